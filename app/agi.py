@@ -0,0 +1,271 @@
+import time
+import asyncio
+import logging
+import argparse
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, unquote, urlsplit
+
+from app.api import lead_lookup
+from app.core.config import settings
+from app.core import metrics
+from app.core.audio_variants import AUDIO_FORMATS
+from app.crud.play_stats import recorder as play_stats
+
+logger = logging.getLogger(__name__)
+
+# FastAGI server for the dialer. Asterisk connects once per lookup, sends its AGI
+# environment, and the server answers with SET VARIABLE commands, so the dialplan
+# reads the results as channel variables with no HTTP request or JSON parsing:
+#
+#   same => n,AGI(agi://127.0.0.1:4573/random_audio/7/no_amd?codec=ulaw)
+#   same => n,GotoIf($["${LOOKUP_STATUS}" != "OK"]?failed)
+#   same => n,Playback(${AUDIO_URL})
+#
+# Scripts mirror the Vicidial HTTP routes and use the same lookup layer:
+#
+#   random_audio/<generation_no>/<audio_type>   sets LEAD_KEY, AUDIO_URL
+#   specific_audio/<lead_key>/<audio_type>      sets AUDIO_URL
+#   random_all_audio/<generation_no>            sets LEAD_KEY, AUDIO_URL_NO_AMD, AUDIO_URL_AMD, ...
+#   all_audio/<lead_key>                        sets AUDIO_URL_NO_AMD, AUDIO_URL_AMD, ...
+#
+# Path segments may also be passed as AGI arguments. LOOKUP_STATUS is always set,
+# to OK, NOT_FOUND, BAD_REQUEST or ERROR.
+#
+# Run the server with `python -m app.agi`, and try it without Asterisk with
+# `python -m app.agi probe random_audio/7/no_amd`.
+
+_READ_TIMEOUT = 10.0
+
+
+class AGIError(Exception):
+    """Asterisk rejected a command or went away."""
+
+
+def _parse_request(env: Dict[str, str]) -> Tuple[str, List[str], Dict[str, str]]:
+    """Splits the requested script into its name, positional arguments and query options."""
+    parts = urlsplit(env.get("agi_network_script", ""))
+    segments = [unquote(segment) for segment in parts.path.strip("/").split("/") if segment]
+    args = []
+    index = 1
+    while f"agi_arg_{index}" in env:
+        args.append(env[f"agi_arg_{index}"])
+        index += 1
+    options = {key: values[-1] for key, values in parse_qs(parts.query).items()}
+    if not segments:
+        return "", args, options
+    return segments[0], segments[1:] + args, options
+
+
+def _codec_option(options: Dict[str, str]) -> Optional[str]:
+    codec = options.get("codec")
+    if codec is None:
+        return None
+    codec = codec.lower()
+    if codec not in AUDIO_FORMATS:
+        raise ValueError(f"unknown codec: {codec}")
+    return codec
+
+
+def _audio_variables(lead, codec: Optional[str]) -> Dict[str, str]:
+    return {key.upper(): url or "" for key, url in lead_lookup.get_all_audio_urls_for_lead(lead, codec).items()}
+
+
+async def _random_audio(args: List[str], codec: Optional[str]) -> Dict[str, str]:
+    if len(args) != 2:
+        raise ValueError("usage: random_audio/<generation_no>/<audio_type>")
+    leads = await lead_lookup.pick_random_leads(generation_no=args[0])
+    if not leads:
+        raise LookupError(f"no completed leads for generation {args[0]}")
+    play_stats.record(leads[0].phone_number)
+    return {"LEAD_KEY": lead_lookup.lead_key_for(leads[0]), "AUDIO_URL": lead_lookup.get_audio_url_for_lead(leads[0], args[1], codec) or ""}
+
+
+async def _specific_audio(args: List[str], codec: Optional[str]) -> Dict[str, str]:
+    if len(args) != 2:
+        raise ValueError("usage: specific_audio/<lead_key>/<audio_type>")
+    lead = await lead_lookup.resolve_lead_key(args[0])
+    if not lead:
+        raise LookupError(f"no lead for key {args[0]}")
+    return {"AUDIO_URL": lead_lookup.get_audio_url_for_lead(lead, args[1], codec) or ""}
+
+
+async def _random_all_audio(args: List[str], codec: Optional[str]) -> Dict[str, str]:
+    if len(args) != 1:
+        raise ValueError("usage: random_all_audio/<generation_no>")
+    leads = await lead_lookup.pick_random_leads(generation_no=args[0])
+    if not leads:
+        raise LookupError(f"no completed leads for generation {args[0]}")
+    play_stats.record(leads[0].phone_number)
+    return {"LEAD_KEY": lead_lookup.lead_key_for(leads[0]), **_audio_variables(leads[0], codec)}
+
+
+async def _all_audio(args: List[str], codec: Optional[str]) -> Dict[str, str]:
+    if len(args) != 1:
+        raise ValueError("usage: all_audio/<lead_key>")
+    lead = await lead_lookup.resolve_lead_key(args[0])
+    if not lead:
+        raise LookupError(f"no lead for key {args[0]}")
+    return _audio_variables(lead, codec)
+
+
+SCRIPTS = {
+    "random_audio": _random_audio,
+    "specific_audio": _specific_audio,
+    "random_all_audio": _random_all_audio,
+    "all_audio": _all_audio,
+}
+
+
+def _quote(value: str) -> str:
+    return '"' + value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", " ") + '"'
+
+
+class AGISession:
+    """One FastAGI connection: reads the environment, runs the script, sets the variables."""
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.reader = reader
+        self.writer = writer
+
+    async def _readline(self) -> str:
+        line = await asyncio.wait_for(self.reader.readline(), _READ_TIMEOUT)
+        if not line:
+            raise AGIError("connection closed")
+        return line.decode("utf-8", "replace").rstrip("\r\n")
+
+    async def read_environment(self) -> Dict[str, str]:
+        env = {}
+        while True:
+            line = await self._readline()
+            if not line:
+                return env
+            key, _, value = line.partition(":")
+            env[key.strip()] = value.strip()
+
+    async def command(self, command: str) -> str:
+        self.writer.write(f"{command}\n".encode("utf-8"))
+        await self.writer.drain()
+        response = await self._readline()
+        if not response.startswith("200"):
+            raise AGIError(f"{command!r} failed: {response}")
+        return response
+
+    async def set_variables(self, variables: Dict[str, str]) -> None:
+        for name, value in variables.items():
+            await self.command(f"SET VARIABLE {name} {_quote(value)}")
+
+    async def run(self) -> None:
+        started = time.perf_counter()
+        env = await self.read_environment()
+        name, args, options = _parse_request(env)
+        status = "OK"
+        variables: Dict[str, str] = {}
+        try:
+            handler = SCRIPTS.get(name)
+            if handler is None:
+                raise ValueError(f"unknown script: {name or '(none)'}")
+            variables = await handler(args, _codec_option(options))
+        except ValueError as e:
+            status = "BAD_REQUEST"
+            logger.warning(f"AGI request {env.get('agi_network_script')!r} rejected: {e}")
+        except LookupError as e:
+            status = "NOT_FOUND"
+            logger.info(f"AGI request {env.get('agi_network_script')!r}: {e}")
+        except Exception as e:
+            status = "ERROR"
+            logger.error(f"AGI request {env.get('agi_network_script')!r} failed: {e}", exc_info=True)
+        await self.set_variables(dict(variables, LOOKUP_STATUS=status))
+        logger.debug(f"AGI {name} answered in {(time.perf_counter() - started) * 1000:.2f} ms ({status}).")
+
+
+async def handle_connection(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    try:
+        await AGISession(reader, writer).run()
+    except (AGIError, asyncio.TimeoutError, ConnectionError) as e:
+        logger.warning(f"AGI session ended early: {e}")
+    finally:
+        writer.close()
+
+
+def serve(host: str, port: int) -> None:
+    loop = asyncio.get_event_loop()
+    server = loop.run_until_complete(asyncio.start_server(handle_connection, host, port))
+    logger.info(f"FastAGI server listening on {host}:{port}.")
+    # Lookups made here show up in the web app's /metrics.
+    metrics.registry.start()
+    try:
+        loop.run_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        loop.run_until_complete(server.wait_closed())
+        # Write out play counts still buffered before the process exits.
+        play_stats.flush()
+        if settings.METRICS_ENABLED:
+            metrics.registry.write_snapshot()
+
+
+# --- Probe client ---
+# Plays Asterisk's side of the protocol, so the server can be tested and timed
+# without a dialer: it sends an AGI environment, answers every command with
+# "200 result=1" and prints the variables that were set.
+
+async def probe(host: str, port: int, script: str, args: List[str], count: int = 1) -> List[Dict[str, str]]:
+    results = []
+    latencies = []
+    for _ in range(count):
+        started = time.perf_counter()
+        reader, writer = await asyncio.open_connection(host, port)
+        env = {
+            "agi_network": "yes",
+            "agi_network_script": script,
+            "agi_request": f"agi://{host}:{port}/{script}",
+            "agi_channel": "SIP/probe-00000001",
+            "agi_type": "SIP",
+            "agi_uniqueid": f"{time.time():.6f}",
+        }
+        env.update((f"agi_arg_{index}", arg) for index, arg in enumerate(args, start=1))
+        writer.write("".join(f"{key}: {value}\n" for key, value in env.items()).encode("utf-8") + b"\n")
+        await writer.drain()
+        variables = {}
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            command = line.decode("utf-8").rstrip("\n")
+            if command.startswith("SET VARIABLE "):
+                name, _, value = command[len("SET VARIABLE "):].partition(" ")
+                variables[name] = value[1:-1].replace('\\"', '"').replace("\\\\", "\\") if value.startswith('"') else value
+            writer.write(b"200 result=1\n")
+            await writer.drain()
+        writer.close()
+        latencies.append(time.perf_counter() - started)
+        results.append(variables)
+    latencies.sort()
+    print(f"{count} lookup(s): p50 {latencies[len(latencies) // 2] * 1000:.3f} ms, max {latencies[-1] * 1000:.3f} ms")
+    return results
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="FastAGI server for Vicidial lead and audio lookups.")
+    parser.add_argument("--host", default=settings.AGI_HOST)
+    parser.add_argument("--port", type=int, default=settings.AGI_PORT)
+    subcommands = parser.add_subparsers(dest="command")
+    probe_parser = subcommands.add_parser("probe", help="Act as Asterisk and run one lookup against a running server.")
+    probe_parser.add_argument("script", help="e.g. random_audio/7/no_amd?codec=ulaw")
+    probe_parser.add_argument("args", nargs="*", help="extra AGI arguments")
+    probe_parser.add_argument("--count", type=int, default=1, help="repeat the lookup and report latency")
+    options = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    if options.command == "probe":
+        results = asyncio.get_event_loop().run_until_complete(probe(options.host, options.port, options.script, options.args, options.count))
+        for name, value in results[-1].items():
+            print(f"{name}={value}")
+        return
+    serve(options.host, options.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,292 @@
+import os
+import time
+import logging
+import mimetypes
+import threading
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Dict, Optional, Tuple
+from starlette.concurrency import run_in_threadpool
+
+from app.core.config import settings
+from app.core.audio_index import load_audio_index
+from app.core.audio_cache import AudioBlobCache
+from app.core import metrics
+from app.crud.lead_pool import read_import_version
+
+logger = logging.getLogger(__name__)
+
+_READ_CHUNK_BYTES = 1024 * 1024
+
+
+def _read_file(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+
+class AudioFile:
+    """Precomputed response metadata for one audio file."""
+    __slots__ = ("path", "size", "etag", "last_modified", "mtime", "content_type")
+
+    def __init__(self, path: str, size: int, mtime: float, etag: str):
+        self.path = path
+        self.size = size
+        self.mtime = int(mtime)
+        self.etag = etag
+        self.last_modified = formatdate(mtime, usegmt=True)
+        self.content_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+
+
+class AudioFiles:
+    """
+    ASGI app serving the deployed audio files, mounted at /audio in place of StaticFiles.
+
+    Validators come from the index the importer writes next to the files, so a
+    conditional request is answered with 304 without opening or even stat-ing the
+    file. Single byte ranges are supported. The body is sent with the server's
+    zero-copy "http.response.zerocopysend" extension (sendfile) when it offers it.
+    Uvicorn does not, so under it files are always read with os.pread in large
+    chunks off the event loop and copied to the socket; AUDIO_CACHE_BYTES, or
+    AUDIO_URL_MODE "asterisk", are the ways to avoid that per-request read.
+
+    With AUDIO_CACHE_BYTES set, whole files are kept in an in-memory LRU cache,
+    which is refilled in the background from the new audio directory whenever a
+    campaign is deployed.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # Serializes reloads, so the last one started reflects the newest deploy.
+        self._reload_lock = threading.Lock()
+        self._files: Dict[str, AudioFile] = {}
+        self._indexed = False
+        self._root = ""
+        self._version: Optional[str] = read_import_version()
+        self._checked_at = time.monotonic()
+        self._cache_control = f"public, max-age={settings.AUDIO_CACHE_MAX_AGE}"
+        self._cache = AudioBlobCache(settings.AUDIO_CACHE_BYTES, settings.AUDIO_CACHE_MAX_FILE_BYTES)
+        self._prewarm_generation = 0
+        self._reload()
+
+    # --- Index management ---
+
+    def _reload(self) -> None:
+        with self._reload_lock:
+            root = os.path.realpath(settings.AUDIO_STORAGE_PATH)
+            index = load_audio_index(root)
+            files = {}
+            if index is not None:
+                for filename, (size, mtime, digest) in index.items():
+                    files[filename] = AudioFile(os.path.join(root, filename), size, mtime, f'"{digest[:32]}"')
+            with self._lock:
+                self._root = root
+                self._files = files
+                self._indexed = index is not None
+                self._prewarm_generation += 1
+        logger.info(f"Audio server loaded {len(files)} indexed files from {root}." if index is not None else f"Audio server found no index in {root}; validators will come from stat().")
+        if self._cache.enabled:
+            self._cache.clear()
+            threading.Thread(target=self._prewarm, args=(self._prewarm_generation, list(files.values())), name="audio-prewarm", daemon=True).start()
+
+    def _prewarm(self, generation: int, audio_files: list) -> None:
+        """Loads the just-deployed audio into the cache until its budget is full."""
+        started = time.perf_counter()
+        loaded = 0
+        for audio_file in audio_files:
+            if generation != self._prewarm_generation:
+                return  # Another campaign was deployed meanwhile; its own prewarm takes over.
+            if not self._cache.cacheable(audio_file.size):
+                continue
+            if not self._cache.has_room(audio_file.size):
+                break
+            try:
+                self._cache.put(audio_file.path, _read_file(audio_file.path))
+            except OSError:
+                continue
+            loaded += 1
+        logger.info(f"Prewarmed audio cache with {loaded} files in {time.perf_counter() - started:.3f}s.")
+
+    def _check_version(self) -> None:
+        now = time.monotonic()
+        if now - self._checked_at < settings.LEAD_POOL_CHECK_INTERVAL:
+            return
+        self._checked_at = now
+        version = read_import_version()
+        if version != self._version:
+            self._version = version
+            # Parsing the index of a large deploy takes a while, so it is done off the
+            # event loop. Until it is swapped in, requests are served from the previous
+            # version, which the importer keeps until the next deploy.
+            threading.Thread(target=self._reload, name="audio-index-reload", daemon=True).start()
+
+    def _lookup(self, filename: str) -> Optional[AudioFile]:
+        audio_file = self._files.get(filename)
+        if audio_file is not None or self._indexed:
+            return audio_file
+        # Deployments imported before the index existed: fall back to stat().
+        path = os.path.join(self._root, filename)
+        try:
+            st = os.stat(path)
+        except (FileNotFoundError, NotADirectoryError):
+            return None
+        audio_file = AudioFile(path, st.st_size, st.st_mtime, f'"{st.st_size:x}-{st.st_mtime_ns:x}"')
+        with self._lock:
+            self._files[filename] = audio_file
+        return audio_file
+
+    def has(self, filename: str) -> bool:
+        self._check_version()
+        return self._lookup(filename) is not None
+
+    def reload_count(self) -> int:
+        """
+        Checks for a newly deployed audio version and returns a counter bumped on
+        every reload, so callers can drop anything derived from the old version.
+        """
+        self._check_version()
+        return self._prewarm_generation
+
+    def stats(self) -> dict:
+        return {"root": self._root, "indexed": self._indexed, "files": len(self._files), "cache": self._cache.stats()}
+
+    # --- Request handling ---
+
+    @staticmethod
+    def _route_path(scope) -> str:
+        path = scope["path"]
+        root_path = scope.get("root_path", "")
+        if root_path and path.startswith(root_path):
+            path = path[len(root_path):]
+        return path.lstrip("/")
+
+    @staticmethod
+    def _parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+        """Parses a single "bytes=" range into (start, end) inclusive. Raises ValueError if unsatisfiable."""
+        unit, _, spec = header.partition("=")
+        if unit.strip() != "bytes" or "," in spec:
+            return None  # Multiple ranges are not supported; the full file is sent instead.
+        start_text, _, end_text = spec.strip().partition("-")
+        if start_text:
+            start = int(start_text)
+            end = int(end_text) if end_text else size - 1
+        else:
+            suffix = int(end_text)
+            if suffix <= 0:
+                raise ValueError("empty suffix range")
+            start, end = max(size - suffix, 0), size - 1
+        end = min(end, size - 1)
+        if start > end or start >= size:
+            raise ValueError("range not satisfiable")
+        return start, end
+
+    def _not_modified(self, headers: Dict[bytes, bytes], audio_file: AudioFile) -> bool:
+        if_none_match = headers.get(b"if-none-match")
+        if if_none_match is not None:
+            tags = [tag.strip() for tag in if_none_match.decode("latin-1").split(",")]
+            return "*" in tags or audio_file.etag in tags or f"W/{audio_file.etag}" in tags
+        if_modified_since = headers.get(b"if-modified-since")
+        if if_modified_since is not None:
+            try:
+                return audio_file.mtime <= parsedate_to_datetime(if_modified_since.decode("latin-1")).timestamp()
+            except (TypeError, ValueError):
+                return False
+        return False
+
+    async def _send_status(self, send, status: int, headers: list, body: bytes = b"") -> None:
+        await send({"type": "http.response.start", "status": status, "headers": headers + [(b"content-length", str(len(body)).encode())]})
+        await send({"type": "http.response.body", "body": body})
+
+    async def __call__(self, scope, receive, send):
+        assert scope["type"] == "http"
+        self._check_version()
+        method = scope["method"]
+        if method not in ("GET", "HEAD"):
+            await self._send_status(send, 405, [(b"allow", b"GET, HEAD")], b"Method Not Allowed")
+            return
+
+        filename = self._route_path(scope)
+        audio_file = None
+        if filename and "/" not in filename and not filename.startswith("."):
+            audio_file = self._lookup(filename)
+        if audio_file is None:
+            await self._send_status(send, 404, [(b"content-type", b"text/plain")], b"Not Found")
+            return
+
+        request_headers = dict(scope["headers"])
+        headers = [
+            (b"etag", audio_file.etag.encode()),
+            (b"last-modified", audio_file.last_modified.encode()),
+            (b"cache-control", self._cache_control.encode()),
+            (b"accept-ranges", b"bytes"),
+        ]
+        if self._not_modified(request_headers, audio_file):
+            await send({"type": "http.response.start", "status": 304, "headers": headers})
+            await send({"type": "http.response.body", "body": b""})
+            return
+
+        status, start, end = 200, 0, audio_file.size - 1
+        range_header = request_headers.get(b"range")
+        if_range = request_headers.get(b"if-range")
+        if range_header is not None and audio_file.size and (if_range is None or if_range.decode("latin-1") == audio_file.etag):
+            try:
+                byte_range = self._parse_range(range_header.decode("latin-1"), audio_file.size)
+            except ValueError:
+                await self._send_status(send, 416, headers + [(b"content-range", f"bytes */{audio_file.size}".encode())])
+                return
+            if byte_range is not None:
+                status, (start, end) = 206, byte_range
+                headers.append((b"content-range", f"bytes {start}-{end}/{audio_file.size}".encode()))
+
+        length = end - start + 1 if audio_file.size else 0
+        headers += [(b"content-type", audio_file.content_type.encode()), (b"content-length", str(length).encode())]
+        if method == "HEAD" or length == 0:
+            await send({"type": "http.response.start", "status": status, "headers": headers})
+            await send({"type": "http.response.body", "body": b""})
+            return
+        if self._cache.cacheable(audio_file.size):
+            await self._send_cached(send, audio_file, status, headers, start, end)
+            return
+        try:
+            f = open(audio_file.path, "rb")
+        except FileNotFoundError:
+            await self._send_status(send, 404, [(b"content-type", b"text/plain")], b"Not Found")
+            return
+        await send({"type": "http.response.start", "status": status, "headers": headers})
+        await self._send_file(scope, send, f, start, length)
+
+    async def _send_cached(self, send, audio_file: AudioFile, status: int, headers: list, start: int, end: int) -> None:
+        data = self._cache.get(audio_file.path)
+        if data is None:
+            try:
+                data = await run_in_threadpool(_read_file, audio_file.path)
+            except FileNotFoundError:
+                await self._send_status(send, 404, [(b"content-type", b"text/plain")], b"Not Found")
+                return
+            self._cache.put(audio_file.path, data)
+        body = data if status == 200 else data[start:end + 1]
+        await send({"type": "http.response.start", "status": status, "headers": headers})
+        await send({"type": "http.response.body", "body": body})
+        metrics.audio_bytes_served.inc("cache", amount=len(body))
+
+    async def _send_file(self, scope, send, f, offset: int, count: int) -> None:
+        with f:
+            if "http.response.zerocopysend" in scope.get("extensions", {}):
+                await send({"type": "http.response.zerocopysend", "file": f, "offset": offset, "count": count})
+                metrics.audio_bytes_served.inc("file", amount=count)
+                return
+            sent = 0
+            fd = f.fileno()
+            while count > 0:
+                chunk = await run_in_threadpool(os.pread, fd, min(_READ_CHUNK_BYTES, count), offset)
+                if not chunk:
+                    break
+                offset += len(chunk)
+                count -= len(chunk)
+                sent += len(chunk)
+                await send({"type": "http.response.body", "body": chunk, "more_body": count > 0})
+            if count > 0:
+                # The file shrank underneath us; end the response rather than hang.
+                await send({"type": "http.response.body", "body": b""})
+            metrics.audio_bytes_served.inc("file", amount=sent)
+
+
+audio_files = AudioFiles()
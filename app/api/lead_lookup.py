@@ -0,0 +1,154 @@
+import os
+import logging
+from json.encoder import encode_basestring_ascii as _encode_json_string
+from typing import Dict, List, Optional, Tuple
+
+from app.db.session import run_db
+from app.crud import lead as lead_crud
+from app.crud.lead_pool import pool as lead_pool
+from app.crud.lead_index import index as lead_index
+from app.core.config import settings
+from app.core import lead_token, metrics
+from app.core.audio_variants import variant_filename
+from app.api.audio import audio_files
+from app.models.lead import Lead
+
+logger = logging.getLogger(__name__)
+
+# Lead and audio lookups shared by the Vicidial HTTP endpoints and the FastAGI
+# server. Database work goes through run_db, which uses the async engine when
+# DB_ASYNC_ENABLED is set and the threadpool otherwise.
+
+AUDIO_TYPES = ("no_amd", "amd", "transfer", "voicemail")
+
+# In "asterisk" mode the lookups return paths Asterisk can play from its own disk,
+# without the extension, so it picks the best format it finds (a transcoded variant
+# if there is one) and never fetches the prompt over HTTP.
+# Without transcoded variants Asterisk would only find the original WAV/MP3 files,
+# which it cannot play unless they happen to be 8 kHz mono, so the mode needs both.
+_ASTERISK_PATHS = settings.AUDIO_URL_MODE == "asterisk" and bool(settings.ASTERISK_SOUNDS_PATH) and bool(settings.AUDIO_TRANSCODE_FORMATS.strip())
+if settings.AUDIO_URL_MODE == "asterisk" and not settings.ASTERISK_SOUNDS_PATH:
+    logger.warning("AUDIO_URL_MODE is 'asterisk' but ASTERISK_SOUNDS_PATH is empty; falling back to HTTP audio URLs.")
+elif settings.AUDIO_URL_MODE == "asterisk" and not settings.AUDIO_TRANSCODE_FORMATS.strip():
+    logger.warning("AUDIO_URL_MODE is 'asterisk' but AUDIO_TRANSCODE_FORMATS is empty, so Asterisk would have no native-format prompts; falling back to HTTP audio URLs.")
+_ASTERISK_SOUNDS_PREFIX = settings.ASTERISK_SOUNDS_PATH.rstrip("/")
+
+async def pick_random_leads(generation_no: str, count: int = 1) -> List:
+    leads = await _pick_random_leads(generation_no, count)
+    # Per-generation hit and 404 rates for /metrics.
+    if settings.METRICS_ENABLED:
+        label = generation_no if leads else await _generation_label(generation_no)
+        metrics.lead_lookups.inc(label, "found" if leads else "not_found")
+    return leads
+
+async def _generation_label(generation_no: str) -> str:
+    """
+    The metrics label of a generation without leads to pick. Only generations in
+    the lead index or the generations catalog get their own; every other number a
+    dialer or scanner asks for is counted as "unknown", so they never add series.
+    """
+    if settings.LEAD_INDEX_ENABLED and lead_index.has_generation(generation_no):
+        return generation_no
+    catalog = lead_pool.catalog_cached()
+    if catalog is None:
+        catalog = await run_db(lead_pool.load_catalog)
+    return generation_no if generation_no in catalog else metrics.UNKNOWN_LABEL
+
+async def _pick_random_leads(generation_no: str, count: int) -> List:
+    """
+    Picks completed leads for new calls. In "deal" mode the next leads of the
+    generation's shuffled rotation are claimed; if no cursor slot is available the
+    pick falls back to random leads, from the compiled lead index or the in-memory
+    pool when they are enabled. Every pick is a single query at most, whatever the count.
+
+    The index answers for every generation it holds. The pool serves the others:
+    generations whose leads completed after the index was last compiled, and all
+    of them while there is no index.
+    """
+    if settings.LEAD_SELECTION_MODE == "deal":
+        leads = await run_db(lead_crud.claim_dealt_leads, generation_no=generation_no, count=count)
+        if leads:
+            return leads
+    if settings.LEAD_INDEX_ENABLED:
+        leads = lead_index.sample(generation_no, count)
+        if leads:
+            return leads
+    if settings.LEAD_POOL_ENABLED:
+        leads = lead_pool.sample_cached(generation_no, count)
+        if leads or lead_pool.is_known_empty(generation_no):
+            return leads
+        return await run_db(lead_pool.sample, generation_no=generation_no, count=count)
+    if count == 1:
+        lead = await run_db(lead_crud.get_random_completed_lead_by_generation, generation_no=generation_no)
+        return [lead] if lead else []
+    return await run_db(lead_crud.get_random_completed_leads_by_generation, generation_no=generation_no, limit=count)
+
+async def resolve_lead_key(lead_key: str):
+    """
+    Finds the lead behind a lead_key: a signed token is decoded, a phone number is
+    looked up in the compiled lead index and then in the database.
+    """
+    if lead_token.is_lead_token(lead_key):
+        return lead_token.decode_lead_token(lead_key)
+    if settings.LEAD_INDEX_ENABLED:
+        lead = lead_index.get(lead_key)
+        if lead:
+            return lead
+    return await run_db(lead_crud.get_lead_by_phone, phone_number=lead_key)
+
+def lead_key_for(lead) -> str:
+    return lead_token.encode_lead_token(lead) if lead_token.tokens_enabled() else lead.phone_number
+
+# Lead attribute holding the audio filename of each audio type.
+_AUDIO_FIELDS = {audio_type: f"audio_filename_{audio_type}" for audio_type in AUDIO_TYPES}
+_HTTP_AUDIO_PREFIX = f"{settings.BASE_URL}/audio/"
+
+def _audio_url(filename: str, codec: Optional[str]) -> str:
+    if _ASTERISK_PATHS:
+        return f"{_ASTERISK_SOUNDS_PREFIX}/{os.path.splitext(filename)[0]}"
+    if codec:
+        variant = variant_filename(filename, codec)
+        if audio_files.has(variant):
+            filename = variant
+    return _HTTP_AUDIO_PREFIX + filename
+
+def get_audio_url_for_lead(lead: Lead, audio_type: str, codec: Optional[str] = None) -> Optional[str]:
+    """
+    Helper function to get the correct audio URL based on audio_type. With a codec,
+    the URL of the transcoded variant is returned if the importer produced one.
+    In "asterisk" mode an absolute path without extension is returned instead.
+    """
+    field = _AUDIO_FIELDS.get(audio_type) or _AUDIO_FIELDS.get(audio_type.lower())
+    filename = getattr(lead, field) if field else None
+    return _audio_url(filename, codec) if filename else None
+
+def get_all_audio_urls_for_lead(lead: Lead, codec: Optional[str] = None) -> dict:
+    return {f"audio_url_{audio_type}": get_audio_url_for_lead(lead, audio_type, codec) for audio_type in AUDIO_TYPES}
+
+# --- Pre-rendered JSON for the dialer's fast path ---
+# The URL of a filename only changes when a new audio version is deployed, so its
+# JSON encoding is rendered once and reused by every lead and request that plays it.
+
+_MAX_RENDERED_URLS = 200000
+_rendered_urls: Dict[Tuple[str, Optional[str]], bytes] = {}
+_rendered_for_reload = audio_files.reload_count()
+
+def json_string(value: Optional[str]) -> bytes:
+    return b"null" if value is None else _encode_json_string(value).encode("ascii")
+
+def audio_url_json(lead: Lead, audio_type: str, codec: Optional[str] = None) -> bytes:
+    """get_audio_url_for_lead, already encoded as a JSON value."""
+    global _rendered_for_reload
+    field = _AUDIO_FIELDS.get(audio_type) or _AUDIO_FIELDS.get(audio_type.lower())
+    filename = getattr(lead, field) if field else None
+    if not filename:
+        return b"null"
+    reloads = audio_files.reload_count()
+    if reloads != _rendered_for_reload or len(_rendered_urls) >= _MAX_RENDERED_URLS:
+        _rendered_urls.clear()
+        _rendered_for_reload = reloads
+    key = (filename, codec)
+    rendered = _rendered_urls.get(key)
+    if rendered is None:
+        rendered = _rendered_urls[key] = json_string(_audio_url(filename, codec))
+    return rendered
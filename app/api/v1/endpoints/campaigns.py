@@ -13,8 +13,9 @@ from celery import group
 # SessionLocal is now used directly in the endpoint
 from app.db.session import SessionLocal
 from app.api.v1 import schemas
-from app.crud import lead as lead_crud
+from app.crud import lead as lead_crud, lead_index, lead_pool
 from app.worker.tasks import process_lead_audio
+from app.worker import importer as import_worker
 from app.core.config import settings
 
 router = APIRouter()
@@ -83,15 +84,17 @@ async def upload_campaign_leads(
     # --- DEFINITIVE FIX: Manual Session for Lead Creation ---
     db = SessionLocal()
     try:
-        created_leads = lead_crud.bulk_create_leads(db=db, df=df, campaign_name=campaign_name, generation_no=generation_no)
-        if not created_leads:
+        # Only the IDs come back, which is all Celery needs.
+        lead_ids = lead_crud.bulk_create_leads(db=db, df=df, campaign_name=campaign_name, generation_no=generation_no)
+        if not lead_ids:
             raise HTTPException(status_code=400, detail="No valid leads found in the uploaded file.")
         
-        # We need the IDs to send to Celery. The objects will expire once the session closes.
-        lead_ids = [str(lead.id) for lead in created_leads]
-        
         # Commit and close the session BEFORE dispatching tasks. This is the key.
         db.commit()
+        # The compiled index no longer matches the leads; lookups use the database until the next import.
+        lead_index.invalidate_lead_index()
+        lead_pool.leads_changed()
+        import_worker.rebuild_lead_index()
     except Exception as e:
         db.rollback()
         raise HTTPException(status_code=500, detail=f"Database error during lead creation: {e}")
@@ -145,6 +148,10 @@ async def delete_leads(payload: schemas.LeadIdList, db: Session = Depends(get_db
     except ValueError:
         raise HTTPException(status_code=400, detail="One or more invalid lead IDs provided.")
     deleted_count = lead_crud.delete_leads_by_ids(db, lead_uuids)
+    lead_index.invalidate_lead_index()
+    # Drops the deleted leads from every worker's lead pool and audio index.
+    lead_pool.leads_changed()
+    import_worker.rebuild_lead_index()
     return {"success_count": deleted_count, "failed_count": len(lead_uuids) - deleted_count, "message": f"Successfully deleted {deleted_count} leads."}
 
 @router.post("/voice-groups", response_model=schemas.VoiceGroup, tags=["Voice Management"])
@@ -1,25 +1,36 @@
 import os
-import shutil
-import subprocess
-import tempfile
+import json
+import time
+import queue
+import hashlib
 import logging
-import uuid
-from fastapi import APIRouter, Depends, HTTPException, Response
-from fastapi.responses import FileResponse
+import threading
+import zipfile
+from typing import List, Optional
+from fastapi import APIRouter, Body, Depends, HTTPException
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
 from datetime import datetime
 
-# --- FIX 1: Import BackgroundTask from Starlette ---
-from starlette.background import BackgroundTask
-
-from sqlalchemy.engine.url import make_url
 from app.db.session import SessionLocal
 from app.core.config import settings
+from app.core import manifest as package_manifest, metrics
+from app.crud import lead as lead_crud
 from app.models.lead import Lead
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
 
+# Packages are generated on the fly and streamed to the client as they are written:
+# leads.csv comes straight from COPY TO STDOUT, audio files are read from
+# AUDIO_STORAGE_PATH into stored (uncompressed) ZIP members, and nothing is staged
+# on disk. A producer thread writes the ZIP into a bounded queue that the response
+# drains, so at most _QUEUE_CHUNKS * _STREAM_CHUNK_BYTES are held in memory.
+
+_STREAM_CHUNK_BYTES = 256 * 1024
+_QUEUE_CHUNKS = 16
+_END_OF_STREAM = object()
+
 def get_db():
     db = SessionLocal()
     try:
@@ -27,88 +38,197 @@ def get_db():
     finally:
         db.close()
 
+class _ExportCancelled(Exception):
+    pass
+
+class _ZipStream:
+    """Write-only, unseekable file object that hands ZIP bytes to the response through a queue."""
+
+    def __init__(self):
+        self._queue = queue.Queue(maxsize=_QUEUE_CHUNKS)
+        self._buffer = bytearray()
+        self._cancelled = threading.Event()
+
+    def write(self, data) -> int:
+        self._buffer += data
+        if len(self._buffer) >= _STREAM_CHUNK_BYTES:
+            self._put(bytes(self._buffer))
+            self._buffer.clear()
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def _put(self, item) -> None:
+        while True:
+            if self._cancelled.is_set():
+                raise _ExportCancelled()
+            try:
+                self._queue.put(item, timeout=1)
+                return
+            except queue.Full:
+                continue
+
+    def finish(self, error: Optional[BaseException] = None) -> None:
+        if self._buffer and error is None:
+            self._put(bytes(self._buffer))
+            self._buffer.clear()
+        self._put(error if error is not None else _END_OF_STREAM)
+
+    def __iter__(self):
+        try:
+            while True:
+                item = self._queue.get()
+                if item is _END_OF_STREAM:
+                    return
+                if isinstance(item, BaseException):
+                    raise item
+                yield item
+        finally:
+            # Also reached when the client disconnects, which stops the producer.
+            self._cancelled.set()
+
+def _get_audio_filenames(db: Session, generation_no: str) -> List[str]:
+    rows = db.query(
+        Lead.audio_filename_no_amd,
+        Lead.audio_filename_amd,
+        Lead.audio_filename_transfer,
+        Lead.audio_filename_voicemail,
+    ).filter(Lead.generation_no == generation_no).all()
+    return list(dict.fromkeys(filename for row in rows for filename in row if filename))
+
+def _hash_files(filenames: List[str]) -> dict:
+    files = {}
+    for filename in filenames:
+        source_path = os.path.join(settings.AUDIO_STORAGE_PATH, filename)
+        if os.path.exists(source_path):
+            files[filename] = package_manifest.file_sha256(source_path)
+    return files
+
+def _write_package(stream: _ZipStream, generation_no: str, manifest: dict, filenames: List[str], lead_ids: Optional[List[str]], hash_files: bool) -> None:
+    """Producer thread: writes the whole package into the stream."""
+    db = SessionLocal()
+    timings = {}
+    try:
+        with zipfile.ZipFile(stream, "w", allowZip64=True) as zip_out:
+            started = time.perf_counter()
+            csv_info = zipfile.ZipInfo("leads.csv", date_time=datetime.now().timetuple()[:6])
+            csv_info.compress_type = zipfile.ZIP_DEFLATED
+            with zip_out.open(csv_info, "w", force_zip64=True) as entry:
+                lead_crud.copy_leads_to_csv(db, entry, generation_no=generation_no, lead_ids=lead_ids)
+            db.rollback()
+            timings["leads_csv"] = time.perf_counter() - started
+
+            started = time.perf_counter()
+            files_written = 0
+            for filename in filenames:
+                source_path = os.path.join(settings.AUDIO_STORAGE_PATH, filename)
+                try:
+                    info = zipfile.ZipInfo.from_file(source_path, arcname=f"audio/{filename}")
+                except FileNotFoundError:
+                    continue
+                info.compress_type = zipfile.ZIP_STORED
+                digest = hashlib.sha256()
+                with open(source_path, "rb") as src, zip_out.open(info, "w") as entry:
+                    for chunk in iter(lambda: src.read(_STREAM_CHUNK_BYTES), b""):
+                        entry.write(chunk)
+                        if hash_files:
+                            digest.update(chunk)
+                if hash_files:
+                    manifest["files"][filename] = digest.hexdigest()
+                files_written += 1
+            timings["audio"] = time.perf_counter() - started
+
+            # Written last, so file hashes can be taken while the audio streams out.
+            zip_out.writestr(package_manifest.MANIFEST_FILENAME, json.dumps(manifest), compress_type=zipfile.ZIP_DEFLATED)
+        stream.finish()
+        for name, seconds in timings.items():
+            metrics.export_phase_seconds.observe(seconds, name)
+        logger.info(f"Streamed package for generation {generation_no}: {files_written} audio files; " + ", ".join(f"{name} {seconds:.3f}s" for name, seconds in timings.items()))
+    except _ExportCancelled:
+        logger.warning(f"Client disconnected during export of generation {generation_no}.")
+    except Exception as e:
+        logger.error(f"An unexpected error occurred while streaming the package: {e}", exc_info=True)
+        try:
+            stream.finish(error=e)
+        except _ExportCancelled:
+            pass
+    finally:
+        db.close()
+
+def _export_package(db: Session, generation_no: str, base_manifest: Optional[dict] = None) -> StreamingResponse:
+    """
+    Streams a campaign package for a generation. With a base_manifest (the manifest
+    deployed on the target server) only the leads and audio files that differ
+    from it are included, and the package is marked as a delta.
+    """
+    first_lead = db.query(Lead.campaign_name).filter(Lead.generation_no == generation_no).first()
+    if not first_lead:
+        raise HTTPException(status_code=404, detail=f"No leads found for generation number: {generation_no}")
+
+    campaign_name = first_lead.campaign_name or ""
+    filenames = _get_audio_filenames(db, generation_no)
+    manifest = {
+        "format": package_manifest.MANIFEST_FORMAT,
+        "generation_no": generation_no,
+        "delta": False,
+        "base_manifest": None,
+        "files": {},
+        "leads": lead_crud.get_lead_row_hashes(db, generation_no=generation_no),
+    }
+
+    lead_ids = None
+    hash_files = True
+    if base_manifest is not None:
+        try:
+            package_manifest.validate_manifest(base_manifest)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=f"Invalid base manifest: {e}")
+        # A delta has to know which files changed before it starts, so hash them up front.
+        manifest["files"] = _hash_files(filenames)
+        hash_files = False
+        lead_ids = package_manifest.diff_manifest(manifest["leads"], base_manifest["leads"])
+        filenames = package_manifest.diff_manifest(manifest["files"], base_manifest["files"])
+        manifest["delta"] = True
+        manifest["base_manifest"] = package_manifest.manifest_digest(base_manifest)
+        logger.info(f"Delta export: {len(lead_ids)} of {len(manifest['leads'])} leads and {len(filenames)} of {len(manifest['files'])} audio files changed.")
+
+    timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
+    safe_campaign_name = "".join(c for c in campaign_name if c.isalnum() or c in (' ', '_')).rstrip()
+    suffix = "_delta" if base_manifest is not None else ""
+    zip_filename = f"{safe_campaign_name}_{generation_no}_{timestamp}{suffix}.zip"
+
+    stream = _ZipStream()
+    threading.Thread(
+        target=_write_package,
+        args=(stream, generation_no, manifest, filenames, lead_ids, hash_files),
+        name="package-export",
+        daemon=True,
+    ).start()
+    return StreamingResponse(
+        iter(stream),
+        media_type='application/zip',
+        headers={"Content-Disposition": f'attachment; filename="{zip_filename}"'},
+    )
+
 @router.get("/package/{generation_no}", summary="Export Campaign as ZIP Package")
 def export_campaign_package(generation_no: str, db: Session = Depends(get_db)):
     """
     Exports all leads and their corresponding audio files for a given
     generation_no into a single downloadable ZIP file.
 
-    This package contains a database dump (.sql) and all associated audio.
+    This package contains the leads as `leads.csv`, all associated audio, and a
+    `manifest.json` of content hashes that makes later delta packages possible.
+    The archive is streamed as it is generated, so the download starts at once.
     """
-    leads = db.query(Lead).filter(Lead.generation_no == generation_no).all()
-    if not leads:
-        raise HTTPException(status_code=404, detail=f"No leads found for generation number: {generation_no}")
-
-    campaign_name = leads[0].campaign_name
+    return _export_package(db, generation_no)
 
-    with tempfile.TemporaryDirectory() as temp_dir:
-        sql_dump_path = os.path.join(temp_dir, "leads_dump.sql")
-        audio_dir = os.path.join(temp_dir, "audio")
-        os.makedirs(audio_dir, exist_ok=True)
-        
-        try:
-            db_url = make_url(settings.DATABASE_URL)
-            pg_dump_command = [
-                'pg_dump',
-                '--data-only',
-                '--inserts',
-                '--table=leads',
-                f'--dbname={db_url.database}',
-                f'--host={db_url.host or "localhost"}',
-                f'--port={str(db_url.port or 5432)}',
-                f'--username={db_url.username}',
-                f'--file={sql_dump_path}',
-            ]
-            
-            env = os.environ.copy()
-            if db_url.password:
-                env['PGPASSWORD'] = db_url.password
-
-            logger.info("Executing pg_dump command for 'leads' table...")
-            result = subprocess.run(pg_dump_command, env=env, capture_output=True, text=True)
-
-            if result.returncode != 0:
-                logger.error(f"pg_dump failed. stderr: {result.stderr}")
-                raise HTTPException(status_code=500, detail=f"Database dump failed: {result.stderr}")
-
-            logger.info(f"Successfully created SQL dump at: {sql_dump_path}")
-
-        except Exception as e:
-            logger.error(f"An unexpected error occurred during pg_dump: {e}")
-            raise HTTPException(status_code=500, detail=f"An unexpected error occurred during database dump: {e}")
-
-        files_copied = 0
-        for lead in leads:
-            for filename in [lead.audio_filename_no_amd, lead.audio_filename_amd, lead.audio_filename_transfer, lead.audio_filename_voicemail]:
-                if filename:
-                    source_path = os.path.join(settings.AUDIO_STORAGE_PATH, filename)
-                    dest_path = os.path.join(audio_dir, filename)
-                    if os.path.exists(source_path):
-                        shutil.copy2(source_path, dest_path)
-                        files_copied += 1
-        logger.info(f"Copied {files_copied} audio files to the package.")
-
-        timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
-        safe_campaign_name = "".join(c for c in campaign_name if c.isalnum() or c in (' ', '_')).rstrip()
-        zip_filename = f"{safe_campaign_name}_{generation_no}_{timestamp}.zip"
-        
-        zip_temp_path = os.path.join(tempfile.gettempdir(), uuid.uuid4().hex)
-
-        shutil.make_archive(
-            base_name=zip_temp_path,
-            format='zip',
-            root_dir=temp_dir
-        )
-        final_zip_path = f"{zip_temp_path}.zip"
-        logger.info(f"Successfully created ZIP package at: {final_zip_path}")
-
-        # --- FIX 2: Use BackgroundTask to safely schedule the file deletion ---
-        # This guarantees the file is deleted ONLY AFTER the response is sent.
-        cleanup_task = BackgroundTask(os.remove, final_zip_path)
-
-        return FileResponse(
-            path=final_zip_path,
-            filename=zip_filename,
-            media_type='application/zip',
-            background=cleanup_task
-        )
\ No newline at end of file
+@router.post("/package/{generation_no}/delta", summary="Export Changes Since a Deployed Manifest")
+def export_campaign_delta(generation_no: str, base_manifest: dict = Body(...), db: Session = Depends(get_db)):
+    """
+    Exports only what changed for a generation since the deployment described by
+    **base_manifest**, the JSON returned by the target server's
+    `/api/v1/importer/manifest`. Leads and audio files whose hashes match the base
+    are left out; the importer reuses its own copies of them.
+    """
+    return _export_package(db, generation_no, base_manifest=base_manifest)
@@ -3,11 +3,10 @@ import logging
 from fastapi import APIRouter, Depends, Request
 from fastapi.templating import Jinja2Templates
 from sqlalchemy.orm import Session
-from sqlalchemy import distinct
 
 from app.db.session import SessionLocal
 from app.crud import lead as lead_crud
-from app.models.lead import Lead
+from app.models.lead import LeadStatus
 
 # --- START: ROBUST TEMPLATE PATH DISCOVERY & LOGGING ---
 # Configure logging to be more visible
@@ -59,7 +58,12 @@ async def read_main(request: Request, db: Session = Depends(get_db)):
 
 @router.get("/dashboard", tags=["Frontend"], include_in_schema=False)
 async def read_dashboard(request: Request, db: Session = Depends(get_db)):
-    return templates.TemplateResponse("dashboard.html", {"request": request, "leads": lead_crud.get_leads(db=db, limit=500)})
+    # The page loads its leads from /api/v1/leads as it is scrolled.
+    return templates.TemplateResponse("dashboard.html", {
+        "request": request,
+        "statuses": [status.value for status in LeadStatus],
+        "generations": lead_crud.get_generations(db),
+    })
 
 @router.get("/voices", tags=["Frontend"], include_in_schema=False)
 async def read_voices_dashboard(request: Request, db: Session = Depends(get_db)):
@@ -74,11 +78,11 @@ async def read_export_page(request: Request, db: Session = Depends(get_db)):
         # Return an error instead of a blank page.
         return {"error": f"Template file not found at {export_template_path}"}, 500
 
-    results = db.query(distinct(Lead.generation_no)).filter(Lead.generation_no.isnot(None)).order_by(Lead.generation_no).all()
-    generation_numbers = [res[0] for res in results]
+    generations = lead_crud.get_generations(db)
+    generation_numbers = [generation.generation_no for generation in generations]
     logger.info(f"DATABASE QUERY: Found generation numbers: {generation_numbers}")
     
-    return templates.TemplateResponse("export.html", {"request": request, "generation_numbers": generation_numbers})
+    return templates.TemplateResponse("export.html", {"request": request, "generation_numbers": generation_numbers, "generations": generations})
 
 # Add this function to your frontend.py file
 
@@ -1,107 +1,48 @@
-import os
-import shutil
-import tempfile
 import logging
-import zipfile
-import csv
-import json
-import uuid
-from fastapi import APIRouter, Depends, UploadFile, File, HTTPException
-from sqlalchemy.orm import Session
-from sqlalchemy import text
-from app.db.session import SessionLocal
-from app.core.config import settings
-from app.models.lead import Lead, LeadStatus
+from fastapi import APIRouter, UploadFile, File, HTTPException
+from starlette.concurrency import run_in_threadpool
+from app.core import manifest as package_manifest
+from app.worker import importer as import_worker
 
 router = APIRouter()
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+@router.post("/upload", status_code=202, summary="Import and Deploy Campaign Package")
+async def import_campaign_package(package: UploadFile = File(...)):
+    """
+    Accepts a campaign package and queues it for import.
 
-@router.post("/upload", summary="Import and Deploy Campaign Package")
-async def import_campaign_package(db: Session = Depends(get_db), package: UploadFile = File(...)):
+    The import runs in a background worker thread, so this returns at once with
+    a **job_id**. Poll `/api/v1/importer/jobs/{job_id}` for its progress.
+    """
     if not package.filename.endswith('.zip'):
         raise HTTPException(status_code=400, detail="Invalid file type. Please upload a .zip package.")
 
-    with tempfile.TemporaryDirectory() as temp_dir:
-        zip_path = os.path.join(temp_dir, "package.zip")
-        with open(zip_path, "wb") as buffer:
-            shutil.copyfileobj(package.file, buffer)
-
-        logger.info("Extracting campaign package...")
-        with zipfile.ZipFile(zip_path, 'r') as zip_ref:
-            zip_ref.extractall(temp_dir)
-        
-        csv_dump_path = os.path.join(temp_dir, "leads.csv")
-        extracted_audio_dir = os.path.join(temp_dir, "audio")
-
-        if not os.path.exists(csv_dump_path):
-            raise HTTPException(status_code=400, detail="Package is invalid: leads.csv not found.")
-
-        try:
-            logger.info("Wiping existing leads and audio files...")
-            db.execute(text('TRUNCATE TABLE leads RESTART IDENTITY'))
-            db.commit()
-
-            audio_path = settings.AUDIO_STORAGE_PATH
-            if os.path.isdir(audio_path):
-                shutil.rmtree(audio_path)
-            os.makedirs(audio_path, exist_ok=True)
-            
-            logger.info("Importing new leads from CSV file...")
-            leads_to_create = []
-            with open(csv_dump_path, 'r', encoding='utf-8') as csvfile:
-                reader = csv.DictReader(csvfile)
-                for row in reader:
-                    new_lead = Lead(
-                        id=uuid.UUID(row['id']),
-                        phone_number=row['phone_number'],
-                        campaign_name=row['campaign_name'],
-                        generation_no=row.get('generation_no') or None,
-                        lead_data=json.loads(row['lead_data']),
-                        status=LeadStatus(row['status']),
-                        audio_filename_no_amd=row.get('audio_filename_no_amd') or None,
-                        audio_filename_amd=row.get('audio_filename_amd') or None,
-                        audio_filename_transfer=row.get('audio_filename_transfer') or None,
-                        audio_filename_voicemail=row.get('audio_filename_voicemail') or None,
-                        llm_input_no_amd=row.get('llm_input_no_amd') or None,
-                        llm_output_no_amd=row.get('llm_output_no_amd') or None,
-                        llm_input_amd=row.get('llm_input_amd') or None,
-                        llm_output_amd=row.get('llm_output_amd') or None,
-                        llm_input_transfer=row.get('llm_input_transfer') or None,
-                        llm_output_transfer=row.get('llm_output_transfer') or None,
-                        llm_input_voicemail=row.get('llm_input_voicemail') or None,
-                        llm_output_voicemail=row.get('llm_output_voicemail') or None,
-                        created_at=row.get('created_at') or None,
-                        updated_at=row.get('updated_at') or None
-                    )
-                    leads_to_create.append(new_lead)
-            
-            if leads_to_create:
-                db.add_all(leads_to_create)
-                db.commit()
-            
-            lead_count = len(leads_to_create)
-            logger.info(f"VERIFICATION: Successfully created {lead_count} leads in the database.")
-
-            # --- FIX: Use a more compatible method for copying files that works in Python 3.6 ---
-            logger.info("Moving new audio files into place...")
-            if os.path.isdir(extracted_audio_dir):
-                for filename in os.listdir(extracted_audio_dir):
-                    source_file = os.path.join(extracted_audio_dir, filename)
-                    destination_file = os.path.join(audio_path, filename)
-                    shutil.copy2(source_file, destination_file) # copy2 is a robust copy command
-            logger.info("Audio files successfully moved.")
-
-        except Exception as e:
-            db.rollback()
-            logger.error(f"A critical error occurred during import: {e}", exc_info=True)
-            raise HTTPException(status_code=500, detail=str(e))
-
-    return {"message": f"Campaign package imported. Verified {lead_count} leads in the database."}
\ No newline at end of file
+    # Writing the upload to disk is blocking I/O, so keep it off the event loop as well.
+    job = await run_in_threadpool(import_worker.start_import, package.file)
+    logger.info(f"Queued campaign import job {job.id}.")
+    return {"job_id": job.id, "message": "Campaign package uploaded. Import has started."}
+
+@router.get("/jobs/{job_id}", summary="Get Import Job Progress")
+def get_import_job(job_id: str):
+    """
+    Reports an import job's **status** (queued, running, completed or failed),
+    its current **phase**, and how long each finished phase took.
+    """
+    job = import_worker.get_job(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail=f"Import job not found: {job_id}")
+    return job
+
+@router.get("/manifest", summary="Get Deployed Campaign Manifest")
+def get_deployed_manifest():
+    """
+    Returns the manifest of the campaign currently deployed on this server.
+    Send it to the exporter's delta endpoint to build a package that contains
+    only what changed since this deployment.
+    """
+    manifest = package_manifest.load_deployed_manifest()
+    if manifest is None:
+        raise HTTPException(status_code=404, detail="The deployed campaign has no manifest. Import a full package first.")
+    return manifest
@@ -0,0 +1,77 @@
+import json
+import uuid
+import base64
+import binascii
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy.orm import Session
+
+from app.db.session import SessionLocal
+from app.api.v1 import schemas
+from app.crud import lead as lead_crud
+from app.models.lead import LeadStatus
+
+router = APIRouter()
+
+MAX_PAGE_SIZE = 500
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+_MICROSECOND = timedelta(microseconds=1)
+
+def get_db():
+    db = SessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+def _encode_cursor(created_at: datetime, lead_id: uuid.UUID) -> str:
+    # created_at as whole microseconds since the epoch: exact, and parsed back without fromisoformat.
+    payload = json.dumps([(created_at - _EPOCH) // _MICROSECOND, str(lead_id)], separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii").rstrip("=")
+
+def _decode_cursor(cursor: str):
+    try:
+        payload = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        created_at, lead_id = json.loads(payload.decode("utf-8"))
+        if not isinstance(created_at, int) or not isinstance(lead_id, str):
+            raise ValueError("unexpected cursor fields")
+        return _EPOCH + created_at * _MICROSECOND, uuid.UUID(lead_id)
+    except (binascii.Error, ValueError, TypeError, AttributeError, OverflowError):
+        raise HTTPException(status_code=400, detail="Invalid cursor.")
+
+@router.get("/generations", response_model=List[schemas.GenerationSummary], summary="List Generations")
+def list_generations(db: Session = Depends(get_db)):
+    """Lists every generation with its lead counts per status and audio totals, from the generations catalog."""
+    return lead_crud.get_generations(db)
+
+@router.get("", response_model=schemas.LeadPageResponse, summary="List Leads")
+def list_leads(
+    generation_no: Optional[str] = None,
+    status: Optional[LeadStatus] = None,
+    phone_prefix: Optional[str] = Query(None, max_length=32),
+    limit: int = Query(100, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    db: Session = Depends(get_db),
+):
+    """
+    Lists leads newest first, filtered by **generation_no**, **status** and
+    **phone_prefix**, one page at a time.
+
+    Pages are keyed on (created_at, id) rather than an offset, so later pages
+    are as fast as the first. Only the columns the dashboard shows are read.
+    """
+    after = _decode_cursor(cursor) if cursor else None
+    filters = dict(generation_no=generation_no, status=status, phone_prefix=phone_prefix)
+    rows = lead_crud.list_leads_page(db, limit=limit + 1, after=after, **filters)
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = _encode_cursor(last.created_at, last.id)
+    return {
+        "leads": [dict(row._mapping) for row in rows],
+        "next_cursor": next_cursor,
+        "estimated_total": lead_crud.estimate_lead_count(db, **filters),
+    }
@@ -0,0 +1,14 @@
+from fastapi import APIRouter, HTTPException
+from fastapi.responses import PlainTextResponse
+
+from app.core import metrics
+from app.core.config import settings
+
+router = APIRouter()
+
+@router.get("/metrics", include_in_schema=False)
+def get_metrics():
+    """Every worker's metrics, merged, in the Prometheus text exposition format."""
+    if not settings.METRICS_ENABLED:
+        raise HTTPException(status_code=404, detail="Metrics are disabled.")
+    return PlainTextResponse(metrics.registry.render(), media_type="text/plain; version=0.0.4")
@@ -1,63 +1,92 @@
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, HTTPException, Query
+from fastapi.responses import Response
 from typing import Optional
 
-from app.db.session import SessionLocal
-from app.api.v1 import schemas
-from app.crud import lead as lead_crud
+from app.db.session import pool_stats
 from app.core.config import settings
-from app.models.lead import Lead
+from app.api.v1 import schemas
+from app.api import lead_lookup
+from app.crud.play_stats import recorder as play_stats
+from app.core.audio_variants import AUDIO_FORMATS
+from app.api.audio import audio_files
+from app.crud.lead_index import index as lead_index
 
 router = APIRouter()
 
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
-def _get_audio_url_for_lead(lead: Lead, audio_type: str) -> Optional[str]:
-    """Helper function to get the correct audio URL based on audio_type."""
-    filename_map = {
-        "no_amd": lead.audio_filename_no_amd,
-        "amd": lead.audio_filename_amd,
-        "transfer": lead.audio_filename_transfer,
-        "voicemail": lead.audio_filename_voicemail,
-    }
-    filename = filename_map.get(audio_type.lower())
-    if filename:
-        return f"{settings.BASE_URL}/audio/{filename}"
-    return None
+# The handlers below are `async def` so a call start that is answered from memory
+# never borrows a threadpool thread. The lookups themselves live in
+# app/api/lead_lookup.py, which the FastAGI server (app/agi.py) shares.
+
+MAX_BATCH_SIZE = 1000
+
+_CODEC_QUERY = Query(None, description=f"Return the importer's pre-transcoded variant for this codec ({', '.join(AUDIO_FORMATS)}) when it exists.")
+
+# --- Fast path ---
+# With VICIDIAL_FAST_RESPONSES the handlers return the JSON body as bytes, assembled
+# from pre-rendered keys and the URL fragments lead_lookup caches per audio file.
+# FastAPI sends a returned Response as is, so nothing is validated or re-encoded;
+# the response models still document the contract, and the body matches them.
+
+_ALL_AUDIO_KEYS = [(audio_type, f',"audio_url_{audio_type}":'.encode("ascii")) for audio_type in lead_lookup.AUDIO_TYPES]
+
+def _json_response(body: bytes) -> Response:
+    return Response(content=body, media_type="application/json")
+
+def _lead_urls_json(lead_key: str, lead, codec: Optional[str]) -> bytes:
+    parts = [b'{"lead_key":', lead_lookup.json_string(lead_key)]
+    for audio_type, key in _ALL_AUDIO_KEYS:
+        parts.append(key)
+        parts.append(lead_lookup.audio_url_json(lead, audio_type, codec))
+    parts.append(b"}")
+    return b"".join(parts)
+
+def _check_codec(codec: Optional[str]) -> Optional[str]:
+    if codec is None:
+        return None
+    codec = codec.lower()
+    if codec not in AUDIO_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unknown codec: {codec}. Expected one of: {', '.join(AUDIO_FORMATS)}")
+    return codec
 
 @router.get(
     "/random_audio/{generation_no}/{audio_type}",
     response_model=schemas.RandomAudioResponse,
     summary="Get Random Lead Audio for a Generation"
 )
-def get_random_audio(
+async def get_random_audio(
     generation_no: str,
     audio_type: str,
-    db: Session = Depends(get_db)
+    codec: Optional[str] = _CODEC_QUERY
 ):
     """
     Called once at the start of a Vicidial call.
 
     - Finds a random, completed lead for the specified **generation_no**.
     - Returns the URL for the requested **audio_type** and a **lead_key**.
-    - The **lead_key** (phone number) MUST be stored by Vicidial in a channel
+    - With **codec** (ulaw, alaw or slin) the URL points at the importer's
+      pre-transcoded variant, so Asterisk can play it without transcoding.
+    - The **lead_key** (phone number, or a signed token when LEAD_KEY_MODE is
+      "token") MUST be stored by Vicidial in a channel
       variable to be used for subsequent requests for the same call.
     """
-    lead = lead_crud.get_random_completed_lead_by_generation(db, generation_no=generation_no)
-    
-    if not lead:
+    codec = _check_codec(codec)
+    leads = await lead_lookup.pick_random_leads(generation_no=generation_no)
+
+    if not leads:
         raise HTTPException(status_code=404, detail=f"No completed leads found for generation number: {generation_no}")
 
-    audio_url = _get_audio_url_for_lead(lead, audio_type)
+    lead = leads[0]
+    play_stats.record(lead.phone_number)
+    if settings.VICIDIAL_FAST_RESPONSES:
+        return _json_response(
+            b'{"audio_url":' + lead_lookup.audio_url_json(lead, audio_type, codec)
+            + b',"lead_key":' + lead_lookup.json_string(lead_lookup.lead_key_for(lead)) + b"}"
+        )
+    audio_url = lead_lookup.get_audio_url_for_lead(lead, audio_type, codec)
 
     return {
         "audio_url": audio_url,
-        "lead_key": lead.phone_number
+        "lead_key": lead_lookup.lead_key_for(lead)
     }
 
 @router.get(
@@ -65,24 +94,113 @@ def get_random_audio(
     response_model=schemas.SpecificAudioResponse,
     summary="Get Specific Lead Audio by Key"
 )
-def get_specific_audio(
+async def get_specific_audio(
     lead_key: str,
     audio_type: str,
-    db: Session = Depends(get_db)
+    codec: Optional[str] = _CODEC_QUERY
 ):
     """
     Called for all subsequent audio requests during a single Vicidial call.
 
-    - Uses the **lead_key** (the phone number) from the first API call to find the exact lead.
+    - Uses the **lead_key** from the first API call to find the exact lead.
+      A signed lead token is resolved without touching the database; a plain
+      phone number is looked up as before.
     - Returns the URL for the new requested **audio_type**.
     """
-    lead = lead_crud.get_lead_by_phone(db, phone_number=lead_key)
+    codec = _check_codec(codec)
+    lead = await lead_lookup.resolve_lead_key(lead_key)
 
     if not lead:
         raise HTTPException(status_code=404, detail=f"No lead found for key: {lead_key}")
 
-    audio_url = _get_audio_url_for_lead(lead, audio_type)
+    if settings.VICIDIAL_FAST_RESPONSES:
+        return _json_response(b'{"audio_url":' + lead_lookup.audio_url_json(lead, audio_type, codec) + b"}")
+    audio_url = lead_lookup.get_audio_url_for_lead(lead, audio_type, codec)
 
     return {
         "audio_url": audio_url
-    }
\ No newline at end of file
+    }
+
+@router.get(
+    "/random_all_audio/{generation_no}",
+    response_model=schemas.LeadAudioUrlsResponse,
+    summary="Get All Audio URLs for a Random Lead"
+)
+async def get_random_all_audio(generation_no: str, codec: Optional[str] = _CODEC_QUERY):
+    """
+    Called once at the start of a Vicidial call, instead of one request per audio type.
+
+    - Picks a completed lead for **generation_no** exactly like `random_audio`.
+    - Returns the **lead_key** and the URLs of all four audio types in one response.
+    """
+    codec = _check_codec(codec)
+    leads = await lead_lookup.pick_random_leads(generation_no=generation_no)
+
+    if not leads:
+        raise HTTPException(status_code=404, detail=f"No completed leads found for generation number: {generation_no}")
+
+    lead = leads[0]
+    play_stats.record(lead.phone_number)
+    if settings.VICIDIAL_FAST_RESPONSES:
+        return _json_response(_lead_urls_json(lead_lookup.lead_key_for(lead), lead, codec))
+    return {"lead_key": lead_lookup.lead_key_for(lead), **lead_lookup.get_all_audio_urls_for_lead(lead, codec)}
+
+@router.get(
+    "/all_audio/{lead_key}",
+    response_model=schemas.LeadAudioUrlsResponse,
+    summary="Get All Audio URLs for a Lead Key"
+)
+async def get_all_audio(lead_key: str, codec: Optional[str] = _CODEC_QUERY):
+    """
+    Returns the URLs of all four audio types for a **lead_key** returned by an earlier call.
+    """
+    codec = _check_codec(codec)
+    lead = await lead_lookup.resolve_lead_key(lead_key)
+
+    if not lead:
+        raise HTTPException(status_code=404, detail=f"No lead found for key: {lead_key}")
+
+    if settings.VICIDIAL_FAST_RESPONSES:
+        return _json_response(_lead_urls_json(lead_key, lead, codec))
+    return {"lead_key": lead_key, **lead_lookup.get_all_audio_urls_for_lead(lead, codec)}
+
+@router.get(
+    "/random_batch/{generation_no}",
+    response_model=schemas.RandomBatchResponse,
+    summary="Reserve a Batch of Random Leads"
+)
+async def get_random_batch(generation_no: str, count: int = Query(10, ge=1, le=MAX_BATCH_SIZE), codec: Optional[str] = _CODEC_QUERY):
+    """
+    Reserves up to **count** completed leads for **generation_no** with a single
+    lookup, so a dialer script or local proxy can pre-stage a batch of calls.
+
+    - Each entry has a **lead_key** and all four audio URLs.
+    - Fewer than **count** leads are returned when the generation is smaller.
+    """
+    codec = _check_codec(codec)
+    leads = await lead_lookup.pick_random_leads(generation_no=generation_no, count=count)
+
+    if not leads:
+        raise HTTPException(status_code=404, detail=f"No completed leads found for generation number: {generation_no}")
+
+    for lead in leads:
+        play_stats.record(lead.phone_number)
+    if settings.VICIDIAL_FAST_RESPONSES:
+        return _json_response(
+            b'{"generation_no":' + lead_lookup.json_string(generation_no) + b',"leads":['
+            + b",".join(_lead_urls_json(lead_lookup.lead_key_for(lead), lead, codec) for lead in leads) + b"]}"
+        )
+    return {
+        "generation_no": generation_no,
+        "leads": [{"lead_key": lead_lookup.lead_key_for(lead), **lead_lookup.get_all_audio_urls_for_lead(lead, codec)} for lead in leads],
+    }
+
+@router.get("/stats", summary="Worker Statistics")
+def get_stats():
+    """
+    Reports the database connection pools of this worker: size, connections in
+    use, overflow, and how long checkouts have waited for a free connection.
+    Also reports which audio version the audio server is serving and its
+    in-memory cache hit rate, and the size and hit count of the mapped lead index.
+    """
+    return {"db_pool": pool_stats(), "audio": audio_files.stats(), "lead_index": lead_index.stats()}
@@ -1,5 +1,6 @@
 from pydantic import BaseModel, Field
 from typing import Optional, List
+from datetime import datetime
 import uuid
 
 class CampaignUploadResponse(BaseModel):
@@ -75,4 +76,64 @@ class SpecificAudioResponse(BaseModel):
     Response for subsequent calls for a specific lead.
     It only needs to return the requested audio URL.
     """
-    audio_url: Optional[str]
\ No newline at end of file
+    audio_url: Optional[str]
+
+class LeadAudioUrlsResponse(BaseModel):
+    """
+    All four audio URLs for one lead, plus the key to use for any
+    follow-up requests during the same call.
+    """
+    lead_key: str
+    audio_url_no_amd: Optional[str] = None
+    audio_url_amd: Optional[str] = None
+    audio_url_transfer: Optional[str] = None
+    audio_url_voicemail: Optional[str] = None
+
+class RandomBatchResponse(BaseModel):
+    """A batch of leads reserved for a generation, for pre-staging several calls at once."""
+    generation_no: str
+    leads: List[LeadAudioUrlsResponse]
+
+
+# --- LEADS API ---
+
+class LeadListItem(BaseModel):
+    id: uuid.UUID
+    phone_number: str
+    campaign_name: Optional[str] = None
+    generation_no: Optional[str] = None
+    status: str
+    audio_filename_no_amd: Optional[str] = None
+    audio_filename_amd: Optional[str] = None
+    audio_filename_transfer: Optional[str] = None
+    audio_filename_voicemail: Optional[str] = None
+    play_count: int = 0
+    last_played_at: Optional[datetime] = None
+    created_at: Optional[datetime] = None
+
+class LeadPageResponse(BaseModel):
+    """
+    One page of leads, newest first. Pass **next_cursor** back as `cursor` to get
+    the next page; it is null on the last page. **estimated_total** is exact when
+    filtering by generation and status only, and the planner's estimate otherwise.
+    """
+    leads: List[LeadListItem]
+    next_cursor: Optional[str] = None
+    estimated_total: int
+
+class GenerationSummary(BaseModel):
+    """A generation's entry in the catalog the importer maintains."""
+    generation_no: str
+    campaign_name: Optional[str] = None
+    lead_count: int
+    pending_count: int
+    processing_count: int
+    completed_count: int
+    failed_count: int
+    audio_file_count: int
+    audio_bytes: int
+    imported_at: Optional[datetime] = None
+    updated_at: Optional[datetime] = None
+
+    class Config:
+        from_attributes = True
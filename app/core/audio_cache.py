@@ -0,0 +1,77 @@
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+
+class AudioBlobCache:
+    """
+    Byte-budgeted LRU cache of whole audio files, keyed by absolute path.
+
+    Paths include the audio version directory, so entries from a replaced campaign
+    can never be served for a new one; they simply age out, or are dropped by clear().
+    Files larger than max_file_bytes are never cached. A budget of 0 disables the cache.
+    """
+
+    def __init__(self, max_bytes: int, max_file_bytes: int):
+        self.max_bytes = max_bytes
+        self.max_file_bytes = max_file_bytes
+        self._entries: "OrderedDict[str, bytes]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def cacheable(self, size: int) -> bool:
+        return self.enabled and size <= min(self.max_file_bytes, self.max_bytes)
+
+    def get(self, path: str) -> Optional[bytes]:
+        with self._lock:
+            data = self._entries.get(path)
+            if data is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(path)
+            self.hits += 1
+            return data
+
+    def put(self, path: str, data: bytes) -> bool:
+        """Adds a file, evicting the least recently used ones to stay in budget. Returns False if it does not fit."""
+        if not self.cacheable(len(data)):
+            return False
+        with self._lock:
+            previous = self._entries.pop(path, None)
+            if previous is not None:
+                self._bytes -= len(previous)
+            while self._entries and self._bytes + len(data) > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= len(evicted)
+                self.evictions += 1
+            self._entries[path] = data
+            self._bytes += len(data)
+        return True
+
+    def has_room(self, size: int) -> bool:
+        return self._bytes + size <= self.max_bytes
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "max_bytes": self.max_bytes,
+            "bytes": self._bytes,
+            "files": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+            "evictions": self.evictions,
+        }
@@ -0,0 +1,31 @@
+import os
+import json
+from typing import Dict, Optional
+
+# Each audio version directory gets an index of its files, written by the importer
+# once the files are in place: {"files": {"<filename>": [size, mtime, sha256]}}.
+# The audio server answers validators (ETag, Last-Modified, Content-Length) from it
+# without touching the files. The leading dot keeps the index itself from being served.
+
+INDEX_FILENAME = ".audio_index.json"
+
+def write_audio_index(version_dir: str, digests: Dict[str, str]) -> Dict[str, int]:
+    """Writes the index for a version directory from each file's sha256. Returns the size of each file indexed."""
+    files = {}
+    sizes = {}
+    for filename, digest in digests.items():
+        st = os.stat(os.path.join(version_dir, filename))
+        files[filename] = [st.st_size, st.st_mtime, digest]
+        sizes[filename] = st.st_size
+    tmp_path = os.path.join(version_dir, f"{INDEX_FILENAME}.tmp")
+    with open(tmp_path, "w") as f:
+        json.dump({"files": files}, f)
+    os.replace(tmp_path, os.path.join(version_dir, INDEX_FILENAME))
+    return sizes
+
+def load_audio_index(version_dir: str) -> Optional[Dict[str, list]]:
+    try:
+        with open(os.path.join(version_dir, INDEX_FILENAME), "r") as f:
+            return json.load(f)["files"]
+    except (FileNotFoundError, ValueError, KeyError):
+        return None
@@ -0,0 +1,27 @@
+import os
+from typing import List
+
+# Asterisk-native variants of each lead's audio, produced by the importer when
+# AUDIO_TRANSCODE_FORMATS is set. A variant sits next to its original with the
+# same stem and the extension Asterisk expects for the format, so "abc.wav"
+# becomes "abc.ulaw", "abc.alaw" or "abc.sln". All variants are 8 kHz mono.
+
+AUDIO_FORMATS = {
+    "ulaw": ".ulaw",
+    "alaw": ".alaw",
+    "slin": ".sln",
+}
+
+def parse_formats(value: str) -> List[str]:
+    """Parses a comma-separated format list such as "ulaw,slin". Raises ValueError for unknown formats."""
+    formats = [name.strip().lower() for name in value.split(",") if name.strip()]
+    unknown = [name for name in formats if name not in AUDIO_FORMATS]
+    if unknown:
+        raise ValueError(f"unknown audio format(s): {', '.join(unknown)}; expected {', '.join(AUDIO_FORMATS)}")
+    return list(dict.fromkeys(formats))
+
+def variant_filename(filename: str, codec: str) -> str:
+    return os.path.splitext(filename)[0] + AUDIO_FORMATS[codec]
+
+def is_variant(filename: str) -> bool:
+    return os.path.splitext(filename)[1].lower() in AUDIO_FORMATS.values()
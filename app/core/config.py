@@ -13,6 +13,103 @@ class Settings(BaseSettings):
     BASE_URL: str
     TTS_SERVICE_URL: str
 
+    # --- Database connection pooling ---
+    DB_POOL_SIZE: int = 5
+    DB_MAX_OVERFLOW: int = 10
+    # Seconds to wait for a free connection before giving up.
+    DB_POOL_TIMEOUT: float = 30.0
+    # Recycle connections older than this many seconds (-1 disables recycling).
+    DB_POOL_RECYCLE: int = -1
+    # Test each connection with a round-trip on checkout. With a local database,
+    # DB_POOL_RECYCLE is a cheaper way to avoid stale connections.
+    DB_POOL_PRE_PING: bool = True
+    # Run the Vicidial endpoints' queries on an async (asyncpg) engine instead of the threadpool.
+    DB_ASYNC_ENABLED: bool = False
+    # Defaults to DATABASE_URL with the postgresql+asyncpg driver.
+    ASYNC_DATABASE_URL: str = ""
+
+    # "http" returns audio URLs under BASE_URL; "asterisk" returns file paths under
+    # ASTERISK_SOUNDS_PATH (without extension) for Asterisk to play straight from disk.
+    AUDIO_URL_MODE: str = "http"
+    # Symlink the importer points at the deployed audio, e.g. /var/lib/asterisk/sounds/campaign.
+    ASTERISK_SOUNDS_PATH: str = ""
+    # Cache-Control max-age (seconds) sent with audio files, so Asterisk's URL cache can reuse them.
+    AUDIO_CACHE_MAX_AGE: int = 86400
+    # In-memory audio cache budget per worker, in bytes; 0 disables it. Files larger
+    # than AUDIO_CACHE_MAX_FILE_BYTES are always read from disk.
+    AUDIO_CACHE_BYTES: int = 0
+    AUDIO_CACHE_MAX_FILE_BYTES: int = 4 * 1024 * 1024
+
+    # --- Vicidial lead selection ---
+    # Keep an in-memory pool of completed leads per generation in each worker.
+    LEAD_POOL_ENABLED: bool = True
+    # How often (seconds) a worker checks the import version stamp for a new deploy.
+    LEAD_POOL_CHECK_INTERVAL: float = 1.0
+    # File the importer rewrites after every deploy. Defaults to a file next to AUDIO_STORAGE_PATH.
+    IMPORT_VERSION_PATH: str = ""
+    # Each import unpacks its audio into a new directory here; AUDIO_STORAGE_PATH is then
+    # switched to it with a symlink. Defaults to "<AUDIO_STORAGE_PATH>_versions".
+    AUDIO_VERSIONS_PATH: str = ""
+    # Threads used to write audio files into place during an import.
+    IMPORT_IO_WORKERS: int = 8
+    # Comma-separated Asterisk-native formats ("ulaw", "alaw", "slin") to convert each
+    # imported audio file to, so Asterisk does not transcode at call time. Empty disables it.
+    AUDIO_TRANSCODE_FORMATS: str = ""
+    # Processes used for transcoding; 0 uses one per CPU.
+    AUDIO_TRANSCODE_WORKERS: int = 0
+    # Manifest of the campaign being served, used to apply delta packages.
+    # Defaults to a file next to AUDIO_STORAGE_PATH.
+    DEPLOYED_MANIFEST_PATH: str = ""
+    # Directory for uploaded packages and import job progress files. Defaults to a
+    # directory next to AUDIO_STORAGE_PATH so uploads sit on the same filesystem.
+    IMPORT_JOBS_PATH: str = ""
+    # Serve phone lookups and random picks from a read-only index file the importer
+    # compiles on each deploy and every worker maps into memory.
+    LEAD_INDEX_ENABLED: bool = True
+    # Defaults to a file next to AUDIO_STORAGE_PATH.
+    LEAD_INDEX_PATH: str = ""
+    # "random" picks any completed lead; "deal" hands leads out in a shuffled, no-repeat rotation.
+    LEAD_SELECTION_MODE: str = "random"
+    # Number of cursor rows per generation in "deal" mode (more slots = less contention).
+    DEAL_CURSOR_SLOTS: int = 8
+    # "phone" returns the phone number as lead_key; "token" returns a signed token carrying
+    # the lead's audio filenames so specific_audio can answer without a database lookup.
+    LEAD_KEY_MODE: str = "phone"
+    # HMAC secret for lead tokens. Must be the same for every worker.
+    LEAD_TOKEN_SECRET: str = ""
+    # Answer the Vicidial endpoints with pre-rendered JSON bytes instead of validating
+    # and encoding each response through its pydantic schema.
+    VICIDIAL_FAST_RESPONSES: bool = True
+    # Address the FastAGI server (python -m app.agi) listens on.
+    AGI_HOST: str = "127.0.0.1"
+    AGI_PORT: int = 4573
+    # Record Prometheus metrics, served at /metrics.
+    METRICS_ENABLED: bool = True
+    # Directory where every process writes its metrics for /metrics to merge.
+    # Defaults to a directory next to AUDIO_STORAGE_PATH.
+    METRICS_PATH: str = ""
+    # How often (seconds) each process writes its metrics there.
+    METRICS_FLUSH_INTERVAL: float = 5.0
+    # --- Request profiling (opt-in) ---
+    PROFILING_ENABLED: bool = False
+    # Requests carrying this header are profiled ("1", or "cprofile" to add cProfile).
+    # Empty disables profiling on request.
+    PROFILING_HEADER: str = "X-Profile"
+    # When set, the header must carry this token ("<mode>:<token>" or "<token>").
+    PROFILING_TOKEN: str = ""
+    # Fraction of all requests profiled (SQL and threadpool accounting only).
+    PROFILING_SAMPLE_RATE: float = 0.0
+    # Fraction of all requests also run under cProfile.
+    PROFILING_CPROFILE_RATE: float = 0.0
+    # Profiled requests slower than this many milliseconds are written as reports.
+    PROFILING_SLOW_MS: float = 200.0
+    # Directory for profiling reports. Defaults to a directory next to AUDIO_STORAGE_PATH.
+    PROFILING_PATH: str = ""
+    # Number of newest reports kept in PROFILING_PATH.
+    PROFILING_MAX_REPORTS: int = 200
+    # How often (seconds) buffered per-lead play counts are written to the database.
+    PLAY_STATS_FLUSH_INTERVAL: float = 5.0
+
     class Config:
         env_file = ".env"
 
@@ -20,4 +117,30 @@ settings = Settings()
 
 # This part remains the same
 os.makedirs(settings.AUDIO_STORAGE_PATH, exist_ok=True)
-os.makedirs(settings.VOICE_STORAGE_PATH, exist_ok=True)
\ No newline at end of file
+os.makedirs(settings.VOICE_STORAGE_PATH, exist_ok=True)
+
+if not settings.AUDIO_VERSIONS_PATH:
+    settings.AUDIO_VERSIONS_PATH = f"{settings.AUDIO_STORAGE_PATH.rstrip('/')}_versions"
+os.makedirs(settings.AUDIO_VERSIONS_PATH, exist_ok=True)
+
+if not settings.IMPORT_JOBS_PATH:
+    settings.IMPORT_JOBS_PATH = os.path.join(os.path.dirname(settings.AUDIO_STORAGE_PATH.rstrip("/")), "import_jobs")
+os.makedirs(settings.IMPORT_JOBS_PATH, exist_ok=True)
+
+if not settings.DEPLOYED_MANIFEST_PATH:
+    settings.DEPLOYED_MANIFEST_PATH = os.path.join(os.path.dirname(settings.AUDIO_STORAGE_PATH.rstrip("/")), "deployed_manifest.json")
+
+if not settings.IMPORT_VERSION_PATH:
+    settings.IMPORT_VERSION_PATH = os.path.join(os.path.dirname(settings.AUDIO_STORAGE_PATH.rstrip("/")), "import_version")
+
+if not settings.LEAD_INDEX_PATH:
+    settings.LEAD_INDEX_PATH = os.path.join(os.path.dirname(settings.AUDIO_STORAGE_PATH.rstrip("/")), "lead_index.bin")
+
+if not settings.METRICS_PATH:
+    settings.METRICS_PATH = os.path.join(os.path.dirname(settings.AUDIO_STORAGE_PATH.rstrip("/")), "metrics")
+os.makedirs(settings.METRICS_PATH, exist_ok=True)
+
+if not settings.PROFILING_PATH:
+    settings.PROFILING_PATH = os.path.join(os.path.dirname(settings.AUDIO_STORAGE_PATH.rstrip("/")), "profiles")
+if settings.PROFILING_ENABLED:
+    os.makedirs(settings.PROFILING_PATH, exist_ok=True)
@@ -0,0 +1,75 @@
+import base64
+import binascii
+import hashlib
+import hmac
+import logging
+from typing import Optional
+
+from app.core.config import settings
+from app.crud.lead import LeadAudio
+
+logger = logging.getLogger(__name__)
+
+# A lead token carries the lead's phone number and its four audio filenames, signed
+# with LEAD_TOKEN_SECRET. Follow-up requests for the same call can be answered from
+# the token alone, without looking the lead up again.
+#
+# Format: "t1.<base64url payload>.<base64url signature>". The prefix can never be a
+# phone number, so tokens and plain phone-number keys are accepted side by side.
+
+TOKEN_PREFIX = "t1."
+_FIELD_SEPARATOR = "\x1f"
+_SIGNATURE_BYTES = 12
+
+_secret = settings.LEAD_TOKEN_SECRET.encode("utf-8")
+
+if settings.LEAD_KEY_MODE == "token" and not _secret:
+    logger.warning("LEAD_KEY_MODE is 'token' but LEAD_TOKEN_SECRET is empty; falling back to phone-number lead keys.")
+
+def _b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode("ascii")
+
+def _b64decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+
+def _sign(body: str) -> str:
+    digest = hmac.new(_secret, body.encode("ascii"), hashlib.sha256).digest()
+    return _b64encode(digest[:_SIGNATURE_BYTES])
+
+def tokens_enabled() -> bool:
+    return settings.LEAD_KEY_MODE == "token" and bool(_secret)
+
+def is_lead_token(lead_key: str) -> bool:
+    return lead_key.startswith(TOKEN_PREFIX)
+
+def encode_lead_token(lead) -> str:
+    fields = [
+        lead.phone_number,
+        lead.audio_filename_no_amd,
+        lead.audio_filename_amd,
+        lead.audio_filename_transfer,
+        lead.audio_filename_voicemail,
+    ]
+    payload = _FIELD_SEPARATOR.join(field or "" for field in fields)
+    body = _b64encode(payload.encode("utf-8"))
+    return f"{TOKEN_PREFIX}{body}.{_sign(body)}"
+
+def decode_lead_token(token: str) -> Optional[LeadAudio]:
+    """Returns the lead carried by a token, or None if it is malformed or its signature does not match."""
+    if not _secret or not is_lead_token(token):
+        return None
+    try:
+        # Real tokens are ASCII; anything else cannot be signed or compared.
+        token.encode("ascii")
+    except UnicodeEncodeError:
+        return None
+    body, _, signature = token[len(TOKEN_PREFIX):].partition(".")
+    if not body or not hmac.compare_digest(signature, _sign(body)):
+        return None
+    try:
+        fields = _b64decode(body).decode("utf-8").split(_FIELD_SEPARATOR)
+    except (binascii.Error, UnicodeDecodeError):
+        return None
+    if len(fields) != len(LeadAudio._fields):
+        return None
+    return LeadAudio(*(field or None for field in fields))
@@ -0,0 +1,79 @@
+import os
+import json
+import hashlib
+from typing import Dict, Iterable, Optional
+
+from app.core.config import settings
+
+# A package manifest describes the complete state a campaign package deploys:
+#
+#   {
+#     "format": 1,
+#     "generation_no": "7",
+#     "delta": false,
+#     "base_manifest": null,            # digest of the deployed manifest a delta applies to
+#     "files": {"<audio filename>": "<sha256 of the file>", ...},
+#     "leads": {"<lead id>": "<md5 of the lead's leads.csv row>", ...}
+#   }
+#
+# A full package carries every lead and audio file. A delta package carries only the
+# leads and files whose hashes differ from its base; everything else listed in the
+# manifest is reused from the deployment on this server.
+
+MANIFEST_FORMAT = 1
+MANIFEST_FILENAME = "manifest.json"
+_HASH_CHUNK_BYTES = 1024 * 1024
+
+def lead_row_hash_sql(columns: Iterable[str], alias: str = "") -> str:
+    """
+    SQL expression hashing one leads.csv row in PostgreSQL: the md5 of its values,
+    cast to text exactly as COPY ... (FORMAT csv) writes them and joined with a unit
+    separator. Columns may already be qualified ("d.lead_data") when they come from
+    different tables.
+    """
+    prefix = f"{alias}." if alias else ""
+    parts = ", ".join(f"coalesce({prefix}{column}::text, '')" for column in columns)
+    return f"md5(concat_ws(E'\\x1f', {parts}))"
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(_HASH_CHUNK_BYTES), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def manifest_digest(manifest: dict) -> str:
+    """Identifies the deployed state a manifest describes, for matching deltas to their base."""
+    canonical = json.dumps({"files": manifest.get("files", {}), "leads": manifest.get("leads", {})}, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+def validate_manifest(manifest: dict) -> None:
+    if manifest.get("format") != MANIFEST_FORMAT:
+        raise ValueError(f"unsupported manifest format: {manifest.get('format')}")
+    if not isinstance(manifest.get("files"), dict) or not isinstance(manifest.get("leads"), dict):
+        raise ValueError("manifest must contain 'files' and 'leads' maps.")
+    if manifest.get("delta") and not manifest.get("base_manifest"):
+        raise ValueError("delta manifest does not name its base_manifest.")
+
+def load_deployed_manifest() -> Optional[dict]:
+    try:
+        with open(settings.DEPLOYED_MANIFEST_PATH, "r") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+def save_deployed_manifest(manifest: Optional[dict]) -> None:
+    """Records the manifest of the campaign now being served, or forgets it for packages without one."""
+    if manifest is None:
+        if os.path.exists(settings.DEPLOYED_MANIFEST_PATH):
+            os.remove(settings.DEPLOYED_MANIFEST_PATH)
+        return
+    deployed = dict(manifest, delta=False, base_manifest=None)
+    tmp_path = f"{settings.DEPLOYED_MANIFEST_PATH}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(deployed, f)
+    os.replace(tmp_path, settings.DEPLOYED_MANIFEST_PATH)
+
+def diff_manifest(current: Dict[str, str], base: Dict[str, str]) -> list:
+    """Keys of `current` whose hash is new or different from `base`."""
+    return [key for key, digest in current.items() if base.get(key) != digest]
@@ -0,0 +1,302 @@
+import os
+import json
+import time
+import bisect
+import threading
+import logging
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from starlette.routing import Match
+
+from app.core.config import settings
+from app.db.session import pool_stats
+
+logger = logging.getLogger(__name__)
+
+# Prometheus metrics, rendered in the text exposition format at /metrics.
+#
+# Recording is an in-memory update under a lock, cheap enough to leave on. Each
+# process (every Gunicorn worker, and the FastAGI server) writes a snapshot of its
+# metrics to METRICS_PATH every METRICS_FLUSH_INTERVAL seconds. /metrics is answered
+# by whichever worker receives the scrape, so it merges all of the snapshots:
+# counters and histograms are summed, and gauges are reported per process with a
+# "worker" label. Snapshots of processes that exited keep counting towards the
+# totals for a day, so counters do not go backwards when a worker is restarted.
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+PHASE_BUCKETS = (0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0, 1800.0, 3600.0)
+
+# Label values come from request paths, so each metric keeps at most this many
+# label sets; further ones are counted under "other".
+_MAX_LABEL_SETS = 1000
+OVERFLOW_LABEL = "other"
+
+# Label for values that are not worth a series of their own, such as generation
+# numbers that no generation has.
+UNKNOWN_LABEL = "unknown"
+
+_KEEP_SNAPSHOT_SECONDS = 86400
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values: Dict[Tuple[str, ...], object] = {}
+        registry.register(self)
+
+    def _key(self, labels: Tuple) -> Tuple[str, ...]:
+        if len(labels) != len(self.labelnames):
+            raise ValueError(f"{self.name} takes labels {self.labelnames}, got {labels}")
+        key = tuple(str(value) for value in labels)
+        if key not in self._values and len(self._values) >= _MAX_LABEL_SETS:
+            key = (OVERFLOW_LABEL,) * len(key)
+        return key
+
+    def describe(self) -> dict:
+        return {"kind": self.kind, "help": self.documentation, "labels": list(self.labelnames)}
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, *labels, amount: float = 1.0) -> None:
+        with self._lock:
+            key = self._key(labels)
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return dict(self.describe(), values=[[list(key), value] for key, value in self._values.items()])
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, *labels) -> None:
+        # Per-bucket counts; they are made cumulative when rendered.
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            key = self._key(labels)
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][index] += 1
+            entry[1] += value
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            values = [[list(key), list(counts), total] for key, (counts, total) in self._values.items()]
+        return dict(self.describe(), buckets=list(self.buckets), values=values)
+
+
+class Gauge(_Metric):
+    """A value read when the snapshot is taken, from `collect`, which returns (labels, value) pairs."""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str], collect: Callable[[], Iterable[Tuple[tuple, float]]]):
+        super().__init__(name, documentation, labelnames)
+        self._collect = collect
+
+    def snapshot(self) -> dict:
+        try:
+            values = [[[str(value) for value in labels], float(value)] for labels, value in self._collect()]
+        except Exception as e:
+            logger.warning(f"Could not collect gauge {self.name}: {e}")
+            values = []
+        return dict(self.describe(), values=values)
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+        self._flusher: Optional[threading.Thread] = None
+
+    def register(self, metric: _Metric) -> None:
+        self._metrics.append(metric)
+
+    def snapshot(self) -> dict:
+        return {"pid": os.getpid(), "time": time.time(), "metrics": {metric.name: metric.snapshot() for metric in self._metrics}}
+
+    def write_snapshot(self) -> None:
+        path = os.path.join(settings.METRICS_PATH, f"{os.getpid()}.json")
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.snapshot(), f)
+        os.replace(tmp_path, path)
+
+    def start(self) -> None:
+        """Starts writing this process's snapshot in the background. Safe to call more than once."""
+        if not settings.METRICS_ENABLED or self._flusher is not None:
+            return
+
+        def flush_forever():
+            while True:
+                time.sleep(settings.METRICS_FLUSH_INTERVAL)
+                try:
+                    self.write_snapshot()
+                except OSError as e:
+                    logger.warning(f"Could not write metrics snapshot: {e}")
+
+        self._flusher = threading.Thread(target=flush_forever, name="metrics-flush", daemon=True)
+        self._flusher.start()
+
+    def _load_snapshots(self) -> List[dict]:
+        snapshots = []
+        now = time.time()
+        for name in os.listdir(settings.METRICS_PATH):
+            if not name.endswith(".json"):
+                continue
+            path = os.path.join(settings.METRICS_PATH, name)
+            try:
+                if now - os.path.getmtime(path) > _KEEP_SNAPSHOT_SECONDS:
+                    os.remove(path)
+                    continue
+                with open(path, "r") as f:
+                    snapshots.append(json.load(f))
+            except (OSError, ValueError):
+                continue  # Removed or being replaced meanwhile.
+        return snapshots
+
+    def render(self) -> str:
+        """The merged metrics of every process, in the Prometheus text format."""
+        self.write_snapshot()
+        return render_snapshots(self._load_snapshots(), stale_after=settings.METRICS_FLUSH_INTERVAL * 3)
+
+
+def _label_text(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    escaped = (value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for value in values)
+    return "{" + ",".join(f'{name}="{value}"' for name, value in zip(names, escaped)) + "}"
+
+
+def _number(value: float) -> str:
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+def render_snapshots(snapshots: List[dict], stale_after: float) -> str:
+    now = time.time()
+    merged: Dict[str, dict] = {}
+    for snapshot in snapshots:
+        live = now - snapshot["time"] <= stale_after
+        for name, metric in snapshot["metrics"].items():
+            target = merged.setdefault(name, dict(metric, values={}))
+            values = target["values"]
+            if metric["kind"] == "gauge":
+                if not live:
+                    continue  # A gauge only describes a process that is still running.
+                target["labels"] = metric["labels"] + ["worker"]
+                for labels, value in metric["values"]:
+                    values[tuple(labels) + (str(snapshot["pid"]),)] = value
+            elif metric["kind"] == "counter":
+                for labels, value in metric["values"]:
+                    values[tuple(labels)] = values.get(tuple(labels), 0.0) + value
+            else:
+                for labels, counts, total in metric["values"]:
+                    entry = values.setdefault(tuple(labels), [[0] * len(counts), 0.0])
+                    entry[0] = [a + b for a, b in zip(entry[0], counts)]
+                    entry[1] += total
+
+    lines = []
+    for name in sorted(merged):
+        metric = merged[name]
+        lines.append(f"# HELP {name} {metric['help']}")
+        lines.append(f"# TYPE {name} {metric['kind']}")
+        names = metric["labels"]
+        for labels, value in sorted(metric["values"].items()):
+            if metric["kind"] != "histogram":
+                lines.append(f"{name}{_label_text(names, labels)} {_number(value)}")
+                continue
+            counts, total = value
+            cumulative = 0
+            for bound, count in zip(list(metric["buckets"]) + ["+Inf"], counts):
+                cumulative += count
+                le = bound if bound == "+Inf" else _number(bound)
+                lines.append(f"{name}_bucket{_label_text(list(names) + ['le'], list(labels) + [le])} {cumulative}")
+            lines.append(f"{name}_sum{_label_text(names, labels)} {_number(total)}")
+            lines.append(f"{name}_count{_label_text(names, labels)} {cumulative}")
+    return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+
+def route_label(scope) -> str:
+    """
+    The path template of the route or mount answering a request, or "unmatched".
+    Recent Starlette versions leave the matched route in the scope; older ones,
+    including every version that runs on Python 3.6, do not, so the app's routes
+    are matched here the way the router does it: the first full match, else the
+    first partial one (the path of a route for another method).
+    """
+    route = scope.get("route")
+    if route is None:
+        router = getattr(scope.get("app"), "router", None)
+        for candidate in getattr(router, "routes", ()):
+            match, _ = candidate.matches(scope)
+            if match == Match.FULL:
+                route = candidate
+                break
+            if match == Match.PARTIAL and route is None:
+                route = candidate
+    return getattr(route, "path", None) or "unmatched"
+
+
+class MetricsMiddleware:
+    """
+    Pure ASGI middleware timing every HTTP request. Requests are labelled with the
+    route's path template (never the raw path, which carries lead keys), the
+    mount's path for the audio server and static files, or "unmatched".
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        started = time.perf_counter()
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            route = route_label(scope)
+            http_request_seconds.observe(time.perf_counter() - started, route, scope["method"])
+            http_responses.inc(route, scope["method"], status)
+
+
+# --- Metrics recorded across the app ---
+
+http_request_seconds = Histogram("vbox_http_request_seconds", "Time to answer an HTTP request, by route.", ["route", "method"])
+http_responses = Counter("vbox_http_responses_total", "HTTP responses, by route and status code.", ["route", "method", "status"])
+lead_lookups = Counter("vbox_lead_lookups_total", "Vicidial and AGI random lead picks, by generation and result (found or not_found).", ["generation_no", "result"])
+audio_bytes_served = Counter("vbox_audio_bytes_served_total", "Audio bytes sent by the audio server, by source (cache or file).", ["source"])
+import_phase_seconds = Histogram("vbox_import_phase_seconds", "Duration of each campaign import phase.", ["phase"], buckets=PHASE_BUCKETS)
+export_phase_seconds = Histogram("vbox_export_phase_seconds", "Duration of each campaign export phase.", ["phase"], buckets=PHASE_BUCKETS)
+
+
+def _pool_gauges():
+    for engine_name, stats in pool_stats().items():
+        for key in ("size", "checked_in", "checked_out", "overflow", "checkouts", "wait_total_ms", "wait_max_ms"):
+            yield (engine_name, key), stats[key]
+
+
+db_pool = Gauge("vbox_db_pool", "SQLAlchemy connection pool state and checkout waits (ms), by engine and statistic.", ["engine", "stat"], _pool_gauges)
@@ -0,0 +1,348 @@
+import os
+import json
+import time
+import pstats
+import random
+import asyncio
+import weakref
+import cProfile
+import itertools
+import threading
+import logging
+from typing import List, Optional, Tuple
+
+from starlette.concurrency import run_in_threadpool
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Opt-in request profiling, for finding out where a slow dialer request spent its time.
+#
+# A request is profiled when it carries the PROFILING_HEADER header (matching
+# PROFILING_TOKEN when one is set) or is picked at PROFILING_SAMPLE_RATE. For a
+# profiled request the app records:
+#   - every SQL statement and its time, from SQLAlchemy cursor events;
+#   - the time run_db calls waited for a threadpool thread, and the time they ran
+#     (session, query and building objects from the rows);
+#   - the time spent waiting for a pooled connection.
+# The totals are returned in a Server-Timing header. A fraction of requests
+# (PROFILING_CPROFILE_RATE, and every request asking with "cprofile") also run under
+# cProfile. Requests slower than PROFILING_SLOW_MS, and all requests that asked for
+# profiling, are written as JSON reports to PROFILING_PATH, keeping the newest
+# PROFILING_MAX_REPORTS.
+#
+# cProfile watches the event loop thread, so other requests handled meanwhile
+# appear in the profile as well; run_db calls of the request are profiled in their
+# worker thread and merged in. Only one request per process is under cProfile at a time.
+
+try:
+    import contextvars
+except ImportError:  # Python 3.6
+    contextvars = None
+
+# Statements kept per request for the report; the totals count all of them.
+_MAX_STATEMENTS = 200
+_STATEMENT_CHARS = 500
+_REPORT_FUNCTIONS = 40
+
+
+class _TaskLocal:
+    """
+    The profile of the current request where there are no contextvars (Python 3.6):
+    keyed by the running asyncio task on the event loop, and by thread in the
+    threadpool threads that profiled_call runs on. Has the ContextVar methods used here.
+    """
+
+    def __init__(self):
+        self._tasks = weakref.WeakKeyDictionary()
+        self._thread = threading.local()
+
+    @staticmethod
+    def _task():
+        try:
+            return asyncio.Task.current_task()
+        except RuntimeError:
+            return None  # A thread without an event loop.
+
+    def get(self):
+        profile = getattr(self._thread, "profile", None)
+        if profile is not None:
+            return profile
+        task = self._task()
+        return self._tasks.get(task) if task is not None else None
+
+    def set(self, profile):
+        task = self._task()
+        if task is None:
+            previous = getattr(self._thread, "profile", None)
+            self._thread.profile = profile
+            return None, previous
+        previous = self._tasks.get(task)
+        self._tasks[task] = profile
+        return task, previous
+
+    def reset(self, token) -> None:
+        task, previous = token
+        if task is None:
+            self._thread.profile = previous
+        elif previous is None:
+            self._tasks.pop(task, None)
+        else:
+            self._tasks[task] = previous
+
+
+_current = contextvars.ContextVar("request_profile", default=None) if contextvars is not None else _TaskLocal()
+_cprofile_lock = threading.Lock()
+_report_numbers = itertools.count(1)
+
+
+class RequestProfile:
+    def __init__(self, method: str, path: str, requested: bool):
+        self.method = method
+        self.path = path
+        self.route: Optional[str] = None
+        self.requested = requested
+        self.started = time.perf_counter()
+        self.report_name = f"{time.strftime('%Y%m%dT%H%M%S')}-{os.getpid()}-{next(_report_numbers)}"
+        self._lock = threading.Lock()
+        self.sql_count = 0
+        self.sql_seconds = 0.0
+        self.statements: List[Tuple[float, str]] = []
+        self.threadpool_calls = 0
+        self.threadpool_wait = 0.0
+        self.db_call_seconds = 0.0
+        self.pool_checkouts = 0
+        self.pool_wait = 0.0
+        self.profiler: Optional[cProfile.Profile] = None
+        self.thread_profilers: List[cProfile.Profile] = []
+
+    def record_statement(self, seconds: float, statement: str) -> None:
+        with self._lock:
+            self.sql_count += 1
+            self.sql_seconds += seconds
+            if len(self.statements) < _MAX_STATEMENTS:
+                self.statements.append((seconds, statement[:_STATEMENT_CHARS]))
+
+    def record_db_call(self, wait: float, seconds: float) -> None:
+        with self._lock:
+            self.threadpool_calls += 1
+            self.threadpool_wait += wait
+            self.db_call_seconds += seconds
+
+    def record_pool_wait(self, seconds: float) -> None:
+        with self._lock:
+            self.pool_checkouts += 1
+            self.pool_wait += seconds
+
+    def server_timing(self) -> str:
+        elapsed = time.perf_counter() - self.started
+        return ", ".join([
+            f'sql;dur={self.sql_seconds * 1000:.3f};desc="{self.sql_count} statements"',
+            f'threadpool-wait;dur={self.threadpool_wait * 1000:.3f}',
+            f'db-calls;dur={self.db_call_seconds * 1000:.3f};desc="{self.threadpool_calls} calls"',
+            f'pool-wait;dur={self.pool_wait * 1000:.3f}',
+            f'app;dur={elapsed * 1000:.3f}',
+        ])
+
+    def report(self, total: float, status: int) -> dict:
+        slowest = sorted(self.statements, key=lambda entry: entry[0], reverse=True)
+        report = {
+            "method": self.method,
+            "path": self.path,
+            "route": self.route,
+            "status": status,
+            "requested": self.requested,
+            "pid": os.getpid(),
+            "time": time.time(),
+            "total_ms": round(total * 1000, 3),
+            "sql": {"statements": self.sql_count, "total_ms": round(self.sql_seconds * 1000, 3)},
+            "run_db": {
+                "calls": self.threadpool_calls,
+                "threadpool_wait_ms": round(self.threadpool_wait * 1000, 3),
+                # Time inside the CRUD functions; what is not SQL is mostly session and object overhead.
+                "total_ms": round(self.db_call_seconds * 1000, 3),
+            },
+            "pool": {"checkouts": self.pool_checkouts, "wait_ms": round(self.pool_wait * 1000, 3)},
+            "statements": [{"ms": round(seconds * 1000, 3), "sql": statement} for seconds, statement in slowest],
+        }
+        if self.profiler is not None:
+            report["profile"] = f"{self.report_name}.prof"
+            report["functions"] = _top_functions(self._stats())
+        return report
+
+    def _stats(self) -> pstats.Stats:
+        stats = pstats.Stats(self.profiler)
+        for profiler in self.thread_profilers:
+            try:
+                stats.add(profiler)
+            except TypeError:
+                continue  # The worker thread's profiler never ran.
+        return stats
+
+    def write_report(self, total: float, status: int) -> None:
+        path = os.path.join(settings.PROFILING_PATH, f"{self.report_name}.json")
+        report = self.report(total, status)
+        if self.profiler is not None:
+            self._stats().dump_stats(os.path.join(settings.PROFILING_PATH, report["profile"]))
+        with open(f"{path}.tmp", "w") as f:
+            json.dump(report, f, indent=2)
+        os.replace(f"{path}.tmp", path)
+        _prune_reports()
+
+
+def _top_functions(stats: pstats.Stats) -> List[dict]:
+    entries = sorted(stats.stats.items(), key=lambda item: item[1][3], reverse=True)[:_REPORT_FUNCTIONS]
+    return [
+        {
+            "function": f"{filename}:{line}({name})",
+            "calls": calls,
+            "own_ms": round(own * 1000, 3),
+            "cumulative_ms": round(cumulative * 1000, 3),
+        }
+        for (filename, line, name), (_, calls, own, cumulative, _) in entries
+    ]
+
+
+def _prune_reports() -> None:
+    """Keeps the newest PROFILING_MAX_REPORTS reports (with their .prof files)."""
+    reports = []
+    for name in os.listdir(settings.PROFILING_PATH):
+        if name.endswith(".json"):
+            try:
+                reports.append((os.path.getmtime(os.path.join(settings.PROFILING_PATH, name)), name))
+            except OSError:
+                continue
+    reports.sort()
+    for _, name in reports[:max(len(reports) - settings.PROFILING_MAX_REPORTS, 0)]:
+        base = os.path.join(settings.PROFILING_PATH, name[:-len(".json")])
+        for path in (f"{base}.json", f"{base}.prof"):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+def current() -> Optional[RequestProfile]:
+    return _current.get()
+
+
+def record_pool_wait(seconds: float) -> None:
+    profile = _current.get()
+    if profile is not None:
+        profile.record_pool_wait(seconds)
+
+
+def profiled_call(profile: RequestProfile, queued: float, fn, *args, **kwargs):
+    """Runs `fn` on a threadpool thread on behalf of a profiled request, queued at `queued`."""
+    started = time.perf_counter()
+    token = _current.set(profile)
+    profiler = None
+    if profile.profiler is not None:
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            profiler = None  # Another profiler is active in this thread.
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profile.thread_profilers.append(profiler)
+        _current.reset(token)
+        profile.record_db_call(started - queued, time.perf_counter() - started)
+
+
+def watch_engine(engine) -> None:
+    """Times the statements `engine` runs for profiled requests."""
+    from sqlalchemy import event
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if _current.get() is not None:
+            conn.info.setdefault("profiling_started", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        profile = _current.get()
+        started = conn.info.get("profiling_started")
+        if profile is not None and started:
+            profile.record_statement(time.perf_counter() - started.pop(), statement)
+
+    @event.listens_for(engine, "handle_error")
+    def handle_error(exception_context):
+        started = exception_context.connection.info.get("profiling_started") if exception_context.connection is not None else None
+        if started:
+            started.pop()
+
+
+def _requested(scope) -> Optional[str]:
+    """The value of the profiling header, if the request carries a valid one."""
+    header = settings.PROFILING_HEADER.lower().encode("latin-1")
+    for name, value in scope["headers"]:
+        if name == header:
+            value = value.decode("latin-1")
+            if settings.PROFILING_TOKEN and value.split(":", 1)[-1] != settings.PROFILING_TOKEN:
+                return None
+            return value
+    return None
+
+
+class ProfilingMiddleware:
+    """
+    Pure ASGI middleware profiling requests that ask for it or are sampled. A
+    request asks with the PROFILING_HEADER header, set to "1", or to "cprofile" to
+    run under cProfile as well; with PROFILING_TOKEN set the value is
+    "<mode>:<token>" (or just the token).
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        requested = _requested(scope) if settings.PROFILING_HEADER else None
+        if requested is None and random.random() >= settings.PROFILING_SAMPLE_RATE:
+            await self.app(scope, receive, send)
+            return
+
+        profile = RequestProfile(scope["method"], scope["path"], requested is not None)
+        wants_cprofile = (requested or "").split(":", 1)[0] == "cprofile" or random.random() < settings.PROFILING_CPROFILE_RATE
+        if wants_cprofile and _cprofile_lock.acquire(blocking=False):
+            profile.profiler = cProfile.Profile()
+            try:
+                profile.profiler.enable()
+            except ValueError:
+                profile.profiler = None
+                _cprofile_lock.release()
+        token = _current.set(profile)
+        status = 500
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                headers = list(message.get("headers", []))
+                headers.append((b"server-timing", profile.server_timing().encode("latin-1")))
+                if profile.requested:
+                    headers.append((b"x-profile-report", profile.report_name.encode("latin-1")))
+                message = dict(message, headers=headers)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            total = time.perf_counter() - profile.started
+            if profile.profiler is not None:
+                profile.profiler.disable()
+                _cprofile_lock.release()
+            _current.reset(token)
+            profile.route = getattr(scope.get("route"), "path", None)
+            if profile.requested or total * 1000 >= settings.PROFILING_SLOW_MS:
+                try:
+                    await run_in_threadpool(profile.write_report, total, status)
+                except OSError as e:
+                    logger.warning(f"Could not write profiling report: {e}")
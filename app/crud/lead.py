@@ -1,51 +1,700 @@
 import os
+import io
+import csv
+import json
 import uuid
+from collections import namedtuple
 import pandas as pd
 from sqlalchemy.orm import Session, joinedload
 # --- NEW: Import func for random ordering ---
-from sqlalchemy import func
+from sqlalchemy import func, text
 # --- FIX: Import LeadStatus for filtering ---
-from app.models.lead import Lead, Voice, VoiceGroup, LeadStatus
+from app.models.lead import Lead, LEAD_DETAIL_FIELDS, Generation, Voice, VoiceGroup, LeadStatus
 from app.core.config import settings
-from typing import List, Optional
+from app.core.manifest import lead_row_hash_sql
+from app.core.audio_index import load_audio_index
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+
+# A lightweight, read-only view of a lead: just the key and its four audio filenames.
+# It exposes the same attribute names as Lead so it can be used wherever a lead's audio is resolved.
+LeadAudio = namedtuple("LeadAudio", [
+    "phone_number",
+    "audio_filename_no_amd",
+    "audio_filename_amd",
+    "audio_filename_transfer",
+    "audio_filename_voicemail",
+])
+
+# Column order of leads.csv in a campaign package. The importer loads these columns
+# with COPY; the LEAD_DETAIL_FIELDS go to lead_details and the rest to leads.
+LEAD_CSV_COLUMNS = [
+    "id", "phone_number", "campaign_name", "generation_no", "lead_data", "status",
+    "audio_filename_no_amd", "audio_filename_amd", "audio_filename_transfer", "audio_filename_voicemail",
+    "llm_input_no_amd", "llm_output_no_amd", "llm_input_amd", "llm_output_amd",
+    "llm_input_transfer", "llm_output_transfer", "llm_input_voicemail", "llm_output_voicemail",
+    "created_at", "updated_at",
+]
+_LEAD_TABLE_COLUMNS = [column for column in LEAD_CSV_COLUMNS if column not in LEAD_DETAIL_FIELDS]
+_DETAIL_TABLE_COLUMNS = ["lead_id"] + LEAD_DETAIL_FIELDS
+_LEAD_CSV_INDEXES = [LEAD_CSV_COLUMNS.index(column) for column in _LEAD_TABLE_COLUMNS]
+_DETAIL_CSV_INDEXES = [LEAD_CSV_COLUMNS.index(column) for column in ["id"] + LEAD_DETAIL_FIELDS]
+# leads.csv columns as expressions over "leads l LEFT JOIN lead_details d".
+_LEAD_CSV_SELECT = [f"d.{column}" if column in LEAD_DETAIL_FIELDS else f"l.{column}" for column in LEAD_CSV_COLUMNS]
+
+# Rows validated and buffered before each COPY round trip during an import.
+COPY_CHUNK_ROWS = 5000
 
 # --- LEAD CRUD Functions ---
 
-def bulk_create_leads(db: Session, df: pd.DataFrame, campaign_name: str, generation_no: Optional[str]) -> List[Lead]:
-    df['phone'] = df['phone'].astype(str)
-    df.drop_duplicates(subset=['phone'], keep='last', inplace=True)
-    phone_numbers = df['phone'].tolist()
-    if phone_numbers:
-        db.query(Lead).filter(Lead.phone_number.in_(phone_numbers)).delete(synchronize_session='fetch')
-    leads_to_create = []
-    for _, row in df.iterrows():
-        lead_data = row.to_dict()
-        phone_number = lead_data.pop('phone', None)
-        if phone_number:
-            db_lead = Lead(
-                phone_number=phone_number,
-                campaign_name=campaign_name,
-                generation_no=generation_no,
-                lead_data=lead_data
-            )
-            leads_to_create.append(db_lead)
-    db.add_all(leads_to_create)
-    db.flush()
-    return leads_to_create
+# Rows sent per COPY round trip by bulk_create_leads.
+UPLOAD_CHUNK_ROWS = 50000
+
+def bulk_create_leads(db: Session, df: pd.DataFrame, campaign_name: str, generation_no: Optional[str]) -> List[str]:
+    """
+    Creates a lead for every phone number in an uploaded campaign CSV and returns
+    their ids. A phone number that already has a lead takes it over as a new,
+    pending lead of this campaign, keeping its id.
+
+    The frame is deduplicated and serialized column-wise, streamed into a temp table
+    with COPY in chunks of UPLOAD_CHUNK_ROWS, and merged into leads and lead_details
+    with one INSERT ... ON CONFLICT each; no ORM objects are built. Runs in the
+    session's transaction; the caller commits.
+    """
+    df = df[df['phone'].notna()]
+    df = df.assign(phone=df['phone'].astype(str).str.strip())
+    df = df[df['phone'] != ''].drop_duplicates(subset=['phone'], keep='last')
+    if df.empty:
+        return []
+    upload = pd.DataFrame({
+        "id": [uuid.uuid4().hex for _ in range(len(df))],
+        "phone_number": df['phone'].to_numpy(),
+        # One JSON object per line, in the order of the rows.
+        "lead_data": df.drop(columns=['phone']).to_json(orient='records', lines=True).splitlines(),
+    })
+
+    db.execute(text("CREATE TEMP TABLE leads_upload (id uuid, phone_number text, lead_data text) ON COMMIT DROP"))
+    cursor = db.connection().connection.cursor()
+    for start in range(0, len(upload), UPLOAD_CHUNK_ROWS):
+        buffer = io.StringIO()
+        upload.iloc[start:start + UPLOAD_CHUNK_ROWS].to_csv(buffer, index=False, header=False)
+        buffer.seek(0)
+        cursor.copy_expert("COPY leads_upload (id, phone_number, lead_data) FROM STDIN WITH (FORMAT csv)", buffer)
+
+    # Generations that are about to lose leads to this one.
+    previous_generations = db.execute(text("""
+        SELECT DISTINCT l.generation_no FROM leads_upload AS u
+        JOIN leads AS l ON l.phone_number = u.phone_number
+        WHERE l.generation_no IS NOT NULL
+    """)).scalars().all()
+
+    reset = ", ".join(f"{column} = NULL" for column in _AUDIO_FILENAME_COLUMNS)
+    lead_ids = db.execute(text(f"""
+        INSERT INTO leads (id, phone_number, campaign_name, generation_no, status, play_count, created_at)
+        SELECT id, phone_number, :campaign_name, :generation_no, 'PENDING', 0, now() FROM leads_upload
+        ON CONFLICT (phone_number) DO UPDATE SET
+            campaign_name = EXCLUDED.campaign_name,
+            generation_no = EXCLUDED.generation_no,
+            status = EXCLUDED.status,
+            {reset},
+            deal_order = NULL,
+            play_count = 0,
+            last_played_at = NULL,
+            created_at = EXCLUDED.created_at,
+            updated_at = now()
+        RETURNING id
+    """), {"campaign_name": campaign_name, "generation_no": generation_no}).scalars().all()
+
+    reset = ", ".join(f"{column} = NULL" for column in LEAD_DETAIL_FIELDS if column != "lead_data")
+    db.execute(text(f"""
+        INSERT INTO lead_details (lead_id, lead_data)
+        SELECT l.id, CAST(u.lead_data AS json) FROM leads_upload AS u
+        JOIN leads AS l ON l.phone_number = u.phone_number
+        ON CONFLICT (lead_id) DO UPDATE SET lead_data = EXCLUDED.lead_data, {reset}
+    """))
+
+    previous_generations = [number for number in previous_generations if number != generation_no]
+    if previous_generations:
+        # The re-uploaded leads left these generations, and their dealing order.
+        renumber_deal_order(db, generation_nos=previous_generations)
+        refresh_generations(db, generation_nos=previous_generations)
+    if generation_no:
+        refresh_generations(db, generation_nos=[generation_no], imported=True)
+    return [str(lead_id) for lead_id in lead_ids]
+
+def _validated_csv_row(row: dict, imported_at: str) -> list:
+    """Checks one leads.csv row and returns its values in LEAD_CSV_COLUMNS order (None for empty)."""
+    uuid.UUID(row["id"])
+    if not row.get("phone_number"):
+        raise ValueError("phone_number is empty")
+    json.loads(row["lead_data"])
+    LeadStatus(row["status"])
+    values = [row.get(column) or None for column in LEAD_CSV_COLUMNS]
+    # Keep created_at populated for rows from older packages that left it empty.
+    if values[LEAD_CSV_COLUMNS.index("created_at")] is None:
+        values[LEAD_CSV_COLUMNS.index("created_at")] = imported_at
+    return values
+
+def copy_leads_from_csv(db: Session, csvfile, leads_table: str = "leads", details_table: str = "lead_details") -> int:
+    """
+    Streams a campaign package's leads.csv into `leads_table` and `details_table`
+    with PostgreSQL COPY.
+
+    Rows are validated as they are read and sent in chunks of COPY_CHUNK_ROWS,
+    so memory use stays bounded no matter how large the package is. Runs in the
+    session's transaction; the caller commits. Raises ValueError on the first bad row.
+    """
+    imported_at = datetime.now(timezone.utc).isoformat()
+    leads_copy_sql = f"COPY {leads_table} ({', '.join(_LEAD_TABLE_COLUMNS)}) FROM STDIN WITH (FORMAT csv)"
+    details_copy_sql = f"COPY {details_table} ({', '.join(_DETAIL_TABLE_COLUMNS)}) FROM STDIN WITH (FORMAT csv)"
+    cursor = db.connection().connection.cursor()
+    reader = csv.DictReader(csvfile)
+    missing = {"id", "phone_number", "lead_data", "status"} - set(reader.fieldnames or [])
+    if missing:
+        raise ValueError(f"leads.csv is missing required columns: {', '.join(sorted(missing))}")
+
+    total = 0
+    pending = 0
+    leads_buffer = io.StringIO()
+    details_buffer = io.StringIO()
+    leads_writer = csv.writer(leads_buffer)
+    details_writer = csv.writer(details_buffer)
+
+    def flush():
+        # Leads first, so the details' foreign keys find their rows.
+        for copy_sql, buffer in ((leads_copy_sql, leads_buffer), (details_copy_sql, details_buffer)):
+            buffer.seek(0)
+            cursor.copy_expert(copy_sql, buffer)
+            buffer.seek(0)
+            buffer.truncate()
+
+    for row in reader:
+        try:
+            values = _validated_csv_row(row, imported_at)
+        except (KeyError, ValueError) as e:
+            raise ValueError(f"leads.csv line {reader.line_num}: invalid row ({e})")
+        leads_writer.writerow([values[index] for index in _LEAD_CSV_INDEXES])
+        details_writer.writerow([values[index] for index in _DETAIL_CSV_INDEXES])
+        pending += 1
+        if pending >= COPY_CHUNK_ROWS:
+            flush()
+            total += pending
+            pending = 0
+    if pending:
+        flush()
+        total += pending
+    return total
+
+def apply_lead_delta(db: Session, csvfile, keep_ids: List[str]) -> Tuple[int, int]:
+    """
+    Applies a delta package's leads.csv to the live leads table: leads not in
+    `keep_ids` are deleted and the rows in the CSV are inserted or updated.
+    Runs in the session's transaction, so readers see the old campaign until
+    the caller commits. Returns (rows upserted, rows deleted).
+    """
+    db.execute(text("CREATE TEMP TABLE leads_delta (LIKE leads INCLUDING DEFAULTS) ON COMMIT DROP"))
+    db.execute(text("CREATE TEMP TABLE lead_details_delta (LIKE lead_details INCLUDING DEFAULTS) ON COMMIT DROP"))
+    upserted = copy_leads_from_csv(db, csvfile, leads_table="leads_delta", details_table="lead_details_delta")
+    # Removed leads take their lead_details rows with them (ON DELETE CASCADE).
+    deleted = db.execute(
+        text("DELETE FROM leads WHERE NOT (id = ANY(CAST(:keep_ids AS uuid[])))"),
+        {"keep_ids": keep_ids},
+    ).rowcount
+    columns = ", ".join(_LEAD_TABLE_COLUMNS)
+    updates = ", ".join(f"{column} = EXCLUDED.{column}" for column in _LEAD_TABLE_COLUMNS if column != "id")
+    db.execute(text(f"""
+        INSERT INTO leads ({columns})
+        SELECT {columns} FROM leads_delta
+        ON CONFLICT (id) DO UPDATE SET {updates}, deal_order = NULL
+    """))
+    columns = ", ".join(_DETAIL_TABLE_COLUMNS)
+    updates = ", ".join(f"{column} = EXCLUDED.{column}" for column in LEAD_DETAIL_FIELDS)
+    db.execute(text(f"""
+        INSERT INTO lead_details ({columns})
+        SELECT {columns} FROM lead_details_delta
+        ON CONFLICT (lead_id) DO UPDATE SET {updates}
+    """))
+    return upserted, deleted
+
+def copy_leads_to_csv(db: Session, out_file, generation_no: str, lead_ids: Optional[List[str]] = None) -> None:
+    """Writes a generation's leads, optionally only `lead_ids`, to out_file as leads.csv with COPY."""
+    cursor = db.connection().connection.cursor()
+    query = f"SELECT {', '.join(_LEAD_CSV_SELECT)} FROM leads l LEFT JOIN lead_details d ON d.lead_id = l.id WHERE l.generation_no = %s"
+    params = [generation_no]
+    if lead_ids is not None:
+        query += " AND l.id = ANY(%s::uuid[])"
+        params.append(lead_ids)
+    # COPY cannot take bind parameters, so the query is rendered client-side with mogrify.
+    select_sql = cursor.mogrify(query, params).decode("utf-8")
+    cursor.copy_expert(f"COPY ({select_sql}) TO STDOUT WITH (FORMAT csv, HEADER)", out_file)
+
+def get_lead_row_hashes(db: Session, generation_no: str) -> dict:
+    """Maps each lead id of a generation to the hash of its leads.csv row."""
+    rows = db.execute(
+        text(f"SELECT l.id::text, {lead_row_hash_sql(_LEAD_CSV_SELECT)} FROM leads l LEFT JOIN lead_details d ON d.lead_id = l.id WHERE l.generation_no = :generation_no"),
+        {"generation_no": generation_no},
+    ).all()
+    return dict(rows)
 
 def get_lead_by_phone(db: Session, phone_number: str):
     return db.query(Lead).filter(Lead.phone_number == phone_number).first()
 
+# Picks a random ordinal below the generation's dealt_count in the catalog and reads
+# the leads at that ordinal and the ones after it, through ix_leads_generation_deal_order.
+# deal_order is already a shuffle, so consecutive ordinals are as random as separate picks.
+# The CTE calls random(), so PostgreSQL evaluates it once rather than per lead.
+_RANDOM_DEALT_LEADS_SQL = text("""
+    WITH pick AS (
+        SELECT generation_no, dealt_count, floor(random() * dealt_count)::integer AS start
+        FROM generations
+        WHERE generation_no = :generation_no AND dealt_count > 0
+    )
+    SELECT l.phone_number, l.audio_filename_no_amd, l.audio_filename_amd,
+           l.audio_filename_transfer, l.audio_filename_voicemail
+    FROM pick
+    CROSS JOIN generate_series(0, LEAST(:count, pick.dealt_count) - 1) AS step(n)
+    JOIN leads AS l
+      ON l.generation_no = pick.generation_no
+     AND l.deal_order = (pick.start + step.n) % pick.dealt_count
+    ORDER BY step.n
+""")
+
+def _random_completed_lead_audio(db: Session, generation_no: str, count: int) -> List[LeadAudio]:
+    rows = db.execute(_RANDOM_DEALT_LEADS_SQL, {"generation_no": generation_no, "count": count}).all()
+    if len(rows) == count:
+        return [LeadAudio(*row) for row in rows]
+    # Generations missing from the catalog or smaller than `count`, or ordinals the
+    # catalog does not know about yet: fall back to sorting the generation's
+    # completed leads randomly.
+    rows = db.query(
+        Lead.phone_number,
+        Lead.audio_filename_no_amd,
+        Lead.audio_filename_amd,
+        Lead.audio_filename_transfer,
+        Lead.audio_filename_voicemail,
+    ).filter(
+        Lead.generation_no == generation_no,
+        Lead.status == LeadStatus.COMPLETED
+    ).order_by(func.random()).limit(count).all()
+    return [LeadAudio(*row) for row in rows]
+
 # --- NEW FUNCTION FOR VICIDIAL API ---
-def get_random_completed_lead_by_generation(db: Session, generation_no: str) -> Optional[Lead]:
+def get_random_completed_lead_by_generation(db: Session, generation_no: str) -> Optional[LeadAudio]:
     """
     Selects a single, random lead from the database that is completed and
-    matches the given generation number. This is highly efficient.
+    matches the given generation number, with one index lookup via the
+    generations catalog.
     """
-    return db.query(Lead).filter(
+    leads = _random_completed_lead_audio(db, generation_no, 1)
+    return leads[0] if leads else None
+
+def get_random_completed_leads_by_generation(db: Session, generation_no: str, limit: int) -> List[LeadAudio]:
+    """Selects up to `limit` distinct random completed leads of a generation in one query."""
+    return _random_completed_lead_audio(db, generation_no, limit)
+
+def get_completed_lead_audio_by_generation(db: Session, generation_no: str) -> List[LeadAudio]:
+    """
+    Loads the key and audio filenames of every completed lead in a generation.
+    Only the five needed columns are selected, so no full Lead rows are hydrated.
+    """
+    rows = db.query(
+        Lead.phone_number,
+        Lead.audio_filename_no_amd,
+        Lead.audio_filename_amd,
+        Lead.audio_filename_transfer,
+        Lead.audio_filename_voicemail,
+    ).filter(
         Lead.generation_no == generation_no,
         Lead.status == LeadStatus.COMPLETED
-    ).order_by(func.random()).first()
+    ).all()
+    return [LeadAudio(*row) for row in rows]
+
+# --- "DEAL" SELECTION: SHUFFLED ORDER + ROTATING CURSORS ---
+
+def assign_deal_order(db: Session, slots: int, leads_table: str = "leads", cursors_table: str = "generation_cursors") -> None:
+    """
+    Gives every completed lead a shuffled ordinal within its generation and
+    resets the dealing cursors. Called by the importer after the leads are loaded,
+    normally against the staging tables before they are swapped in.
+    """
+    db.execute(text(f"""
+        UPDATE {leads_table} AS l SET deal_order = shuffled.ordinal
+        FROM (
+            SELECT id, row_number() OVER (PARTITION BY generation_no ORDER BY random()) - 1 AS ordinal
+            FROM {leads_table}
+            WHERE status = 'COMPLETED' AND generation_no IS NOT NULL
+        ) AS shuffled
+        WHERE l.id = shuffled.id
+    """))
+    db.execute(text(f"UPDATE {leads_table} SET deal_order = NULL WHERE deal_order IS NOT NULL AND status <> 'COMPLETED'"))
+    db.execute(text(f"DELETE FROM {cursors_table}"))
+    db.execute(text(f"""
+        INSERT INTO {cursors_table} (generation_no, slot, slot_count, position, lead_count)
+        SELECT counts.generation_no, slots.slot, :slots, 0, counts.lead_count
+        FROM (
+            SELECT generation_no, count(*) AS lead_count
+            FROM {leads_table} WHERE deal_order IS NOT NULL
+            GROUP BY generation_no
+        ) AS counts
+        CROSS JOIN generate_series(0, :slots - 1) AS slots(slot)
+    """), {"slots": max(1, slots)})
+
+def renumber_deal_order(db: Session, generation_nos: List[str]) -> None:
+    """
+    Closes the gaps that removed leads leave in the dealing order of `generation_nos`,
+    keeping the remaining leads' relative order, and resizes their dealing cursors to
+    match. Without it, ordinals past the new count would never be dealt. Runs in the
+    session's transaction; the caller commits.
+    """
+    params = {"generation_nos": list(generation_nos)}
+    db.execute(text("""
+        UPDATE leads AS l SET deal_order = renumbered.ordinal
+        FROM (
+            SELECT id, row_number() OVER (PARTITION BY generation_no ORDER BY deal_order) - 1 AS ordinal
+            FROM leads
+            WHERE deal_order IS NOT NULL AND generation_no = ANY(CAST(:generation_nos AS text[]))
+        ) AS renumbered
+        WHERE l.id = renumbered.id AND l.deal_order <> renumbered.ordinal
+    """), params)
+    db.execute(text("""
+        UPDATE generation_cursors AS c SET lead_count = counts.lead_count
+        FROM (
+            SELECT generation_no, count(*) AS lead_count
+            FROM leads
+            WHERE deal_order IS NOT NULL AND generation_no = ANY(CAST(:generation_nos AS text[]))
+            GROUP BY generation_no
+        ) AS counts
+        WHERE c.generation_no = counts.generation_no
+    """), params)
+    # Generations with no dealt leads left have nothing to deal.
+    db.execute(text("""
+        DELETE FROM generation_cursors AS c
+        WHERE c.generation_no = ANY(CAST(:generation_nos AS text[]))
+          AND NOT EXISTS (SELECT 1 FROM leads AS l WHERE l.generation_no = c.generation_no AND l.deal_order IS NOT NULL)
+    """), params)
+
+# --- GENERATIONS CATALOG ---
+
+_AUDIO_FILENAME_COLUMNS = ["audio_filename_no_amd", "audio_filename_amd", "audio_filename_transfer", "audio_filename_voicemail"]
+
+def _deployed_audio_sizes() -> Dict[str, int]:
+    index = load_audio_index(os.path.realpath(settings.AUDIO_STORAGE_PATH)) or {}
+    return {filename: entry[0] for filename, entry in index.items()}
+
+def refresh_generations(
+    db: Session,
+    generation_nos: Optional[List[str]] = None,
+    audio_sizes: Optional[Dict[str, int]] = None,
+    imported: bool = False,
+    leads_table: str = "leads",
+    generations_table: str = "generations",
+) -> None:
+    """
+    Recomputes the catalog rows of `generation_nos` (every generation if None) from
+    `leads_table`: lead counts per status, the dealt count, and the number and size
+    of the audio files the leads point at. Sizes come from `audio_sizes`, or from
+    the deployed audio index. Generations left without leads are removed.
+    `imported` stamps imported_at; otherwise it is kept. Runs in the session's
+    transaction; the caller commits.
+
+    Only imports, uploads and deletes call this. Status changes made elsewhere
+    (the Celery audio tasks) show up at the next one of those.
+    """
+    if audio_sizes is None:
+        audio_sizes = _deployed_audio_sizes()
+    params = {"filenames": list(audio_sizes), "sizes": list(audio_sizes.values())}
+    scope = ""
+    if generation_nos is not None:
+        scope = "AND l.generation_no = ANY(CAST(:generation_nos AS text[]))"
+        params["generation_nos"] = list(generation_nos)
+    audio_values = ", ".join(f"(l.{column})" for column in _AUDIO_FILENAME_COLUMNS)
+    db.execute(text(f"""
+        WITH lead_counts AS (
+            SELECT l.generation_no,
+                   max(l.campaign_name) AS campaign_name,
+                   count(*) AS lead_count,
+                   count(*) FILTER (WHERE l.status = 'PENDING') AS pending_count,
+                   count(*) FILTER (WHERE l.status = 'PROCESSING') AS processing_count,
+                   count(*) FILTER (WHERE l.status = 'COMPLETED') AS completed_count,
+                   count(*) FILTER (WHERE l.status = 'FAILED') AS failed_count,
+                   count(l.deal_order) AS dealt_count
+            FROM {leads_table} AS l
+            WHERE l.generation_no IS NOT NULL {scope}
+            GROUP BY l.generation_no
+        ), lead_files AS (
+            SELECT DISTINCT l.generation_no, f.filename
+            FROM {leads_table} AS l
+            CROSS JOIN LATERAL (VALUES {audio_values}) AS f(filename)
+            WHERE l.generation_no IS NOT NULL AND f.filename IS NOT NULL {scope}
+        ), audio AS (
+            SELECT lf.generation_no, count(*) AS audio_file_count, coalesce(sum(sizes.bytes), 0) AS audio_bytes
+            FROM lead_files AS lf
+            LEFT JOIN (
+                SELECT unnest(CAST(:filenames AS text[])) AS filename,
+                       unnest(CAST(:sizes AS bigint[])) AS bytes
+            ) AS sizes ON sizes.filename = lf.filename
+            GROUP BY lf.generation_no
+        )
+        INSERT INTO {generations_table} (
+            generation_no, campaign_name, lead_count, pending_count, processing_count,
+            completed_count, failed_count, dealt_count, audio_file_count, audio_bytes,
+            imported_at, updated_at
+        )
+        SELECT c.generation_no, c.campaign_name, c.lead_count, c.pending_count, c.processing_count,
+               c.completed_count, c.failed_count, c.dealt_count,
+               coalesce(a.audio_file_count, 0), coalesce(a.audio_bytes, 0),
+               now(), now()
+        FROM lead_counts AS c
+        LEFT JOIN audio AS a ON a.generation_no = c.generation_no
+        ON CONFLICT (generation_no) DO UPDATE SET
+            campaign_name = EXCLUDED.campaign_name,
+            lead_count = EXCLUDED.lead_count,
+            pending_count = EXCLUDED.pending_count,
+            processing_count = EXCLUDED.processing_count,
+            completed_count = EXCLUDED.completed_count,
+            failed_count = EXCLUDED.failed_count,
+            dealt_count = EXCLUDED.dealt_count,
+            audio_file_count = EXCLUDED.audio_file_count,
+            audio_bytes = EXCLUDED.audio_bytes,
+            imported_at = {"EXCLUDED.imported_at" if imported else f"coalesce({generations_table}.imported_at, EXCLUDED.imported_at)"},
+            updated_at = EXCLUDED.updated_at
+    """), params)
+    db.execute(text(f"""
+        DELETE FROM {generations_table} AS g
+        WHERE NOT EXISTS (SELECT 1 FROM {leads_table} AS l WHERE l.generation_no = g.generation_no)
+        {scope.replace("l.generation_no", "g.generation_no")}
+    """), params)
+
+def get_generations(db: Session) -> List[Generation]:
+    return db.query(Generation).order_by(Generation.generation_no).all()
+
+def get_generation_nos(db: Session) -> List[str]:
+    return [generation_no for (generation_no,) in db.query(Generation.generation_no)]
+
+def get_generation(db: Session, generation_no: str) -> Optional[Generation]:
+    return db.query(Generation).filter(Generation.generation_no == generation_no).first()
+
+# --- STAGING TABLES FOR ZERO-DOWNTIME IMPORTS ---
+# A new campaign is loaded into "<table>_staging" copies while the live tables keep
+# serving, then all of them are swapped in with renames in one short transaction.
+
+# Listed so that a table comes after the tables its foreign keys point at; drops
+# run in reverse order.
+STAGED_TABLES = ["leads", "lead_details", "generation_cursors", "generations"]
+
+def staging_table(table: str) -> str:
+    return f"{table}_staging"
+
+def create_staging_tables(db: Session) -> None:
+    for table in reversed(STAGED_TABLES):
+        db.execute(text(f"DROP TABLE IF EXISTS {staging_table(table)}"))
+    for table in STAGED_TABLES:
+        db.execute(text(f"CREATE TABLE {staging_table(table)} (LIKE {table} INCLUDING ALL)"))
+    # LIKE does not copy foreign keys. This one follows leads_staging through the rename;
+    # constraint names are per table, so it can take the live one's name right away.
+    db.execute(text(
+        f"ALTER TABLE {staging_table('lead_details')} ADD CONSTRAINT lead_details_lead_id_fkey "
+        f"FOREIGN KEY (lead_id) REFERENCES {staging_table('leads')} (id) ON DELETE CASCADE"
+    ))
+
+# The indexes of two tables, paired by definition (the CREATE INDEX statement without
+# the index and table names). Duplicate definitions are paired in name order.
+_INDEX_PAIRS_SQL = text("""
+    WITH indexes AS (
+        SELECT i.indrelid, c.relname AS name,
+               regexp_replace(pg_get_indexdef(i.indexrelid), '^(CREATE (UNIQUE )?INDEX) \\S+ ON \\S+', '\\1') AS definition
+        FROM pg_index AS i
+        JOIN pg_class AS c ON c.oid = i.indexrelid
+        WHERE i.indrelid IN (CAST(:from_table AS regclass), CAST(:to_table AS regclass))
+    ), numbered AS (
+        SELECT *, row_number() OVER (PARTITION BY indrelid, definition ORDER BY name) AS copy
+        FROM indexes
+    )
+    SELECT f.name AS from_name, t.name AS to_name
+    FROM numbered AS f
+    JOIN numbered AS t ON t.definition = f.definition AND t.copy = f.copy
+    WHERE f.indrelid = CAST(:from_table AS regclass) AND t.indrelid = CAST(:to_table AS regclass)
+      AND f.name <> t.name
+""")
+
+def _take_over_index_names(db: Session, table: str, replaced_table: str) -> None:
+    """
+    Gives the indexes of `table` the names of the matching indexes of
+    `replaced_table`. LIKE names the staging copies after the staging table
+    (leads_staging_pkey, ...), and without this every import would leave the live
+    tables with those names, and initial_db.py would add the ix_* indexes again.
+    Renaming a primary key or unique constraint's index renames the constraint too.
+    """
+    pairs = db.execute(_INDEX_PAIRS_SQL, {"from_table": replaced_table, "to_table": table}).fetchall()
+    for number, (name, staging_name) in enumerate(pairs, start=1):
+        db.execute(text(f'ALTER INDEX "{name}" RENAME TO "{replaced_table}_{number}"'))
+        db.execute(text(f'ALTER INDEX "{staging_name}" RENAME TO "{name}"'))
+
+def swap_in_staging_tables(db: Session, lock_timeout: str = "5s") -> None:
+    """
+    Replaces the live tables with their staging copies. Each rename takes an
+    exclusive lock only for the instant of the swap; if live queries hold the
+    tables for longer than lock_timeout the swap fails and the import is aborted.
+    """
+    db.execute(text(f"SET LOCAL lock_timeout = '{lock_timeout}'"))
+    for table in reversed(STAGED_TABLES):
+        db.execute(text(f"DROP TABLE IF EXISTS {table}_old"))
+    for table in STAGED_TABLES:
+        db.execute(text(f"ALTER TABLE {table} RENAME TO {table}_old"))
+        db.execute(text(f"ALTER TABLE {staging_table(table)} RENAME TO {table}"))
+        _take_over_index_names(db, table, f"{table}_old")
+    db.commit()
+
+def drop_replaced_tables(db: Session) -> None:
+    for table in reversed(STAGED_TABLES):
+        db.execute(text(f"DROP TABLE IF EXISTS {table}_old"))
+    db.commit()
+
+def drop_staging_tables(db: Session) -> None:
+    for table in reversed(STAGED_TABLES):
+        db.execute(text(f"DROP TABLE IF EXISTS {staging_table(table)}"))
+    db.commit()
+
+# Claims the least-advanced unlocked cursor slot, advances it by :count (at most the
+# generation's size) and returns the leads at the ordinals it passed over, all in one
+# round trip. SKIP LOCKED means concurrent calls move on to another slot instead of
+# waiting on a row that is already being claimed.
+_CLAIM_DEALT_LEADS_SQL = text("""
+    WITH claimed AS (
+        SELECT generation_no, slot FROM generation_cursors
+        WHERE generation_no = :generation_no
+        ORDER BY position
+        LIMIT 1
+        FOR UPDATE SKIP LOCKED
+    ), advanced AS (
+        UPDATE generation_cursors AS c
+        SET position = c.position + LEAST(:count, c.lead_count)
+        FROM claimed
+        WHERE c.generation_no = claimed.generation_no AND c.slot = claimed.slot
+        RETURNING c.generation_no, c.slot, c.slot_count, c.position - LEAST(:count, c.lead_count) AS position, c.lead_count
+    )
+    SELECT l.phone_number, l.audio_filename_no_amd, l.audio_filename_amd,
+           l.audio_filename_transfer, l.audio_filename_voicemail
+    FROM advanced AS a
+    CROSS JOIN LATERAL generate_series(0, LEAST(:count, a.lead_count) - 1) AS step(n)
+    JOIN leads AS l
+      ON l.generation_no = a.generation_no
+     AND l.deal_order = ((a.position + step.n) * a.slot_count + a.slot) % a.lead_count
+    ORDER BY step.n
+""")
+
+def claim_dealt_leads(db: Session, generation_no: str, count: int = 1) -> List[LeadAudio]:
+    """
+    Deals the next `count` leads of a generation from its shuffled order. Returns an
+    empty list when the generation has no cursors or every cursor slot is momentarily locked.
+
+    A slot visits lead_count / gcd(slot_count, lead_count) ordinals before it comes
+    round again, so a batch larger than that would repeat leads; repeats are dropped
+    and fewer than `count` distinct leads are returned.
+    """
+    rows = db.execute(_CLAIM_DEALT_LEADS_SQL, {"generation_no": generation_no, "count": count}).all()
+    db.commit()
+    leads, seen = [], set()
+    for row in rows:
+        if row[0] not in seen:
+            seen.add(row[0])
+            leads.append(LeadAudio(*row))
+    return leads
+
+def record_lead_plays(db: Session, plays: List[Tuple[str, int, datetime]]) -> None:
+    """Adds (phone_number, play_count, last_played_at) batches to the per-lead play stats."""
+    if not plays:
+        return
+    phone_numbers, counts, played_at = zip(*plays)
+    db.execute(text("""
+        UPDATE leads
+        SET play_count = leads.play_count + v.plays,
+            last_played_at = GREATEST(leads.last_played_at, v.played_at)
+        FROM (
+            SELECT unnest(CAST(:phone_numbers AS text[])) AS phone_number,
+                   unnest(CAST(:counts AS integer[])) AS plays,
+                   unnest(CAST(:played_at AS timestamptz[])) AS played_at
+        ) AS v
+        WHERE leads.phone_number = v.phone_number
+    """), {"phone_numbers": list(phone_numbers), "counts": list(counts), "played_at": list(played_at)})
+    db.commit()
+
+# --- LEADS API: KEYSET PAGINATION ---
+
+# Columns the dashboard shows; the lead details are never read for a listing.
+LEAD_LIST_COLUMNS = [
+    "id", "phone_number", "campaign_name", "generation_no", "status",
+    "audio_filename_no_amd", "audio_filename_amd", "audio_filename_transfer", "audio_filename_voicemail",
+    "play_count", "last_played_at", "created_at",
+]
+
+def _lead_filters(generation_no: Optional[str], status: Optional[LeadStatus], phone_prefix: Optional[str]) -> Tuple[List[str], dict]:
+    conditions, params = [], {}
+    if generation_no is not None:
+        conditions.append("generation_no = :generation_no")
+        params["generation_no"] = generation_no
+    if status is not None:
+        conditions.append("status = :status")
+        params["status"] = status.value
+    if phone_prefix:
+        conditions.append("phone_number LIKE :phone_pattern")
+        escaped = phone_prefix.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        params["phone_pattern"] = f"{escaped}%"
+    return conditions, params
+
+def list_leads_page(
+    db: Session,
+    limit: int,
+    after: Optional[Tuple[datetime, uuid.UUID]] = None,
+    generation_no: Optional[str] = None,
+    status: Optional[LeadStatus] = None,
+    phone_prefix: Optional[str] = None,
+) -> list:
+    """
+    Returns up to `limit` leads, newest first, that come after the (created_at, id)
+    key `after`. Seeking on the key keeps every page as cheap as the first,
+    where OFFSET would scan and discard all the rows before it.
+    """
+    conditions, params = _lead_filters(generation_no, status, phone_prefix)
+    if after is not None:
+        conditions.append("(created_at, id) < (:after_created_at, :after_id)")
+        params.update(after_created_at=after[0], after_id=after[1])
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    params["limit"] = limit
+    return db.execute(text(f"""
+        SELECT {', '.join(LEAD_LIST_COLUMNS)} FROM leads
+        {where}
+        ORDER BY created_at DESC, id DESC
+        LIMIT :limit
+    """), params).all()
+
+def estimate_lead_count(
+    db: Session,
+    generation_no: Optional[str] = None,
+    status: Optional[LeadStatus] = None,
+    phone_prefix: Optional[str] = None,
+) -> int:
+    """
+    How many leads match, without counting them: exact from the generations
+    catalog when filtering by generation and status only, otherwise the
+    planner's estimate, which is good to within a few percent once the table
+    has been analyzed.
+    """
+    if generation_no is not None and not phone_prefix:
+        # Exact, from the generations catalog.
+        generation = get_generation(db, generation_no)
+        if generation is None:
+            return 0
+        if status is None:
+            return generation.lead_count
+        return getattr(generation, f"{status.value.lower()}_count")
+    conditions, params = _lead_filters(generation_no, status, phone_prefix)
+    if not conditions:
+        return max(int(db.execute(text("SELECT reltuples FROM pg_class WHERE oid = 'leads'::regclass")).scalar() or 0), 0)
+    plan = db.execute(text(f"EXPLAIN (FORMAT JSON) SELECT 1 FROM leads WHERE {' AND '.join(conditions)}"), params).scalar()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]["Plan"]["Plan Rows"])
 
 def get_leads(db: Session, skip: int = 0, limit: int = 100) -> List[Lead]:
     return db.query(Lead).order_by(Lead.created_at.desc()).offset(skip).limit(limit).all()
@@ -64,7 +713,11 @@ def delete_leads_by_ids(db: Session, lead_ids: List[uuid.UUID]) -> int:
                         os.remove(file_path)
                 except OSError:
                     pass
+    generation_nos = {lead.generation_no for lead in leads_to_delete if lead.generation_no}
     num_deleted = db.query(Lead).filter(Lead.id.in_(lead_ids)).delete(synchronize_session=False)
+    if generation_nos:
+        renumber_deal_order(db, generation_nos=list(generation_nos))
+        refresh_generations(db, generation_nos=list(generation_nos))
     db.commit()
     return num_deleted
 
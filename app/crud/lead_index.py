@@ -0,0 +1,279 @@
+import os
+import sys
+import mmap
+import array
+import random
+import struct
+import threading
+import time
+import logging
+from collections import namedtuple
+from typing import Dict, List, Optional, Tuple
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.crud.lead import LeadAudio
+
+logger = logging.getLogger(__name__)
+
+# --- Compiled lead index ---
+# The importer compiles the completed leads of each deploy into one read-only file,
+# and every worker maps it with mmap. Lookups then cost a binary search over memory
+# the workers share through the page cache, with no connection or query at all.
+# The database stays the source of truth: a phone number missing from the index is
+# looked up there, and the file is removed whenever leads change between imports.
+#
+# Layout (little-endian):
+#   header       magic, lead count, generation count, and the offsets of the sections below
+#   strings      each string as a u16 length and its UTF-8 bytes
+#   records      one per lead, sorted by phone number: six u32 string offsets (phone,
+#                generation, four audio filenames); NO_STRING for a missing filename
+#   lists        per generation, the u32 record numbers of its leads
+#   generations  per generation: u32 string offset, u64 list offset, u32 lead count
+
+IndexedLead = namedtuple("IndexedLead", LeadAudio._fields + ("generation_no",))
+
+MAGIC = b"LEADIDX1"
+NO_STRING = 0xFFFFFFFF
+_HEADER = struct.Struct("<8sIIQQQ")
+_RECORD = struct.Struct("<6I")
+_GENERATION = struct.Struct("<IQI")
+_LENGTH = struct.Struct("<H")
+_U32 = struct.Struct("<I")
+
+_INDEX_SQL = """
+    SELECT phone_number, generation_no, audio_filename_no_amd, audio_filename_amd,
+           audio_filename_transfer, audio_filename_voicemail
+    FROM {leads_table}
+    WHERE status = 'COMPLETED' AND generation_no IS NOT NULL
+    ORDER BY phone_number COLLATE "C"
+"""
+
+
+def compile_lead_index(db: Session, path: str, leads_table: str = "leads") -> Tuple[str, int]:
+    """
+    Writes the completed leads of `leads_table` to a new index file next to `path`
+    and returns its path and lead count. Nothing is served from it until
+    install_lead_index moves it into place. Rows are sorted by PostgreSQL with
+    the "C" collation, which orders them by their bytes, as lookups compare them.
+    """
+    tmp_path = f"{path}.tmp"
+    strings_offset = _HEADER.size
+    records = array.array("I")
+    lists: Dict[str, array.array] = {}
+    generation_refs: Dict[str, int] = {}
+    try:
+        with open(tmp_path, "wb") as f:
+            f.write(b"\0" * _HEADER.size)
+            position = 0
+
+            def add_string(value: Optional[str]) -> int:
+                nonlocal position
+                if value is None:
+                    return NO_STRING
+                data = value.encode("utf-8")
+                ref = position
+                f.write(_LENGTH.pack(len(data)))
+                f.write(data)
+                position += _LENGTH.size + len(data)
+                return ref
+
+            result = db.execute(text(_INDEX_SQL.format(leads_table=leads_table)).execution_options(stream_results=True))
+            for number, (phone_number, generation_no, *audio_filenames) in enumerate(result):
+                if generation_no not in generation_refs:
+                    generation_refs[generation_no] = add_string(generation_no)
+                    lists[generation_no] = array.array("I")
+                records.extend([add_string(phone_number), generation_refs[generation_no], *(add_string(name) for name in audio_filenames)])
+                lists[generation_no].append(number)
+            if position >= NO_STRING:
+                raise ValueError("lead index strings exceed 4 GiB")
+
+            records_offset = strings_offset + position
+            f.write(_pack_array(records))
+            generation_entries = []
+            list_offset = records_offset + len(records) * _U32.size
+            for generation_no, numbers in lists.items():
+                f.write(_pack_array(numbers))
+                generation_entries.append(_GENERATION.pack(generation_refs[generation_no], list_offset, len(numbers)))
+                list_offset += len(numbers) * _U32.size
+            generations_offset = list_offset
+            f.write(b"".join(generation_entries))
+
+            lead_count = len(records) // 6
+            f.seek(0)
+            f.write(_HEADER.pack(MAGIC, lead_count, len(lists), strings_offset, records_offset, generations_offset))
+            f.flush()
+            os.fsync(f.fileno())
+    except Exception:
+        remove_file(tmp_path)
+        raise
+    return tmp_path, lead_count
+
+
+def _pack_array(values: array.array) -> bytes:
+    if sys.byteorder != "little":
+        values = array.array("I", values)
+        values.byteswap()
+    return values.tobytes()
+
+
+def install_lead_index(tmp_path: str, path: str) -> None:
+    # os.replace is atomic, so workers map either the old index or the new one.
+    os.replace(tmp_path, path)
+
+
+def remove_file(path: str) -> None:
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def invalidate_lead_index() -> None:
+    """
+    Removes the index after leads changed outside an import. This worker stops
+    using it at once, the others at their next check; until the index is rebuilt
+    (see app.worker.importer.rebuild_lead_index) every lookup goes to the database.
+    """
+    if settings.LEAD_INDEX_ENABLED:
+        remove_file(settings.LEAD_INDEX_PATH)
+        index.drop()
+        logger.warning("Lead index removed after leads changed; lookups use the database until it is rebuilt.")
+
+
+class _MappedIndex:
+    """One open index file. Never closed explicitly: lookups still using it keep it alive."""
+
+    def __init__(self, path: str):
+        with open(path, "rb") as f:
+            self.identity = os.fstat(f.fileno()).st_ino
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.lead_count, generation_count, self.strings_offset, self.records_offset, generations_offset = _HEADER.unpack_from(self.data, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a lead index")
+        self.generations: Dict[str, Tuple[int, int]] = {}
+        for number in range(generation_count):
+            ref, list_offset, count = _GENERATION.unpack_from(self.data, generations_offset + number * _GENERATION.size)
+            self.generations[self.string(ref)] = (list_offset, count)
+
+    def raw_string(self, ref: int) -> bytes:
+        start = self.strings_offset + ref
+        (length,) = _LENGTH.unpack_from(self.data, start)
+        return self.data[start + _LENGTH.size:start + _LENGTH.size + length]
+
+    def string(self, ref: int) -> Optional[str]:
+        return None if ref == NO_STRING else self.raw_string(ref).decode("utf-8")
+
+    def record(self, number: int) -> IndexedLead:
+        phone, generation, *audio = _RECORD.unpack_from(self.data, self.records_offset + number * _RECORD.size)
+        return IndexedLead(self.string(phone), *(self.string(ref) for ref in audio), self.string(generation))
+
+    def find(self, phone_number: str) -> Optional[int]:
+        key = phone_number.encode("utf-8")
+        low, high = 0, self.lead_count
+        while low < high:
+            middle = (low + high) // 2
+            (ref,) = _U32.unpack_from(self.data, self.records_offset + middle * _RECORD.size)
+            if self.raw_string(ref) < key:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self.lead_count:
+            (ref,) = _U32.unpack_from(self.data, self.records_offset + low * _RECORD.size)
+            if self.raw_string(ref) == key:
+                return low
+        return None
+
+    def list_entry(self, list_offset: int, position: int) -> int:
+        return _U32.unpack_from(self.data, list_offset + position * _U32.size)[0]
+
+
+class LeadIndex:
+    """
+    The compiled lead index of the current deploy, as seen by one worker.
+
+    The file is re-checked every check_interval seconds and remapped when the
+    importer has replaced it. Every lookup returns nothing while there is no
+    index, and callers fall back to the database.
+    """
+
+    def __init__(self, path: str, check_interval: float):
+        self._path = path
+        self._check_interval = check_interval
+        self._index: Optional[_MappedIndex] = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    def _check(self) -> Optional[_MappedIndex]:
+        now = time.monotonic()
+        if now - self._checked_at < self._check_interval:
+            return self._index
+        with self._lock:
+            if now - self._checked_at < self._check_interval:
+                return self._index
+            self._checked_at = now
+            try:
+                identity = os.stat(self._path).st_ino
+            except FileNotFoundError:
+                if self._index is not None:
+                    logger.info("Lead index removed; lookups go to the database.")
+                self._index = None
+                return None
+            if self._index is None or self._index.identity != identity:
+                try:
+                    self._index = _MappedIndex(self._path)
+                    logger.info(f"Lead index mapped: {self._index.lead_count} leads in {len(self._index.generations)} generations.")
+                except (OSError, ValueError, struct.error) as e:
+                    logger.error(f"Could not map lead index {self._path}: {e}")
+                    self._index = None
+            return self._index
+
+    def drop(self) -> None:
+        """Stops using the mapped index now, rather than at the next check."""
+        with self._lock:
+            self._index = None
+            self._checked_at = 0.0
+
+    def get(self, phone_number: str) -> Optional[IndexedLead]:
+        index = self._check()
+        if index is None:
+            return None
+        number = index.find(phone_number)
+        if number is None:
+            self._misses += 1
+            return None
+        self._hits += 1
+        return index.record(number)
+
+    def has_generation(self, generation_no: str) -> bool:
+        index = self._check()
+        return index is not None and generation_no in index.generations
+
+    def sample(self, generation_no: str, count: int = 1) -> List[IndexedLead]:
+        """Picks up to `count` distinct completed leads of a generation."""
+        index = self._check()
+        if index is None or generation_no not in index.generations:
+            return []
+        list_offset, size = index.generations[generation_no]
+        if count == 1:
+            positions = [random.randrange(size)]
+        else:
+            positions = random.sample(range(size), min(count, size))
+        return [index.record(index.list_entry(list_offset, position)) for position in positions]
+
+    def stats(self) -> dict:
+        index = self._index
+        return {
+            "path": self._path,
+            "mapped": index is not None,
+            "leads": index.lead_count if index else 0,
+            "generations": len(index.generations) if index else 0,
+            "hits": self._hits,
+            "misses": self._misses,
+        }
+
+
+index = LeadIndex(settings.LEAD_INDEX_PATH, check_interval=settings.LEAD_POOL_CHECK_INTERVAL)
@@ -0,0 +1,150 @@
+import os
+import random
+import threading
+import time
+import uuid
+import logging
+from typing import Dict, FrozenSet, List, Optional
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.crud import lead as lead_crud
+from app.crud.lead import LeadAudio
+
+logger = logging.getLogger(__name__)
+
+# A generation found with no completed leads is not queried again for this long,
+# unless the import version changes first.
+EMPTY_GENERATION_RETRY_SECONDS = 30.0
+
+# --- Import version stamp ---
+# The importer rewrites this file after every successful deploy. Each worker compares
+# it against the version its in-memory data was built from and rebuilds when it changes.
+
+def read_import_version() -> Optional[str]:
+    try:
+        with open(settings.IMPORT_VERSION_PATH, "r") as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+def write_import_version() -> str:
+    version = uuid.uuid4().hex
+    tmp_path = f"{settings.IMPORT_VERSION_PATH}.tmp"
+    with open(tmp_path, "w") as f:
+        f.write(version)
+    # os.replace is atomic, so readers never see a half-written stamp.
+    os.replace(tmp_path, settings.IMPORT_VERSION_PATH)
+    return version
+
+def leads_changed() -> None:
+    """
+    Called after leads are added or deleted outside an import. Every worker drops
+    its lead pool and audio index on its next version check; this one at once.
+    """
+    write_import_version()
+    pool.clear()
+
+
+class LeadPool:
+    """
+    Per-worker pool of completed leads, grouped by generation_no.
+
+    Each generation is loaded from the database once, on first use, as a list of
+    LeadAudio tuples. Picking a random lead is then a single list index with no
+    database round-trip. The whole pool is dropped when the import version changes.
+    """
+
+    def __init__(self, check_interval: float):
+        self._check_interval = check_interval
+        self._generations: Dict[str, List[LeadAudio]] = {}
+        # generation_no -> monotonic time until which it is known to be empty.
+        self._empty: Dict[str, float] = {}
+        # generation_nos of the generations catalog, read on first use.
+        self._catalog: Optional[FrozenSet[str]] = None
+        self._version: Optional[str] = read_import_version()
+        self._checked_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _check_version(self) -> None:
+        now = time.monotonic()
+        if now - self._checked_at < self._check_interval:
+            return
+        self._checked_at = now
+        version = read_import_version()
+        if version != self._version:
+            with self._lock:
+                self._generations = {}
+                self._empty = {}
+                self._catalog = None
+                self._version = version
+            logger.info(f"Import version changed to {version}; lead pool cleared.")
+
+    def _load(self, db: Session, generation_no: str) -> List[LeadAudio]:
+        # The query runs without holding the lock: on the async engine it runs in a
+        # greenlet on the event loop thread, where blocking on a lock would deadlock.
+        # Two requests loading the same generation at once is harmless.
+        version = self._version
+        leads = lead_crud.get_completed_lead_audio_by_generation(db, generation_no=generation_no)
+        with self._lock:
+            if version == self._version:
+                if leads:
+                    self._generations[generation_no] = leads
+                else:
+                    # Remembered only for a while, so leads completed later are still found.
+                    self._empty[generation_no] = time.monotonic() + EMPTY_GENERATION_RETRY_SECONDS
+        if leads:
+            logger.info(f"Lead pool loaded {len(leads)} completed leads for generation {generation_no}.")
+        return leads
+
+    def is_known_empty(self, generation_no: str) -> bool:
+        retry_at = self._empty.get(generation_no)
+        return retry_at is not None and time.monotonic() < retry_at
+
+    @staticmethod
+    def _choose(leads: List[LeadAudio], count: int) -> List[LeadAudio]:
+        if count == 1:
+            return [leads[random.randrange(len(leads))]]
+        # Distinct leads, capped at the size of the generation.
+        return random.sample(leads, min(count, len(leads)))
+
+    def sample_cached(self, generation_no: str, count: int = 1) -> List[LeadAudio]:
+        """Picks leads only if the generation is already loaded; never touches the database."""
+        self._check_version()
+        leads = self._generations.get(generation_no)
+        if not leads:
+            return []
+        return self._choose(leads, count)
+
+    def sample(self, db: Session, generation_no: str, count: int = 1) -> List[LeadAudio]:
+        picked = self.sample_cached(generation_no, count)
+        if picked or self.is_known_empty(generation_no):
+            return picked
+        leads = self._load(db, generation_no)
+        if not leads:
+            return []
+        return self._choose(leads, count)
+
+    def catalog_cached(self) -> Optional[FrozenSet[str]]:
+        """The generation_nos of the generations catalog, or None when not loaded yet."""
+        self._check_version()
+        return self._catalog
+
+    def load_catalog(self, db: Session) -> FrozenSet[str]:
+        # The catalog only changes with imports, uploads and deletes, which all
+        # change the import version.
+        version = self._version
+        catalog = frozenset(lead_crud.get_generation_nos(db))
+        with self._lock:
+            if version == self._version:
+                self._catalog = catalog
+        return catalog
+
+    def clear(self) -> None:
+        with self._lock:
+            self._generations = {}
+            self._empty = {}
+            self._catalog = None
+
+
+pool = LeadPool(check_interval=settings.LEAD_POOL_CHECK_INTERVAL)
@@ -0,0 +1,62 @@
+import threading
+import time
+import logging
+from datetime import datetime, timezone
+from typing import Dict, List
+
+from app.core.config import settings
+from app.db.session import SessionLocal
+from app.crud import lead as lead_crud
+
+logger = logging.getLogger(__name__)
+
+
+class PlayStatsRecorder:
+    """
+    Buffers per-lead play counts in memory and writes them to the database in
+    batches from a background thread, so recording a play never adds a write
+    to the request path. Plays still buffered when a worker dies are lost.
+    """
+
+    def __init__(self, flush_interval: float):
+        self._flush_interval = flush_interval
+        self._pending: Dict[str, List] = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def record(self, lead_key: str) -> None:
+        now = datetime.now(timezone.utc)
+        with self._lock:
+            entry = self._pending.get(lead_key)
+            if entry is None:
+                self._pending[lead_key] = [1, now]
+            else:
+                entry[0] += 1
+                entry[1] = now
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="play-stats-flusher", daemon=True)
+                self._thread.start()
+
+    def flush(self) -> int:
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+        plays = [(lead_key, count, played_at) for lead_key, (count, played_at) in pending.items()]
+        db = SessionLocal()
+        try:
+            lead_crud.record_lead_plays(db, plays)
+        finally:
+            db.close()
+        return len(plays)
+
+    def _run(self) -> None:
+        while True:
+            time.sleep(self._flush_interval)
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Failed to flush lead play stats: {e}", exc_info=True)
+
+
+recorder = PlayStatsRecorder(flush_interval=settings.PLAY_STATS_FLUSH_INTERVAL)
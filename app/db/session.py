@@ -1,6 +1,133 @@
+import threading
+import time
 from sqlalchemy import create_engine
+from sqlalchemy.engine.url import make_url
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool
+from starlette.concurrency import run_in_threadpool
 from app.core.config import settings
 
-engine = create_engine(settings.DATABASE_URL, pool_pre_ping=True)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
\ No newline at end of file
+# Request profiling hooks in only when enabled.
+profiling = None
+if settings.PROFILING_ENABLED:
+    from app.core import profiling
+
+# --- Connection pool wait accounting ---
+
+class PoolWaitStats:
+    """Running totals of how long callers waited to check a connection out of a pool."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def record(self, seconds: float) -> None:
+        with self._lock:
+            self.checkouts += 1
+            self.total_wait += seconds
+            if seconds > self.max_wait:
+                self.max_wait = seconds
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "checkouts": self.checkouts,
+                "wait_total_ms": round(self.total_wait * 1000, 3),
+                "wait_avg_ms": round(self.total_wait * 1000 / self.checkouts, 3) if self.checkouts else 0.0,
+                "wait_max_ms": round(self.max_wait * 1000, 3),
+            }
+
+class TimedQueuePool(QueuePool):
+    # Kept on the class so the numbers survive pool.recreate() after engine.dispose().
+    wait_stats = PoolWaitStats()
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            waited = time.perf_counter() - started
+            self.wait_stats.record(waited)
+            if profiling is not None:
+                profiling.record_pool_wait(waited)
+
+class TimedAsyncAdaptedQueuePool(AsyncAdaptedQueuePool):
+    wait_stats = PoolWaitStats()
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            waited = time.perf_counter() - started
+            self.wait_stats.record(waited)
+            if profiling is not None:
+                profiling.record_pool_wait(waited)
+
+_pool_options = dict(
+    pool_size=settings.DB_POOL_SIZE,
+    max_overflow=settings.DB_MAX_OVERFLOW,
+    pool_timeout=settings.DB_POOL_TIMEOUT,
+    pool_recycle=settings.DB_POOL_RECYCLE,
+    pool_pre_ping=settings.DB_POOL_PRE_PING,
+)
+
+engine = create_engine(settings.DATABASE_URL, poolclass=TimedQueuePool, **_pool_options)
+SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+# --- Optional async engine for the hot Vicidial endpoints ---
+
+async_engine = None
+AsyncSessionLocal = None
+
+if settings.DB_ASYNC_ENABLED:
+    from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+
+    async_url = settings.ASYNC_DATABASE_URL or make_url(settings.DATABASE_URL).set(drivername="postgresql+asyncpg")
+    async_engine = create_async_engine(async_url, poolclass=TimedAsyncAdaptedQueuePool, **_pool_options)
+    AsyncSessionLocal = sessionmaker(async_engine, class_=AsyncSession, autocommit=False, autoflush=False, expire_on_commit=False)
+
+if profiling is not None:
+    profiling.watch_engine(engine)
+    if async_engine is not None:
+        profiling.watch_engine(async_engine.sync_engine)
+
+def _run_with_session(fn, *args, **kwargs):
+    db = SessionLocal()
+    try:
+        return fn(db, *args, **kwargs)
+    finally:
+        db.close()
+
+async def run_db(fn, *args, **kwargs):
+    """
+    Runs a sync CRUD function `fn(db, *args, **kwargs)` from an async handler.
+
+    With DB_ASYNC_ENABLED the function runs on the async engine through
+    AsyncSession.run_sync, so no threadpool thread is held while waiting on
+    PostgreSQL. Otherwise it runs in the threadpool with a regular session.
+    """
+    if AsyncSessionLocal is not None:
+        async with AsyncSessionLocal() as db:
+            return await db.run_sync(fn, *args, **kwargs)
+    profile = profiling.current() if profiling is not None else None
+    if profile is not None:
+        # Time spent queued for a thread is part of a profiled request's report.
+        return await run_in_threadpool(profiling.profiled_call, profile, time.perf_counter(), _run_with_session, fn, *args, **kwargs)
+    return await run_in_threadpool(_run_with_session, fn, *args, **kwargs)
+
+def pool_stats() -> dict:
+    def describe(pool, wait_stats):
+        return {
+            "size": pool.size(),
+            "checked_in": pool.checkedin(),
+            "checked_out": pool.checkedout(),
+            "overflow": pool.overflow(),
+            **wait_stats.snapshot(),
+        }
+    stats = {"sync": describe(engine.pool, TimedQueuePool.wait_stats)}
+    if async_engine is not None:
+        stats["async"] = describe(async_engine.sync_engine.pool, TimedAsyncAdaptedQueuePool.wait_stats)
+    return stats
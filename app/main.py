@@ -1,19 +1,42 @@
 from fastapi import FastAPI
 from fastapi.staticfiles import StaticFiles
-from app.api.v1.endpoints import frontend, vicidial, importer
+from app.api.v1.endpoints import frontend, vicidial, importer, leads, metrics as metrics_endpoint
+from app.api.audio import audio_files
 from app.core.config import settings
+from app.crud.play_stats import recorder as play_stats
+from app.core import metrics
 import os
 
 app = FastAPI(title="Vicidial Playback Service")
 
+if settings.METRICS_ENABLED:
+    app.add_middleware(metrics.MetricsMiddleware)
+if settings.PROFILING_ENABLED:
+    from app.core import profiling
+    app.add_middleware(profiling.ProfilingMiddleware)
+
 # Create storage directories if they don't exist
 os.makedirs(settings.AUDIO_STORAGE_PATH, exist_ok=True)
 
 # Mount the local audio directory
 app.mount("/static", StaticFiles(directory="static"), name="static")
-app.mount("/audio", StaticFiles(directory=settings.AUDIO_STORAGE_PATH), name="audio")
+# Audio gets a dedicated server with precomputed validators, Range support and an optional memory cache.
+app.mount("/audio", audio_files, name="audio")
 
 # Include only the necessary routers
 app.include_router(frontend.router, tags=["Frontend GUI"])
 app.include_router(vicidial.router, prefix="/api/v1/vicidial", tags=["Vicidial API"])
 app.include_router(importer.router, prefix="/api/v1/importer", tags=["Campaign Importer API"])
+app.include_router(leads.router, prefix="/api/v1/leads", tags=["Leads API"])
+app.include_router(metrics_endpoint.router)
+
+@app.on_event("startup")
+def start_metrics():
+    metrics.registry.start()
+
+@app.on_event("shutdown")
+def flush_play_stats():
+    # Write out play counts still buffered in this worker before it exits.
+    play_stats.flush()
+    if settings.METRICS_ENABLED:
+        metrics.registry.write_snapshot()
@@ -1,7 +1,8 @@
 import uuid
-from sqlalchemy import Column, String, JSON, DateTime, func, Enum as SQLAlchemyEnum, Text, Boolean, ForeignKey
+from sqlalchemy import Column, String, JSON, DateTime, func, Enum as SQLAlchemyEnum, Text, Boolean, ForeignKey, Integer, BigInteger, Index
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.ext.associationproxy import association_proxy
 from sqlalchemy.orm import relationship
 from enum import Enum as PythonEnum
 
@@ -13,22 +14,71 @@ class LeadStatus(str, PythonEnum):
     COMPLETED = "COMPLETED"
     FAILED = "FAILED"
 
+# Columns kept in lead_details rather than on the hot leads table.
+LEAD_DETAIL_FIELDS = [
+    "lead_data",
+    "llm_input_no_amd", "llm_output_no_amd", "llm_input_amd", "llm_output_amd",
+    "llm_input_transfer", "llm_output_transfer", "llm_input_voicemail", "llm_output_voicemail",
+]
+
+def _detail_proxy(field: str):
+    # Lets lead.lead_data, lead.llm_output_amd, ... keep working; the detail row is created on first write.
+    return association_proxy("details", field, creator=lambda value: LeadDetail(**{field: value}))
+
 class Lead(Base):
+    """
+    The narrow serving row of a lead: everything the dialer lookups read. The
+    lead's original CSV data and the LLM prompts and outputs live in LeadDetail,
+    so lookups never read or hydrate them.
+    """
     __tablename__ = "leads"
+    __table_args__ = (
+        # Used by "deal" selection to fetch the lead at a given ordinal within a generation.
+        Index("ix_leads_generation_deal_order", "generation_no", "deal_order"),
+        # Keyset pagination of the dashboard's leads API, newest first.
+        Index("ix_leads_created_at_id", "created_at", "id"),
+        # Phone-prefix search with LIKE 'prefix%' regardless of the database collation.
+        Index("ix_leads_phone_number_pattern", "phone_number", postgresql_ops={"phone_number": "text_pattern_ops"}),
+    )
 
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     phone_number = Column(String, nullable=False, unique=True, index=True)
     campaign_name = Column(String, index=True)
     generation_no = Column(String, index=True, nullable=True)
-    lead_data = Column(JSON, nullable=False)
-    
+
     status = Column(SQLAlchemyEnum(LeadStatus), nullable=False, default=LeadStatus.PENDING)
     
     audio_filename_no_amd = Column(String, nullable=True)
     audio_filename_amd = Column(String, nullable=True)
     audio_filename_transfer = Column(String, nullable=True)
     audio_filename_voicemail = Column(String, nullable=True)
-    
+
+    # Position of this lead in its generation's shuffled dealing order (completed leads only).
+    deal_order = Column(Integer, nullable=True)
+    play_count = Column(Integer, nullable=False, default=0, server_default="0")
+    last_played_at = Column(DateTime(timezone=True), nullable=True)
+
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), onupdate=func.now())
+
+    details = relationship("LeadDetail", uselist=False, back_populates="lead", cascade="all, delete-orphan", passive_deletes=True)
+
+    lead_data = _detail_proxy("lead_data")
+    llm_input_no_amd = _detail_proxy("llm_input_no_amd")
+    llm_output_no_amd = _detail_proxy("llm_output_no_amd")
+    llm_input_amd = _detail_proxy("llm_input_amd")
+    llm_output_amd = _detail_proxy("llm_output_amd")
+    llm_input_transfer = _detail_proxy("llm_input_transfer")
+    llm_output_transfer = _detail_proxy("llm_output_transfer")
+    llm_input_voicemail = _detail_proxy("llm_input_voicemail")
+    llm_output_voicemail = _detail_proxy("llm_output_voicemail")
+
+class LeadDetail(Base):
+    """The wide, rarely read part of a lead: its CSV data and the LLM text behind each audio."""
+    __tablename__ = "lead_details"
+    lead_id = Column(UUID(as_uuid=True), ForeignKey("leads.id", ondelete="CASCADE"), primary_key=True)
+    lead_data = Column(JSON, nullable=False)
+
     llm_input_no_amd = Column(Text, nullable=True)
     llm_output_no_amd = Column(Text, nullable=True)
     llm_input_amd = Column(Text, nullable=True)
@@ -37,9 +87,47 @@ class Lead(Base):
     llm_output_transfer = Column(Text, nullable=True)
     llm_input_voicemail = Column(Text, nullable=True)
     llm_output_voicemail = Column(Text, nullable=True)
-    
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
-    updated_at = Column(DateTime(timezone=True), onupdate=func.now())
+
+    lead = relationship("Lead", back_populates="details")
+
+class GenerationCursor(Base):
+    """
+    One of several dealing cursors for a generation. Each slot deals every
+    slot_count-th ordinal, so concurrent calls can claim different slots
+    instead of queueing on a single row.
+    """
+    __tablename__ = "generation_cursors"
+    generation_no = Column(String, primary_key=True)
+    slot = Column(Integer, primary_key=True)
+    slot_count = Column(Integer, nullable=False)
+    position = Column(BigInteger, nullable=False, default=0)
+    lead_count = Column(Integer, nullable=False)
+
+class Generation(Base):
+    """
+    Catalog of the generations on this server, with their lead and audio totals.
+    Rebuilt from the leads by the importer, bulk_create_leads and lead deletes, so
+    pages and lookups that need a generation's size never aggregate the leads table.
+    Status changes made by the Celery audio tasks are only counted at the next of those.
+    """
+    __tablename__ = "generations"
+    generation_no = Column(String, primary_key=True)
+    campaign_name = Column(String, nullable=True)
+
+    lead_count = Column(Integer, nullable=False, default=0)
+    pending_count = Column(Integer, nullable=False, default=0)
+    processing_count = Column(Integer, nullable=False, default=0)
+    completed_count = Column(Integer, nullable=False, default=0)
+    failed_count = Column(Integer, nullable=False, default=0)
+    # Completed leads with a deal_order, numbered 0 .. dealt_count - 1.
+    dealt_count = Column(Integer, nullable=False, default=0)
+
+    # Distinct audio files the generation's leads point at, and their size on disk.
+    audio_file_count = Column(Integer, nullable=False, default=0)
+    audio_bytes = Column(BigInteger, nullable=False, default=0)
+
+    imported_at = Column(DateTime(timezone=True), nullable=True)
+    updated_at = Column(DateTime(timezone=True), nullable=True)
 
 class VoiceGroup(Base):
     __tablename__ = "voice_groups"
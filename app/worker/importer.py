@@ -0,0 +1,568 @@
+import os
+import io
+import re
+import json
+import time
+import uuid
+import fcntl
+import shutil
+import hashlib
+import threading
+import logging
+import tempfile
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+
+from app.db.session import SessionLocal
+from app.core.config import settings
+from app.core import manifest as package_manifest
+from app.core import audio_variants, metrics
+from app.core.audio_index import load_audio_index, write_audio_index
+from app.crud import lead as lead_crud, lead_pool, lead_index
+
+logger = logging.getLogger(__name__)
+
+# Campaign imports run here, off the event loop, one at a time. Job state is kept in
+# JSON files under IMPORT_JOBS_PATH rather than in memory, so a progress poll answered
+# by a different Gunicorn worker than the one that accepted the upload still sees it.
+
+_JOB_ID_RE = re.compile(r"^[0-9a-f]{32}$")
+_KEEP_FINISHED_JOBS = 50
+
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="campaign-import")
+
+_PLACEMENT_CHUNK_BYTES = 1024 * 1024
+
+# Audio versions kept besides the current one, for workers still serving them.
+_KEEP_PREVIOUS_VERSIONS = 1
+
+# Asterisk-native formats every imported audio file is converted to. Parsed here so a
+# typo in AUDIO_TRANSCODE_FORMATS stops the app at startup rather than failing imports.
+_TRANSCODE_FORMATS = audio_variants.parse_formats(settings.AUDIO_TRANSCODE_FORMATS)
+
+
+class PackageError(ValueError):
+    """The uploaded package is malformed; reported to the user rather than logged as a crash."""
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+class ImportJob:
+    def __init__(self, job_id: str, state: dict):
+        self.id = job_id
+        self.state = state
+
+    @staticmethod
+    def _path(job_id: str) -> str:
+        return os.path.join(settings.IMPORT_JOBS_PATH, f"{job_id}.json")
+
+    @classmethod
+    def create(cls) -> "ImportJob":
+        job_id = uuid.uuid4().hex
+        job = cls(job_id, {
+            "id": job_id,
+            "status": "queued",
+            "phase": None,
+            "phases": [],
+            "message": "Waiting for any running import to finish...",
+            "lead_count": None,
+            "error": None,
+            "created_at": _now(),
+            "finished_at": None,
+        })
+        job.save()
+        return job
+
+    @classmethod
+    def load(cls, job_id: str) -> Optional["ImportJob"]:
+        if not _JOB_ID_RE.match(job_id):
+            return None
+        try:
+            with open(cls._path(job_id), "r") as f:
+                return cls(job_id, json.load(f))
+        except FileNotFoundError:
+            return None
+
+    def save(self) -> None:
+        path = self._path(self.id)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.state, f)
+        os.replace(tmp_path, path)
+
+    def update(self, **fields) -> None:
+        self.state.update(fields)
+        self.save()
+
+    @contextmanager
+    def phase(self, name: str, message: str):
+        """Records how long one stage of the import takes."""
+        logger.info(message)
+        self.update(phase=name, message=message)
+        started = time.perf_counter()
+        timing = {"name": name, "seconds": None}
+        try:
+            yield timing
+        finally:
+            timing["seconds"] = round(time.perf_counter() - started, 3)
+            metrics.import_phase_seconds.observe(timing["seconds"], name)
+            self.state["phases"].append(timing)
+            self.save()
+            logger.info(f"Import phase '{name}' took {timing['seconds']}s.")
+
+
+@contextmanager
+def _import_lock():
+    # Serializes imports across every worker process on this machine.
+    with open(os.path.join(settings.IMPORT_JOBS_PATH, ".lock"), "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _prune_finished_jobs() -> None:
+    paths = [os.path.join(settings.IMPORT_JOBS_PATH, name) for name in os.listdir(settings.IMPORT_JOBS_PATH) if name.endswith(".json")]
+    paths.sort(key=os.path.getmtime, reverse=True)
+    for path in paths[_KEEP_FINISHED_JOBS:]:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def _replace_symlink(link_path: str, target: str) -> None:
+    tmp_link = f"{link_path}.tmp"
+    if os.path.lexists(tmp_link):
+        os.remove(tmp_link)
+    os.symlink(target, tmp_link)
+    # os.replace is atomic, so readers see either the old or the new directory.
+    os.replace(tmp_link, link_path)
+
+
+def _point_audio_storage_at(version_dir: str) -> None:
+    """Atomically repoints the AUDIO_STORAGE_PATH symlink at a new audio version directory."""
+    link_path = settings.AUDIO_STORAGE_PATH.rstrip("/")
+    if os.path.isdir(link_path) and not os.path.islink(link_path):
+        # First versioned import on this server: move the old plain directory aside so
+        # the symlink can take its place. It is deleted with the other old versions.
+        legacy_dir = os.path.join(settings.AUDIO_VERSIONS_PATH, f"legacy-{uuid.uuid4().hex}")
+        os.rename(link_path, legacy_dir)
+    _replace_symlink(link_path, version_dir)
+    if settings.ASTERISK_SOUNDS_PATH:
+        _point_asterisk_sounds_at(version_dir)
+
+
+def _point_asterisk_sounds_at(version_dir: str) -> None:
+    """
+    Repoints ASTERISK_SOUNDS_PATH at the new audio version, so Asterisk plays the
+    files straight from disk. Only a symlink is ever replaced there; a real
+    directory is left alone, since it may hold sounds this app does not own.
+    """
+    link_path = settings.ASTERISK_SOUNDS_PATH.rstrip("/")
+    if os.path.exists(link_path) and not os.path.islink(link_path):
+        logger.error(f"ASTERISK_SOUNDS_PATH {link_path} exists and is not a symlink; Asterisk will not see the new campaign's audio.")
+        return
+    os.makedirs(os.path.dirname(link_path), exist_ok=True)
+    _replace_symlink(link_path, version_dir)
+
+
+def _remove_replaced_versions() -> None:
+    """
+    Deletes the replaced campaign's tables and every audio version except the
+    current one and the one before it. Workers keep serving the previous version
+    until they notice the new import version, so it is only deleted by the next
+    import's cleanup. Runs on the import executor under the import lock, after the
+    import, so it never sees a version directory that is still being built.
+    """
+    started = time.perf_counter()
+    with _import_lock():
+        db = SessionLocal()
+        try:
+            lead_crud.drop_replaced_tables(db)
+        except Exception as e:
+            logger.error(f"Failed to drop replaced lead tables: {e}", exc_info=True)
+        finally:
+            db.close()
+        current = os.path.realpath(settings.AUDIO_STORAGE_PATH)
+        replaced = []
+        for name in os.listdir(settings.AUDIO_VERSIONS_PATH):
+            path = os.path.join(settings.AUDIO_VERSIONS_PATH, name)
+            if os.path.isdir(path) and not os.path.islink(path) and os.path.realpath(path) != current:
+                replaced.append((os.path.getmtime(path), path))
+        # Newest first: the previous version is kept.
+        replaced.sort(reverse=True)
+        for _, path in replaced[_KEEP_PREVIOUS_VERSIONS:]:
+            shutil.rmtree(path, ignore_errors=True)
+    logger.info(f"Removed replaced campaign data in {time.perf_counter() - started:.3f}s.")
+
+
+def _cleanup_after_import() -> None:
+    try:
+        _remove_replaced_versions()
+    except Exception as e:
+        logger.error(f"Failed to remove replaced campaign data: {e}", exc_info=True)
+
+
+def _audio_members(zip_ref: zipfile.ZipFile) -> List[zipfile.ZipInfo]:
+    members = []
+    for info in zip_ref.infolist():
+        if not info.filename.startswith("audio/") or info.is_dir():
+            continue
+        # Only flat "audio/<name>" entries are accepted, so a member can never be
+        # written outside the version directory.
+        filename = info.filename[len("audio/"):]
+        if not filename or filename != os.path.basename(filename) or filename in (".", ".."):
+            raise PackageError(f"unexpected audio entry: {info.filename}")
+        members.append(info)
+    return members
+
+
+def _place_audio_members(zip_path: str, members: List[zipfile.ZipInfo], dest_dir: str) -> Tuple[int, Dict[str, str]]:
+    """
+    Writes audio members straight from the package to their final location in a
+    single pass, using a bounded pool of threads. Each file is hashed as it is
+    written, for the audio index. Returns the bytes written and the sha256 per file.
+    """
+    local = threading.local()
+    opened = []
+
+    def place(info: zipfile.ZipInfo) -> Tuple[str, str]:
+        # ZipFile objects are not safe to share between threads, so each thread opens its own.
+        zip_ref = getattr(local, "zip_ref", None)
+        if zip_ref is None:
+            zip_ref = local.zip_ref = zipfile.ZipFile(zip_path, "r")
+            opened.append(zip_ref)
+        filename = info.filename[len("audio/"):]
+        digest = hashlib.sha256()
+        with zip_ref.open(info) as src, open(os.path.join(dest_dir, filename), "wb") as dst:
+            for chunk in iter(lambda: src.read(_PLACEMENT_CHUNK_BYTES), b""):
+                digest.update(chunk)
+                dst.write(chunk)
+        return filename, digest.hexdigest()
+
+    try:
+        with ThreadPoolExecutor(max_workers=settings.IMPORT_IO_WORKERS, thread_name_prefix="audio-placement") as pool:
+            digests = dict(pool.map(place, members))
+        return sum(info.file_size for info in members), digests
+    finally:
+        for zip_ref in opened:
+            zip_ref.close()
+
+
+def _import_package(job: ImportJob, zip_path: str) -> int:
+    """
+    Deploys a full or delta package while the current campaign keeps serving.
+    Nothing is extracted to a temporary directory: leads.csv is streamed from the
+    package and audio members are written directly to their final location.
+    """
+    try:
+        package_zip = zipfile.ZipFile(zip_path, "r")
+    except zipfile.BadZipFile:
+        raise PackageError("the file is not a valid .zip archive.")
+    with package_zip:
+        if "leads.csv" not in package_zip.namelist():
+            raise PackageError("leads.csv not found.")
+        manifest = _read_manifest(package_zip)
+        audio_members = _audio_members(package_zip)
+        if manifest and manifest.get("delta"):
+            lead_count = _apply_delta_package(job, package_zip, zip_path, audio_members, manifest)
+        else:
+            lead_count = _load_package(job, package_zip, zip_path, audio_members)
+
+    package_manifest.save_deployed_manifest(manifest)
+
+    # Tell every worker to rebuild its in-memory lead pool from the new data.
+    import_version = lead_pool.write_import_version()
+    logger.info(f"Import version stamp updated to {import_version}.")
+
+    # Queued behind this import, so it runs once the import lock is released.
+    _executor.submit(_cleanup_after_import)
+    return lead_count
+
+
+def _read_manifest(package_zip: zipfile.ZipFile) -> Optional[dict]:
+    if package_manifest.MANIFEST_FILENAME not in package_zip.namelist():
+        return None
+    try:
+        manifest = json.loads(package_zip.read(package_manifest.MANIFEST_FILENAME).decode("utf-8"))
+        package_manifest.validate_manifest(manifest)
+    except (ValueError, AttributeError) as e:
+        raise PackageError(f"{package_manifest.MANIFEST_FILENAME} is invalid: {e}")
+    return manifest
+
+
+def _new_version_dir(job: ImportJob) -> str:
+    return os.path.join(settings.AUDIO_VERSIONS_PATH, f"{datetime.now():%Y%m%d%H%M%S}-{job.id[:8]}")
+
+
+def _link_or_copy(src_path: str, dest_path: str) -> None:
+    # A hard link shares the file's data, so unchanged audio costs no I/O at all.
+    try:
+        os.link(src_path, dest_path)
+    except OSError:
+        shutil.copy2(src_path, dest_path)
+
+
+def _reuse_deployed_files(filenames: List[str], src_dir: str, dest_dir: str) -> None:
+    with ThreadPoolExecutor(max_workers=settings.IMPORT_IO_WORKERS, thread_name_prefix="audio-placement") as pool:
+        list(pool.map(lambda name: _link_or_copy(os.path.join(src_dir, name), os.path.join(dest_dir, name)), filenames))
+
+
+def _transcode_audio(job: ImportJob, version_dir: str, filenames: List[str], digests: Dict[str, str]) -> None:
+    """
+    Adds the AUDIO_TRANSCODE_FORMATS variants of the given files to a version
+    directory, on a process pool, and records their hashes in `digests` for the
+    audio index. Files that cannot be decoded keep only their original.
+    """
+    if not _TRANSCODE_FORMATS:
+        return
+    # Imported lazily so NumPy is only needed on servers that transcode.
+    from app.worker import transcode
+
+    sources = [name for name in filenames if not audio_variants.is_variant(name)]
+    with job.phase("transcode", f"Converting {len(sources)} audio files to {', '.join(_TRANSCODE_FORMATS)}...") as timing:
+        variants, failed = transcode.transcode_files(
+            [os.path.join(version_dir, name) for name in sources],
+            version_dir,
+            _TRANSCODE_FORMATS,
+            workers=settings.AUDIO_TRANSCODE_WORKERS,
+        )
+        digests.update(variants)
+        timing["files"] = len(sources)
+        timing["variants"] = len(variants)
+        timing["failed"] = len(failed)
+    for filename, error in list(failed.items())[:20]:
+        logger.warning(f"Could not transcode {filename}: {error}. Only the original will be served.")
+    if len(failed) > 20:
+        logger.warning(f"... and {len(failed) - 20} more audio files could not be transcoded.")
+
+
+def _compile_lead_index(job: ImportJob, db, leads_table: str = "leads") -> Optional[str]:
+    """Compiles the lead index for the new campaign. Returns the file to install at the swap, if enabled."""
+    if not settings.LEAD_INDEX_ENABLED:
+        return None
+    with job.phase("lead_index", "Compiling the lead index...") as timing:
+        index_path, timing["leads"] = lead_index.compile_lead_index(db, settings.LEAD_INDEX_PATH, leads_table=leads_table)
+    return index_path
+
+
+def _rebuild_lead_index() -> None:
+    started = time.perf_counter()
+    with _import_lock():
+        db = SessionLocal()
+        try:
+            index_path, lead_count = lead_index.compile_lead_index(db, settings.LEAD_INDEX_PATH)
+            lead_index.install_lead_index(index_path, settings.LEAD_INDEX_PATH)
+        except Exception as e:
+            logger.error(f"Failed to rebuild the lead index; lookups use the database until the next import: {e}", exc_info=True)
+            return
+        finally:
+            db.close()
+    logger.info(f"Rebuilt the lead index with {lead_count} leads in {time.perf_counter() - started:.3f}s.")
+
+
+def rebuild_lead_index() -> None:
+    """
+    Queues a recompile of the lead index from the live leads, after leads were
+    uploaded or deleted outside an import. It runs on the import executor, under
+    the import lock, so it never overwrites the index of an import in progress.
+    """
+    if settings.LEAD_INDEX_ENABLED:
+        _executor.submit(_rebuild_lead_index)
+
+
+def _apply_delta_package(job: ImportJob, package_zip: zipfile.ZipFile, zip_path: str, audio_members: List[zipfile.ZipInfo], manifest: dict) -> int:
+    """
+    Applies a delta package: only the leads and audio files that changed are in it.
+    Unchanged audio is hard-linked from the deployed version into the new one, and
+    the changed leads are merged into the live table in a single transaction.
+    """
+    deployed = package_manifest.load_deployed_manifest()
+    if not deployed or package_manifest.manifest_digest(deployed) != manifest["base_manifest"]:
+        raise PackageError("this delta package was built against a different deployment. Import a full package instead.")
+
+    shipped = {info.filename[len("audio/"):] for info in audio_members}
+    reused = [name for name in manifest["files"] if name not in shipped]
+    for name in reused:
+        if deployed["files"].get(name) != manifest["files"][name]:
+            raise PackageError(f"audio file {name} is neither in the package nor unchanged on this server.")
+
+    current_dir = os.path.realpath(settings.AUDIO_STORAGE_PATH)
+    current_index = load_audio_index(current_dir) or {}
+    # Transcoded variants of unchanged files are reused as well; files missing one of
+    # the configured variants are transcoded again below.
+    reused_variants = {}
+    needs_transcode = list(shipped)
+    for name in reused:
+        variants = [audio_variants.variant_filename(name, codec) for codec in _TRANSCODE_FORMATS]
+        if all(variant in current_index for variant in variants):
+            reused_variants.update((variant, current_index[variant][2]) for variant in variants)
+        else:
+            needs_transcode.append(name)
+
+    version_dir = _new_version_dir(job)
+    db = SessionLocal()
+    try:
+        with job.phase("audio_placement", "Placing changed audio files and linking unchanged ones...") as timing:
+            os.makedirs(version_dir)
+            _reuse_deployed_files(reused + list(reused_variants), current_dir, version_dir)
+            timing["bytes"], digests = _place_audio_members(zip_path, audio_members, version_dir)
+            timing["files"] = len(audio_members)
+            timing["reused_files"] = len(reused)
+        # Reused files were checked against the manifest above, so their hashes are known.
+        digests.update((name, manifest["files"][name]) for name in reused)
+        digests.update(reused_variants)
+        _transcode_audio(job, version_dir, needs_transcode, digests)
+        audio_sizes = write_audio_index(version_dir, digests)
+
+        with job.phase("merge", "Merging changed leads into the live table..."):
+            with package_zip.open("leads.csv") as raw_csv, io.TextIOWrapper(raw_csv, encoding='utf-8', newline='') as csvfile:
+                upserted, deleted = lead_crud.apply_lead_delta(db, csvfile, keep_ids=list(manifest["leads"]))
+            lead_crud.assign_deal_order(db, slots=settings.DEAL_CURSOR_SLOTS)
+
+        with job.phase("catalog", "Updating the generations catalog..."):
+            lead_crud.refresh_generations(db, audio_sizes=audio_sizes, imported=True)
+        index_path = _compile_lead_index(job, db)
+        logger.info(f"Delta import: {upserted} leads inserted or updated, {deleted} removed, {len(reused)} audio files reused.")
+
+        with job.phase("swap", "Switching live traffic to the new campaign..."):
+            db.commit()
+            _point_audio_storage_at(version_dir)
+            if index_path:
+                lead_index.install_lead_index(index_path, settings.LEAD_INDEX_PATH)
+    except Exception:
+        db.rollback()
+        lead_index.remove_file(f"{settings.LEAD_INDEX_PATH}.tmp")
+        if os.path.realpath(settings.AUDIO_STORAGE_PATH) != os.path.realpath(version_dir):
+            shutil.rmtree(version_dir, ignore_errors=True)
+        raise
+    finally:
+        db.close()
+    return len(manifest["leads"])
+
+
+def _load_package(job: ImportJob, package_zip: zipfile.ZipFile, zip_path: str, audio_members: List[zipfile.ZipInfo]) -> int:
+    """
+    Loads a full package into staging tables and a new audio version directory,
+    then switches both over at once.
+    """
+    version_dir = _new_version_dir(job)
+    db = SessionLocal()
+    try:
+        with job.phase("insert", "Streaming new leads from CSV file into staging tables..."):
+            lead_crud.create_staging_tables(db)
+            with package_zip.open("leads.csv") as raw_csv, io.TextIOWrapper(raw_csv, encoding='utf-8', newline='') as csvfile:
+                lead_count = lead_crud.copy_leads_from_csv(
+                    db,
+                    csvfile,
+                    leads_table=lead_crud.staging_table("leads"),
+                    details_table=lead_crud.staging_table("lead_details"),
+                )
+            db.commit()
+        logger.info(f"VERIFICATION: Successfully staged {lead_count} leads.")
+
+        with job.phase("deal_order", "Shuffling dealing order for completed leads..."):
+            lead_crud.assign_deal_order(
+                db,
+                slots=settings.DEAL_CURSOR_SLOTS,
+                leads_table=lead_crud.staging_table("leads"),
+                cursors_table=lead_crud.staging_table("generation_cursors"),
+            )
+            db.commit()
+
+        with job.phase("audio_placement", "Placing new audio files into a new version directory...") as timing:
+            os.makedirs(version_dir)
+            placed_bytes, digests = _place_audio_members(zip_path, audio_members, version_dir)
+            timing["files"] = len(audio_members)
+            timing["bytes"] = placed_bytes
+        seconds = max(timing["seconds"], 0.001)
+        timing["files_per_second"] = round(len(audio_members) / seconds, 1)
+        timing["bytes_per_second"] = round(placed_bytes / seconds)
+        job.save()
+        logger.info(f"Placed {len(audio_members)} audio files ({placed_bytes} bytes): {timing['files_per_second']} files/s, {timing['bytes_per_second']} bytes/s.")
+
+        _transcode_audio(job, version_dir, list(digests), digests)
+        audio_sizes = write_audio_index(version_dir, digests)
+
+        with job.phase("catalog", "Building the generations catalog..."):
+            lead_crud.refresh_generations(
+                db,
+                audio_sizes=audio_sizes,
+                imported=True,
+                leads_table=lead_crud.staging_table("leads"),
+                generations_table=lead_crud.staging_table("generations"),
+            )
+            db.commit()
+        index_path = _compile_lead_index(job, db, leads_table=lead_crud.staging_table("leads"))
+
+        with job.phase("swap", "Switching live traffic to the new campaign..."):
+            lead_crud.swap_in_staging_tables(db)
+            _point_audio_storage_at(version_dir)
+            if index_path:
+                lead_index.install_lead_index(index_path, settings.LEAD_INDEX_PATH)
+    except Exception:
+        db.rollback()
+        lead_index.remove_file(f"{settings.LEAD_INDEX_PATH}.tmp")
+        try:
+            lead_crud.drop_staging_tables(db)
+        except Exception:
+            db.rollback()
+        if os.path.realpath(settings.AUDIO_STORAGE_PATH) != os.path.realpath(version_dir):
+            shutil.rmtree(version_dir, ignore_errors=True)
+        raise
+    finally:
+        db.close()
+    return lead_count
+
+
+def _run_job(job: ImportJob, work_dir: str, zip_path: str) -> None:
+    try:
+        with _import_lock():
+            job.update(status="running", message="Import started.")
+            lead_count = _import_package(job, zip_path)
+        job.update(
+            status="completed",
+            phase=None,
+            lead_count=lead_count,
+            message=f"Campaign package imported. Verified {lead_count} leads in the database.",
+            finished_at=_now(),
+        )
+    except ValueError as e:
+        logger.error(f"Rejected invalid campaign package: {e}")
+        job.update(status="failed", error=f"Package is invalid: {e}", message="Import failed.", finished_at=_now())
+    except Exception as e:
+        logger.error(f"A critical error occurred during import: {e}", exc_info=True)
+        job.update(status="failed", error=str(e), message="Import failed.", finished_at=_now())
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+        _prune_finished_jobs()
+
+
+def start_import(upload_file) -> ImportJob:
+    """
+    Saves an uploaded package to disk and queues it for import. Blocking; call it
+    from a threadpool, not the event loop. Returns the job to poll for progress.
+    """
+    job = ImportJob.create()
+    work_dir = tempfile.mkdtemp(prefix="import-", dir=settings.IMPORT_JOBS_PATH)
+    zip_path = os.path.join(work_dir, "package.zip")
+    started = time.perf_counter()
+    with open(zip_path, "wb") as buffer:
+        shutil.copyfileobj(upload_file, buffer)
+    job.state["phases"].append({"name": "upload", "seconds": round(time.perf_counter() - started, 3)})
+    metrics.import_phase_seconds.observe(time.perf_counter() - started, "upload")
+    job.save()
+    _executor.submit(_run_job, job, work_dir, zip_path)
+    return job
+
+
+def get_job(job_id: str) -> Optional[dict]:
+    job = ImportJob.load(job_id)
+    return job.state if job else None
@@ -0,0 +1,143 @@
+import os
+import wave
+import hashlib
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from app.core.audio_variants import variant_filename
+
+logger = logging.getLogger(__name__)
+
+# Converts lead audio to the formats Asterisk plays without transcoding, so the
+# dialer does not spend CPU on it at call time. Sources are PCM WAV files, read with
+# the stdlib wave module; everything after that is NumPy. The work runs on a pool of
+# processes, so this module must stay importable without the rest of the app.
+
+TARGET_RATE = 8000
+
+# Segment end points of the G.711 companding curves (ITU-T G.711, as in the
+# reference g711.c), for 13-bit (A-law) and 14-bit (mu-law) magnitudes.
+_ALAW_SEG_END = np.array([0x1F, 0x3F, 0x7F, 0xFF, 0x1FF, 0x3FF, 0x7FF, 0xFFF])
+_ULAW_SEG_END = np.array([0x3F, 0x7F, 0xFF, 0x1FF, 0x3FF, 0x7FF, 0xFFF, 0x1FFF])
+_ULAW_BIAS = 0x84 >> 2
+_ULAW_CLIP = 8159
+
+
+def _read_wav(path: str) -> Tuple[np.ndarray, int]:
+    """Returns the samples of a PCM WAV file as mono float64 in [-1, 1), and its sample rate."""
+    with wave.open(path, "rb") as wav:
+        channels = wav.getnchannels()
+        width = wav.getsampwidth()
+        rate = wav.getframerate()
+        frames = wav.readframes(wav.getnframes())
+    if width == 1:
+        samples = (np.frombuffer(frames, dtype=np.uint8).astype(np.float64) - 128.0) / 128.0
+    elif width == 2:
+        samples = np.frombuffer(frames, dtype="<i2").astype(np.float64) / 32768.0
+    elif width == 3:
+        raw = np.frombuffer(frames, dtype=np.uint8).reshape(-1, 3).astype(np.int32)
+        values = raw[:, 0] | (raw[:, 1] << 8) | (raw[:, 2] << 16)
+        values = np.where(values & 0x800000, values - 0x1000000, values)
+        samples = values.astype(np.float64) / 8388608.0
+    elif width == 4:
+        samples = np.frombuffer(frames, dtype="<i4").astype(np.float64) / 2147483648.0
+    else:
+        raise wave.Error(f"unsupported sample width: {width} bytes")
+    if channels > 1:
+        samples = samples[: len(samples) - len(samples) % channels].reshape(-1, channels).mean(axis=1)
+    return samples, rate
+
+
+def _resample(samples: np.ndarray, rate: int, target_rate: int) -> np.ndarray:
+    """
+    Band-limited resampling in the frequency domain: the spectrum is cut (or
+    zero-padded) at the target Nyquist frequency, which also acts as the
+    anti-aliasing filter when downsampling.
+    """
+    if rate == target_rate or len(samples) == 0:
+        return samples
+    out_len = max(int(round(len(samples) * target_rate / rate)), 1)
+    spectrum = np.fft.rfft(samples)
+    keep = out_len // 2 + 1
+    if keep <= len(spectrum):
+        spectrum = spectrum[:keep]
+    else:
+        spectrum = np.concatenate([spectrum, np.zeros(keep - len(spectrum), dtype=spectrum.dtype)])
+    return np.fft.irfft(spectrum, out_len) * (out_len / len(samples))
+
+
+def _to_pcm16(samples: np.ndarray) -> np.ndarray:
+    return np.clip(np.round(samples * 32768.0), -32768, 32767).astype(np.int16)
+
+
+def _encode_ulaw(pcm: np.ndarray) -> bytes:
+    values = pcm.astype(np.int32) >> 2
+    mask = np.where(values < 0, 0x7F, 0xFF)
+    magnitude = np.minimum(np.abs(values), _ULAW_CLIP) + _ULAW_BIAS
+    segment = np.searchsorted(_ULAW_SEG_END, magnitude, side="left")
+    encoded = np.where(segment >= 8, 0x7F, (np.minimum(segment, 7) << 4) | ((magnitude >> (np.minimum(segment, 7) + 1)) & 0x0F))
+    return ((encoded ^ mask) & 0xFF).astype(np.uint8).tobytes()
+
+
+def _encode_alaw(pcm: np.ndarray) -> bytes:
+    values = pcm.astype(np.int32) >> 3
+    mask = np.where(values >= 0, 0xD5, 0x55)
+    magnitude = np.where(values >= 0, values, -values - 1)
+    segment = np.searchsorted(_ALAW_SEG_END, magnitude, side="left")
+    shift = np.where(segment < 2, 1, segment)
+    encoded = np.where(segment >= 8, 0x7F, (np.minimum(segment, 7) << 4) | ((magnitude >> shift) & 0x0F))
+    return ((encoded ^ mask) & 0xFF).astype(np.uint8).tobytes()
+
+
+_ENCODERS = {
+    "ulaw": _encode_ulaw,
+    "alaw": _encode_alaw,
+    "slin": lambda pcm: pcm.astype("<i2").tobytes(),
+}
+
+
+def transcode_file(src_path: str, dest_dir: str, formats: List[str]) -> Tuple[str, Dict[str, str], Optional[str]]:
+    """
+    Writes the requested variants of one audio file into dest_dir. Returns the source
+    filename, {variant filename: sha256} and an error message if the file could not be read.
+    """
+    filename = os.path.basename(src_path)
+    try:
+        samples, rate = _read_wav(src_path)
+    except (wave.Error, EOFError, ValueError) as e:
+        return filename, {}, f"not a readable PCM WAV file ({e or type(e).__name__})"
+    pcm = _to_pcm16(_resample(samples, rate, TARGET_RATE))
+    variants = {}
+    for codec in formats:
+        data = _ENCODERS[codec](pcm)
+        name = variant_filename(filename, codec)
+        tmp_path = os.path.join(dest_dir, f".{name}.tmp")
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, os.path.join(dest_dir, name))
+        variants[name] = hashlib.sha256(data).hexdigest()
+    return filename, variants, None
+
+
+def transcode_files(src_paths: List[str], dest_dir: str, formats: List[str], workers: int = 0) -> Tuple[Dict[str, str], Dict[str, str]]:
+    """
+    Transcodes many files on a process pool. Returns {variant filename: sha256} for
+    everything written and {source filename: error} for files that were skipped.
+    """
+    if not src_paths or not formats:
+        return {}, {}
+    variants: Dict[str, str] = {}
+    failed: Dict[str, str] = {}
+    # "spawn" keeps the workers free of the importer's threads and database connections.
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers or None, mp_context=context) as pool:
+        chunksize = max(len(src_paths) // ((workers or os.cpu_count() or 1) * 4), 1)
+        for filename, file_variants, error in pool.map(transcode_file, src_paths, [dest_dir] * len(src_paths), [formats] * len(src_paths), chunksize=chunksize):
+            if error is not None:
+                failed[filename] = error
+            variants.update(file_variants)
+    return variants, failed
@@ -0,0 +1,487 @@
+"""
+Load-tests the Vicidial API the way a dialer uses it, and fails when a run is slower
+than a saved baseline.
+
+    python -m bench.dialer_load --database-url postgresql://bench@localhost/vbox_bench --save baseline.json
+    python -m bench.dialer_load --database-url postgresql://bench@localhost/vbox_bench --compare baseline.json
+
+The app is started with uvicorn against the given database, with its audio, index
+and job directories in a temporary directory. A synthetic campaign package (N
+completed leads across M generations, with generated WAV prompts) is uploaded
+through the importer, so the run serves a real deploy: catalog, lead index and
+audio versions included. THE IMPORT REPLACES EVERY LEAD IN THAT DATABASE, so point
+it at a database kept for benchmarks.
+
+Each simulated call is one random_audio request, then one to three specific_audio
+requests, each followed by the download of the returned audio URL, over a
+keep-alive connection per concurrent caller. Latency is reported per request kind
+and per whole call. With --compare the run exits with status 1 when a percentile
+or the throughput is worse than the baseline by more than --tolerance, or when
+any request failed. Every run also fails when the app's /metrics does not report
+the Vicidial requests under their route templates.
+
+--url runs the call flow against a server that is already running (and already
+seeded; pass --generations to name them). --env passes settings to the started
+app, e.g. --env LEAD_INDEX_ENABLED=false.
+"""
+import io
+import os
+import sys
+import csv
+import json
+import math
+import time
+import uuid
+import wave
+import array
+import random
+import shutil
+import asyncio
+import zipfile
+import argparse
+import tempfile
+import statistics
+import subprocess
+import urllib.error
+import urllib.parse
+import urllib.request
+from typing import Dict, List, Optional, Tuple
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+AUDIO_TYPES = ("no_amd", "amd", "transfer", "voicemail")
+SAMPLE_RATE = 8000
+# Percentiles and throughput compared against the baseline.
+COMPARED_PERCENTILES = ("p50_ms", "p95_ms", "p99_ms")
+# Route labels /metrics must report for the requests of the call flow.
+EXPECTED_ROUTE_LABELS = (
+    "/api/v1/vicidial/random_audio/{generation_no}/{audio_type}",
+    "/api/v1/vicidial/specific_audio/{lead_key}/{audio_type}",
+)
+
+
+# --- Synthetic campaign ---
+
+def _tone_wav(frequency: float, seconds: float) -> bytes:
+    samples = array.array("h", (
+        int(8000 * math.sin(2 * math.pi * frequency * number / SAMPLE_RATE))
+        for number in range(int(SAMPLE_RATE * seconds))
+    ))
+    if sys.byteorder != "little":
+        samples.byteswap()
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(SAMPLE_RATE)
+        wav.writeframes(samples.tobytes())
+    return buffer.getvalue()
+
+
+def generation_names(count: int) -> List[str]:
+    return [f"bench{number}" for number in range(1, count + 1)]
+
+
+def build_package(path: str, leads: int, generations: List[str], audio_pool: int, audio_seconds: float) -> None:
+    """
+    Writes a full campaign package of `leads` completed leads spread over
+    `generations`. Leads share `audio_pool` distinct prompts per audio type
+    (one per lead when 0), so large runs do not need one file per lead.
+    """
+    distinct = audio_pool or leads
+    with zipfile.ZipFile(path, "w", compression=zipfile.ZIP_STORED) as package:
+        for audio_type_number, audio_type in enumerate(AUDIO_TYPES):
+            for number in range(min(distinct, leads)):
+                # A different tone per file, so files never share a digest.
+                frequency = 300 + audio_type_number * 200 + (number % 1000) * 0.1 + number // 1000
+                package.writestr(f"audio/{audio_type}_{number}.wav", _tone_wav(frequency, audio_seconds))
+
+        rows = io.StringIO()
+        writer = csv.writer(rows)
+        writer.writerow(["id", "phone_number", "campaign_name", "generation_no", "lead_data", "status"]
+                        + [f"audio_filename_{audio_type}" for audio_type in AUDIO_TYPES])
+        for number in range(leads):
+            writer.writerow([
+                str(uuid.uuid4()), f"555{number:07d}", "bench", generations[number % len(generations)],
+                json.dumps({"first_name": f"Lead{number}"}), "COMPLETED",
+            ] + [f"{audio_type}_{number % distinct}.wav" for audio_type in AUDIO_TYPES])
+        package.writestr("leads.csv", rows.getvalue())
+
+
+def _upload_package(base_url: str, path: str) -> str:
+    boundary = uuid.uuid4().hex
+    with open(path, "rb") as f:
+        content = f.read()
+    body = (
+        f"--{boundary}\r\nContent-Disposition: form-data; name=\"package\"; filename=\"bench.zip\"\r\n"
+        f"Content-Type: application/zip\r\n\r\n"
+    ).encode("utf-8") + content + f"\r\n--{boundary}--\r\n".encode("utf-8")
+    request = urllib.request.Request(
+        f"{base_url}/api/v1/importer/upload", data=body, method="POST",
+        headers={"Content-Type": f"multipart/form-data; boundary={boundary}"},
+    )
+    with urllib.request.urlopen(request, timeout=600) as response:
+        return json.load(response)["job_id"]
+
+
+def seed(base_url: str, work_dir: str, leads: int, generations: List[str], audio_pool: int, audio_seconds: float) -> None:
+    package_path = os.path.join(work_dir, "bench_package.zip")
+    started = time.perf_counter()
+    build_package(package_path, leads, generations, audio_pool, audio_seconds)
+    print(f"Built package of {leads} leads in {len(generations)} generations ({os.path.getsize(package_path) / 1048576:.1f} MiB) in {time.perf_counter() - started:.1f} s.")
+
+    job_id = _upload_package(base_url, package_path)
+    while True:
+        time.sleep(0.5)
+        with urllib.request.urlopen(f"{base_url}/api/v1/importer/jobs/{job_id}", timeout=30) as response:
+            job = json.load(response)
+        if job["status"] == "failed":
+            raise SystemExit(f"Seeding failed: {job.get('error')}")
+        if job["status"] == "completed":
+            break
+    phases = ", ".join(f"{phase['name']} {phase['seconds']}s" for phase in job.get("phases", []))
+    print(f"Imported in {time.perf_counter() - started:.1f} s ({phases}).")
+    os.remove(package_path)
+
+
+# --- App under test ---
+
+def start_app(database_url: str, work_dir: str, port: int, workers: int, extra_env: Dict[str, str]) -> subprocess.Popen:
+    env = dict(os.environ)
+    for name in ("CELERY_BROKER_URL", "CELERY_RESULT_BACKEND", "TTS_SERVICE_URL"):
+        env.setdefault(name, "unused")
+    env.update({
+        "DATABASE_URL": database_url,
+        "AUDIO_STORAGE_PATH": os.path.join(work_dir, "audio"),
+        "VOICE_STORAGE_PATH": os.path.join(work_dir, "voices"),
+        "BASE_URL": f"http://127.0.0.1:{port}",
+        "AUDIO_URL_MODE": "http",
+    })
+    env.update(extra_env)
+    subprocess.run([sys.executable, "initial_db.py"], cwd=REPO_ROOT, env=env, check=True, stdout=subprocess.DEVNULL)
+    log = open(os.path.join(work_dir, "app.log"), "wb")
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1", "--port", str(port), "--workers", str(workers), "--no-access-log"],
+        cwd=REPO_ROOT, env=env, stdout=log, stderr=subprocess.STDOUT,
+    )
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise SystemExit(f"The app exited during startup; see {log.name}.")
+        try:
+            with urllib.request.urlopen(f"http://127.0.0.1:{port}/api/v1/vicidial/stats", timeout=2):
+                return process
+        except OSError:
+            time.sleep(0.25)
+    process.terminate()
+    raise SystemExit(f"The app did not start within 60 s; see {log.name}.")
+
+
+def stop_app(process: subprocess.Popen) -> None:
+    process.terminate()
+    try:
+        process.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+
+# --- HTTP client ---
+
+class Connection:
+    """A keep-alive HTTP/1.1 connection doing one GET at a time, reconnecting when the server closes it."""
+
+    def __init__(self, host: str, port: int):
+        self.host = host
+        self.port = port
+        self.reader: Optional[asyncio.StreamReader] = None
+        self.writer: Optional[asyncio.StreamWriter] = None
+
+    async def get(self, target: str) -> Tuple[int, bytes]:
+        for attempt in range(2):
+            if self.writer is None:
+                self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+            try:
+                self.writer.write(f"GET {target} HTTP/1.1\r\nHost: {self.host}:{self.port}\r\n\r\n".encode("latin-1"))
+                await self.writer.drain()
+                return await self._read_response()
+            except (ConnectionError, asyncio.IncompleteReadError):
+                # The server may close an idle keep-alive connection; retry once on a new one.
+                self.close()
+                if attempt:
+                    raise
+
+    async def _read_response(self) -> Tuple[int, bytes]:
+        status_line = await self.reader.readline()
+        if not status_line:
+            raise ConnectionResetError("connection closed")
+        status = int(status_line.split()[1])
+        headers = {}
+        while True:
+            line = await self.reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        if "content-length" in headers:
+            body = await self.reader.readexactly(int(headers["content-length"]))
+        elif headers.get("transfer-encoding", "").lower() == "chunked":
+            chunks = []
+            while True:
+                size = int((await self.reader.readline()).split(b";")[0], 16)
+                if size == 0:
+                    await self.reader.readline()
+                    break
+                chunks.append(await self.reader.readexactly(size))
+                await self.reader.readline()
+            body = b"".join(chunks)
+        else:
+            body = await self.reader.read()
+            headers["connection"] = "close"
+        if headers.get("connection", "").lower() == "close":
+            self.close()
+        return status, body
+
+    def close(self) -> None:
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+
+# --- Call flow ---
+
+class Recorder:
+    def __init__(self):
+        self.samples: Dict[str, List[float]] = {}
+        self.errors: Dict[str, int] = {}
+        self.audio_bytes = 0
+        self.requests = 0
+
+    async def get(self, connection: Connection, kind: str, target: str) -> Optional[bytes]:
+        started = time.perf_counter()
+        try:
+            status, body = await connection.get(target)
+        except (OSError, asyncio.IncompleteReadError, ValueError, IndexError) as e:
+            status, body = type(e).__name__, b""
+        self.samples.setdefault(kind, []).append(time.perf_counter() - started)
+        self.requests += 1
+        if status != 200:
+            key = f"{kind} {status}"
+            self.errors[key] = self.errors.get(key, 0) + 1
+            return None
+        return body
+
+
+async def _download(recorder: Recorder, connection: Connection, audio_url: str) -> None:
+    url = urllib.parse.urlsplit(audio_url)
+    if url.scheme not in ("http", "https"):
+        return  # A file path for Asterisk to play from disk; nothing to download.
+    body = await recorder.get(connection, "audio", url.path + (f"?{url.query}" if url.query else ""))
+    if body is not None:
+        recorder.audio_bytes += len(body)
+
+
+async def one_call(recorder: Recorder, connection: Connection, generations: List[str], codec: str) -> None:
+    """One dialer call: a random lead's first prompt, then one to three follow-up prompts."""
+    query = f"?codec={codec}" if codec else ""
+    started = time.perf_counter()
+    generation_no = random.choice(generations)
+    body = await recorder.get(connection, "random_audio", f"/api/v1/vicidial/random_audio/{urllib.parse.quote(generation_no)}/no_amd{query}")
+    if body is None:
+        return
+    first = json.loads(body)
+    await _download(recorder, connection, first["audio_url"])
+    lead_key = urllib.parse.quote(first["lead_key"], safe="")
+    for _ in range(random.randint(1, 3)):
+        audio_type = random.choice(AUDIO_TYPES[1:])
+        body = await recorder.get(connection, "specific_audio", f"/api/v1/vicidial/specific_audio/{lead_key}/{audio_type}{query}")
+        if body is None:
+            return
+        await _download(recorder, connection, json.loads(body)["audio_url"])
+    recorder.samples.setdefault("call", []).append(time.perf_counter() - started)
+
+
+async def drive(host: str, port: int, generations: List[str], calls: int, concurrency: int, codec: str) -> Tuple[Recorder, float]:
+    recorder = Recorder()
+    remaining = calls
+
+    async def caller():
+        nonlocal remaining
+        connection = Connection(host, port)
+        try:
+            while remaining > 0:
+                remaining -= 1
+                await one_call(recorder, connection, generations, codec)
+        finally:
+            connection.close()
+
+    started = time.perf_counter()
+    await asyncio.gather(*(caller() for _ in range(concurrency)))
+    return recorder, time.perf_counter() - started
+
+
+def check_route_labels(base_url: str) -> List[str]:
+    """
+    The call flow's route templates missing from the app's request metrics; empty
+    when they are all there or the app has metrics disabled.
+    """
+    try:
+        with urllib.request.urlopen(f"{base_url}/metrics", timeout=30) as response:
+            text = response.read().decode("utf-8")
+    except urllib.error.HTTPError as e:
+        if e.code == 404:
+            return []
+        raise
+    return [
+        route for route in EXPECTED_ROUTE_LABELS
+        if f'vbox_http_responses_total{{route="{route}",' not in text
+    ]
+
+
+# --- Results ---
+
+def _percentiles(samples: List[float]) -> Dict[str, float]:
+    samples = sorted(samples)
+
+    def at(fraction: float) -> float:
+        return samples[min(int(len(samples) * fraction), len(samples) - 1)] * 1000
+
+    return {
+        "count": len(samples),
+        "p50_ms": round(at(0.50), 3),
+        "p95_ms": round(at(0.95), 3),
+        "p99_ms": round(at(0.99), 3),
+        "mean_ms": round(statistics.mean(samples) * 1000, 3),
+        "max_ms": round(samples[-1] * 1000, 3),
+    }
+
+
+def summarize(recorder: Recorder, elapsed: float, parameters: dict) -> dict:
+    return {
+        "parameters": parameters,
+        "elapsed_seconds": round(elapsed, 3),
+        "calls_per_second": round(len(recorder.samples.get("call", [])) / elapsed, 2),
+        "requests_per_second": round(recorder.requests / elapsed, 2),
+        "audio_bytes": recorder.audio_bytes,
+        "errors": recorder.errors,
+        "latency": {kind: _percentiles(samples) for kind, samples in sorted(recorder.samples.items())},
+    }
+
+
+def compare(results: dict, baseline: dict, tolerance: float, min_delta_ms: float) -> List[str]:
+    """The ways `results` is worse than `baseline`, beyond `tolerance` and noise."""
+    regressions = []
+    if results["errors"]:
+        regressions.append(f"failed requests: {results['errors']}")
+    for kind, stats in results["latency"].items():
+        before = baseline.get("latency", {}).get(kind)
+        if not before:
+            continue
+        for key in COMPARED_PERCENTILES:
+            if stats[key] > before[key] * (1 + tolerance) and stats[key] - before[key] > min_delta_ms:
+                regressions.append(f"{kind} {key} {stats[key]:.3f} ms, baseline {before[key]:.3f} ms")
+    if results["calls_per_second"] < baseline["calls_per_second"] * (1 - tolerance):
+        regressions.append(f"throughput {results['calls_per_second']} calls/s, baseline {baseline['calls_per_second']} calls/s")
+    return regressions
+
+
+def _print(results: dict, baseline: dict = None) -> None:
+    parameters = results["parameters"]
+    print(f"{parameters['calls']} calls at concurrency {parameters['concurrency']}: "
+          f"{results['calls_per_second']} calls/s, {results['requests_per_second']} requests/s, "
+          f"{results['audio_bytes'] / 1048576:.1f} MiB of audio in {results['elapsed_seconds']} s")
+    if baseline:
+        print(f"baseline: {baseline['calls_per_second']} calls/s, {baseline['requests_per_second']} requests/s")
+        changed = {key: value for key, value in parameters.items() if baseline.get("parameters", {}).get(key) != value}
+        if changed:
+            print(f"warning: parameters differ from the baseline's: {changed}")
+    for kind, stats in results["latency"].items():
+        line = f"{kind:16} n {stats['count']:7}  p50 {stats['p50_ms']:8.3f} ms  p95 {stats['p95_ms']:8.3f} ms  p99 {stats['p99_ms']:8.3f} ms"
+        before = (baseline or {}).get("latency", {}).get(kind)
+        if before:
+            line += f"  (p99 was {before['p99_ms']:.3f} ms)"
+        print(line)
+    for error, count in results["errors"].items():
+        print(f"errors: {error} x {count}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url", help="database for the started app; its leads are replaced")
+    parser.add_argument("--url", help="run against this already seeded server instead of starting one")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--workers", type=int, default=2, help="uvicorn workers of the started app")
+    parser.add_argument("--env", action="append", default=[], metavar="NAME=VALUE", help="setting for the started app")
+    parser.add_argument("--leads", type=int, default=20000)
+    parser.add_argument("--generations", type=int, default=4)
+    parser.add_argument("--audio-pool", type=int, default=500, help="distinct prompts per audio type (0: one per lead)")
+    parser.add_argument("--audio-seconds", type=float, default=1.0)
+    parser.add_argument("--calls", type=int, default=5000)
+    parser.add_argument("--warmup-calls", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--codec", default="", help="request transcoded variants (ulaw, alaw, slin)")
+    parser.add_argument("--save", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="fail when worse than results saved earlier with --save")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown against the baseline (0.25 = 25%%)")
+    parser.add_argument("--min-delta-ms", type=float, default=1.0, help="latency increases below this are noise")
+    parser.add_argument("--keep", action="store_true", help="keep the started app's work directory")
+    options = parser.parse_args()
+    if not options.url and not options.database_url:
+        parser.error("--database-url is required unless --url is given")
+
+    generations = generation_names(options.generations)
+    parameters = {
+        "leads": options.leads, "generations": options.generations, "audio_pool": options.audio_pool,
+        "calls": options.calls, "concurrency": options.concurrency, "workers": options.workers,
+        "codec": options.codec, "env": sorted(options.env),
+    }
+    process = None
+    work_dir = None
+    try:
+        if options.url:
+            url = urllib.parse.urlsplit(options.url)
+            host, port = url.hostname, url.port or 80
+        else:
+            work_dir = tempfile.mkdtemp(prefix="dialer-load-")
+            extra_env = dict(setting.split("=", 1) for setting in options.env)
+            process = start_app(options.database_url, work_dir, options.port, options.workers, extra_env)
+            host, port = "127.0.0.1", options.port
+            seed(f"http://{host}:{port}", work_dir, options.leads, generations, options.audio_pool, options.audio_seconds)
+            # Workers notice the new deploy within LEAD_POOL_CHECK_INTERVAL.
+            time.sleep(2)
+
+        loop = asyncio.get_event_loop()
+        if options.warmup_calls:
+            loop.run_until_complete(drive(host, port, generations, options.warmup_calls, options.concurrency, options.codec))
+        recorder, elapsed = loop.run_until_complete(drive(host, port, generations, options.calls, options.concurrency, options.codec))
+        missing_labels = check_route_labels(f"http://{host}:{port}")
+    finally:
+        if process is not None:
+            stop_app(process)
+        if work_dir and not options.keep:
+            shutil.rmtree(work_dir, ignore_errors=True)
+        elif work_dir:
+            print(f"Work directory kept at {work_dir}.")
+
+    results = summarize(recorder, elapsed, parameters)
+    baseline = None
+    if options.compare:
+        with open(options.compare, "r") as f:
+            baseline = json.load(f)
+    _print(results, baseline)
+    if options.save:
+        with open(options.save, "w") as f:
+            json.dump(results, f, indent=2)
+    for route in missing_labels:
+        print(f"METRICS: no request metrics under the route label {route}")
+    if missing_labels:
+        raise SystemExit(1)
+    if baseline:
+        regressions = compare(results, baseline, options.tolerance, options.min_delta_ms)
+        for regression in regressions:
+            print(f"REGRESSION: {regression}")
+        if regressions:
+            raise SystemExit(1)
+        print("No regression against the baseline.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+"""
+Measures the latency of the dialer's lead lookups against the configured database.
+
+Run it once before applying a schema change (`python initial_db.py`) and once after,
+saving the first run and comparing the second against it:
+
+    python -m bench.lookup_latency --save before.json
+    python initial_db.py
+    python -m bench.lookup_latency --compare before.json
+
+Each lookup is timed from the client, over the same connection pool the app uses.
+"sql_*" lookups read whole rows with SELECT *, the way the ORM read a lead before
+the hot/cold split. "crud_*" lookups call the app's CRUD functions.
+"""
+import json
+import time
+import random
+import argparse
+import statistics
+from typing import Callable, Dict, List
+
+from sqlalchemy import text
+
+from app.db.session import SessionLocal
+from app.crud import lead as lead_crud
+
+
+def _percentiles(samples: List[float]) -> Dict[str, float]:
+    samples = sorted(samples)
+
+    def at(fraction: float) -> float:
+        return samples[min(int(len(samples) * fraction), len(samples) - 1)] * 1000
+
+    return {
+        "p50_ms": round(at(0.50), 4),
+        "p95_ms": round(at(0.95), 4),
+        "p99_ms": round(at(0.99), 4),
+        "mean_ms": round(statistics.mean(samples) * 1000, 4),
+    }
+
+
+def _time(fn: Callable[[], object], iterations: int) -> Dict[str, float]:
+    for _ in range(min(iterations, 50)):
+        fn()  # Warm the connection, plan cache and buffers.
+    samples = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - started)
+    return _percentiles(samples)
+
+
+def run(iterations: int, sample_size: int) -> dict:
+    db = SessionLocal()
+    try:
+        phones = [row[0] for row in db.execute(text("SELECT phone_number FROM leads TABLESAMPLE SYSTEM (10) LIMIT :n"), {"n": sample_size})]
+        if not phones:
+            phones = [row[0] for row in db.execute(text("SELECT phone_number FROM leads LIMIT :n"), {"n": sample_size})]
+        generations = [row[0] for row in db.execute(text("SELECT DISTINCT generation_no FROM leads WHERE status = 'COMPLETED' AND generation_no IS NOT NULL"))]
+        if not phones or not generations:
+            raise SystemExit("The database has no completed leads to look up.")
+
+        table_stats = db.execute(text("""
+            SELECT count(*), avg(pg_column_size(l.*)), pg_total_relation_size('leads')
+            FROM leads AS l
+        """)).one()
+
+        results = {
+            "leads": table_stats[0],
+            "leads_avg_row_bytes": round(float(table_stats[1] or 0), 1),
+            "leads_total_bytes": table_stats[2],
+            "iterations": iterations,
+            "lookups": {},
+        }
+        lookups = results["lookups"]
+
+        by_phone_sql = text("SELECT * FROM leads WHERE phone_number = :phone")
+        random_sql = text("SELECT * FROM leads WHERE generation_no = :generation_no AND status = 'COMPLETED' ORDER BY random() LIMIT 1")
+        lookups["sql_by_phone"] = _time(lambda: db.execute(by_phone_sql, {"phone": random.choice(phones)}).first(), iterations)
+        lookups["sql_random_completed"] = _time(lambda: db.execute(random_sql, {"generation_no": random.choice(generations)}).first(), iterations)
+
+        def crud_by_phone():
+            lead_crud.get_lead_by_phone(db, phone_number=random.choice(phones))
+            db.expunge_all()
+
+        def crud_random_completed():
+            lead_crud.get_random_completed_lead_by_generation(db, generation_no=random.choice(generations))
+            db.expunge_all()
+
+        lookups["crud_by_phone"] = _time(crud_by_phone, iterations)
+        lookups["crud_random_completed"] = _time(crud_random_completed, iterations)
+        return results
+    finally:
+        db.close()
+
+
+def _print(results: dict, baseline: dict = None) -> None:
+    print(f"leads: {results['leads']}, average row {results['leads_avg_row_bytes']} bytes, table {results['leads_total_bytes'] / 1048576:.1f} MiB")
+    if baseline:
+        print(f"baseline: average row {baseline['leads_avg_row_bytes']} bytes, table {baseline['leads_total_bytes'] / 1048576:.1f} MiB")
+    for name, stats in results["lookups"].items():
+        line = f"{name:24} p50 {stats['p50_ms']:8.3f} ms  p95 {stats['p95_ms']:8.3f} ms  p99 {stats['p99_ms']:8.3f} ms"
+        before = (baseline or {}).get("lookups", {}).get(name)
+        if before:
+            line += f"  (p50 was {before['p50_ms']:.3f} ms, {stats['p50_ms'] / before['p50_ms']:.2f}x)"
+        print(line)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=2000)
+    parser.add_argument("--sample-size", type=int, default=5000, help="phone numbers to draw lookups from")
+    parser.add_argument("--save", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="compare against results saved earlier with --save")
+    options = parser.parse_args()
+
+    results = run(options.iterations, options.sample_size)
+    baseline = None
+    if options.compare:
+        with open(options.compare, "r") as f:
+            baseline = json.load(f)
+    _print(results, baseline)
+    if options.save:
+        with open(options.save, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""
+Measures what the Vicidial fast path saves per response: the time to turn a looked-up
+lead into response bytes, with and without VICIDIAL_FAST_RESPONSES.
+
+    python -m bench.response_encoding
+
+"schema" builds the dict the handler returns, validates it through the response model
+and encodes it the way FastAPI does. "fast" assembles the body from pre-rendered
+fragments, as the handlers do in fast-path mode. No database or server is involved.
+"""
+import json
+import time
+import argparse
+import statistics
+from typing import Callable, Dict
+
+from fastapi.encoders import jsonable_encoder
+
+from app.api import lead_lookup
+from app.api.v1 import schemas
+from app.api.v1.endpoints import vicidial
+from app.crud.lead import LeadAudio
+
+
+def _time(fn: Callable[[], object], iterations: int) -> Dict[str, float]:
+    for _ in range(min(iterations, 1000)):
+        fn()
+    samples = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - started)
+    samples.sort()
+    return {
+        "p50_us": round(samples[len(samples) // 2] * 1e6, 3),
+        "p99_us": round(samples[min(int(len(samples) * 0.99), len(samples) - 1)] * 1e6, 3),
+        "mean_us": round(statistics.mean(samples) * 1e6, 3),
+    }
+
+
+def _schema_body(model, content: dict) -> bytes:
+    return json.dumps(jsonable_encoder(model(**content)), ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def run(iterations: int, leads: int) -> Dict[str, Dict[str, float]]:
+    pool = [
+        LeadAudio(f"555{number:07d}", f"{number}_no_amd.wav", f"{number}_amd.wav", f"{number}_transfer.wav", f"{number}_voicemail.wav")
+        for number in range(leads)
+    ]
+    state = {"next": 0}
+
+    def pick():
+        state["next"] = (state["next"] + 1) % len(pool)
+        return pool[state["next"]]
+
+    def random_audio_schema():
+        lead = pick()
+        return _schema_body(schemas.RandomAudioResponse, {
+            "audio_url": lead_lookup.get_audio_url_for_lead(lead, "no_amd"),
+            "lead_key": lead_lookup.lead_key_for(lead),
+        })
+
+    def random_audio_fast():
+        lead = pick()
+        return vicidial._json_response(
+            b'{"audio_url":' + lead_lookup.audio_url_json(lead, "no_amd")
+            + b',"lead_key":' + lead_lookup.json_string(lead_lookup.lead_key_for(lead)) + b"}"
+        ).body
+
+    def all_audio_schema():
+        lead = pick()
+        return _schema_body(schemas.LeadAudioUrlsResponse, {"lead_key": lead.phone_number, **lead_lookup.get_all_audio_urls_for_lead(lead)})
+
+    def all_audio_fast():
+        lead = pick()
+        return vicidial._json_response(vicidial._lead_urls_json(lead.phone_number, lead, None)).body
+
+    assert json.loads(random_audio_schema()).keys() == json.loads(random_audio_fast()).keys()
+    return {
+        "random_audio_schema": _time(random_audio_schema, iterations),
+        "random_audio_fast": _time(random_audio_fast, iterations),
+        "all_audio_schema": _time(all_audio_schema, iterations),
+        "all_audio_fast": _time(all_audio_fast, iterations),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=100000)
+    parser.add_argument("--leads", type=int, default=1000, help="distinct leads to cycle through")
+    options = parser.parse_args()
+    for name, stats in run(options.iterations, options.leads).items():
+        print(f"{name:22} p50 {stats['p50_us']:8.2f} us  p99 {stats['p99_us']:8.2f} us  mean {stats['mean_us']:8.2f} us")
+
+
+if __name__ == "__main__":
+    main()
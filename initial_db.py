@@ -1,10 +1,111 @@
 import logging
-from app.db.session import engine
-from app.models.lead import Base # Import the Base from your model file
+from sqlalchemy import text
+from app.db.session import engine, SessionLocal
+from app.models.lead import Base, Generation # Import the Base from your model file
+from app.crud import lead as lead_crud
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# create_all only creates missing tables, so columns and indexes added to existing
+# tables are applied here. Every statement must be safe to run more than once.
+SCHEMA_UPGRADES = [
+    "ALTER TABLE leads ADD COLUMN IF NOT EXISTS deal_order INTEGER",
+    "ALTER TABLE leads ADD COLUMN IF NOT EXISTS play_count INTEGER NOT NULL DEFAULT 0",
+    "ALTER TABLE leads ADD COLUMN IF NOT EXISTS last_played_at TIMESTAMP WITH TIME ZONE",
+    "CREATE INDEX IF NOT EXISTS ix_leads_generation_deal_order ON leads (generation_no, deal_order)",
+    # Keyset pagination needs every lead to have a created_at.
+    "UPDATE leads SET created_at = now() WHERE created_at IS NULL",
+    "CREATE INDEX IF NOT EXISTS ix_leads_created_at_id ON leads (created_at, id)",
+    "CREATE INDEX IF NOT EXISTS ix_leads_phone_number_pattern ON leads (phone_number text_pattern_ops)",
+    # Imports used to leave the live tables with their staging copies' index and
+    # constraint names (leads_staging_pkey, ...), so the ix_* indexes above were built
+    # again next to them. Drop those copies where the named index exists, and give the
+    # keys their names back.
+    """
+    DO $$
+    DECLARE
+        found record;
+    BEGIN
+        FOR found IN
+            SELECT c.relname AS index_name
+            FROM pg_index AS i
+            JOIN pg_class AS c ON c.oid = i.indexrelid
+            JOIN pg_class AS t ON t.oid = i.indrelid
+            WHERE t.relname IN ('leads', 'lead_details', 'generation_cursors', 'generations')
+              AND c.relname LIKE t.relname || '\\_staging\\_%'
+              AND NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conindid = i.indexrelid)
+              AND EXISTS (
+                  SELECT 1
+                  FROM pg_index AS other
+                  JOIN pg_class AS other_c ON other_c.oid = other.indexrelid
+                  WHERE other.indrelid = i.indrelid
+                    AND other_c.relname NOT LIKE t.relname || '\\_staging\\_%'
+                    AND regexp_replace(pg_get_indexdef(other.indexrelid), '^(CREATE (UNIQUE )?INDEX) \\S+ ON \\S+', '\\1')
+                      = regexp_replace(pg_get_indexdef(i.indexrelid), '^(CREATE (UNIQUE )?INDEX) \\S+ ON \\S+', '\\1')
+              )
+        LOOP
+            EXECUTE format('DROP INDEX %I', found.index_name);
+        END LOOP;
+        FOR found IN
+            SELECT t.relname AS table_name, k.conname, t.relname || substr(k.conname, length(t.relname) + 9) AS new_name
+            FROM pg_constraint AS k
+            JOIN pg_class AS t ON t.oid = k.conrelid
+            WHERE t.relname IN ('leads', 'lead_details', 'generation_cursors', 'generations')
+              AND k.contype IN ('p', 'u', 'f')
+              AND k.conname LIKE t.relname || '\\_staging\\_%'
+        LOOP
+            -- Key indexes share the schema's namespace; a replaced table may still hold the name.
+            IF found.conname LIKE '%\\_fkey' OR to_regclass(found.new_name) IS NULL THEN
+                EXECUTE format('ALTER TABLE %I RENAME CONSTRAINT %I TO %I', found.table_name, found.conname, found.new_name);
+            END IF;
+        END LOOP;
+    END $$
+    """,
+    # lead_data and the LLM text moved from leads to lead_details (created by create_all).
+    # The dropped columns' space is reclaimed by the next full import, which builds a
+    # fresh leads table, or by VACUUM FULL leads.
+    """
+    DO $$
+    BEGIN
+        IF EXISTS (SELECT 1 FROM information_schema.columns WHERE table_name = 'leads' AND column_name = 'lead_data') THEN
+            INSERT INTO lead_details (lead_id, lead_data,
+                llm_input_no_amd, llm_output_no_amd, llm_input_amd, llm_output_amd,
+                llm_input_transfer, llm_output_transfer, llm_input_voicemail, llm_output_voicemail)
+            SELECT id, lead_data,
+                llm_input_no_amd, llm_output_no_amd, llm_input_amd, llm_output_amd,
+                llm_input_transfer, llm_output_transfer, llm_input_voicemail, llm_output_voicemail
+            FROM leads
+            ON CONFLICT (lead_id) DO NOTHING;
+            ALTER TABLE leads
+                DROP COLUMN lead_data,
+                DROP COLUMN llm_input_no_amd, DROP COLUMN llm_output_no_amd,
+                DROP COLUMN llm_input_amd, DROP COLUMN llm_output_amd,
+                DROP COLUMN llm_input_transfer, DROP COLUMN llm_output_transfer,
+                DROP COLUMN llm_input_voicemail, DROP COLUMN llm_output_voicemail;
+        END IF;
+    END $$
+    """,
+]
+
+def upgrade_db() -> None:
+    logger.info("Applying schema upgrades to existing tables...")
+    with engine.begin() as connection:
+        for statement in SCHEMA_UPGRADES:
+            connection.execute(text(statement))
+    logger.info("Schema upgrades applied successfully.")
+
+def populate_generations() -> None:
+    # Deployments imported before the generations catalog existed get it built once here.
+    db = SessionLocal()
+    try:
+        if db.query(Generation).first() is None:
+            logger.info("Building the generations catalog from the leads table...")
+            lead_crud.refresh_generations(db)
+            db.commit()
+    finally:
+        db.close()
+
 def init_db() -> None:
     try:
         logger.info("Creating all database tables...")
@@ -17,4 +118,6 @@ def init_db() -> None:
         raise
 
 if __name__ == "__main__":
-    init_db()
\ No newline at end of file
+    init_db()
+    upgrade_db()
+    populate_generations()
\ No newline at end of file